@@ -1,21 +1,57 @@
 import cv2
 import os
+import json
+import time
+import argparse
+from functools import partial
 from tqdm import tqdm 
 import sys 
 
 # Import config locale
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from config_local import INPUT_ROTATOR_PATH
+from common.config import setting, RESIZE_FACTOR, FRAME_SKIP
+from common.transforms import prepare_frame
+from common.parallel import run_parallel, print_summary, failed_result
+from common.chunking import open_at, run_chunked
+from common.reader import FrameReader
+from common.prefetch import Prefetcher
+from common.video_io import open_writer, output_name, list_videos, encoder_settings
+from common import filtergraph, metrics
+from common.manifest import write_manifest
+from common.build_cache import BuildCache
+from common.staging import run_staged, SCRATCH_DIR
+from common.work_queue import job_key
 
 # --- CONFIGURATION ---
-INPUT_FOLDER = INPUT_ROTATOR_PATH 
+INPUT_FOLDER = setting('INPUT_ROTATOR_PATH', None)
 OUTPUT_FOLDER = r"output_preprocessed" 
+ROTATION_FILE = "rotation_choices.json"  # Scelte di rotazione (lette anche da 03_fused_pipeline)
+MANIFEST_FILE = "manifest_rotate.json"   # Job della fase 2 eseguibili senza GUI (headless/run_manifest.py)
 
-# SETTINGS OTTIMIZZAZIONE
-RESIZE_FACTOR = 0.5  # 0.5 = Dimezza risoluzione (1080p -> 540p)
-FRAME_SKIP = 2       # 2 = 30fps (da 60fps originali)
+# SETTINGS OTTIMIZZAZIONE (RESIZE_FACTOR e FRAME_SKIP in common/config.py, condivisi con fused.py)
+NUM_WORKERS = 1      # Video elaborati in parallelo nella fase 2 (sovrascrivibile con --workers N)
+NUM_CHUNKS = 1       # >1 = ogni video diviso in blocchi di frame elaborati in parallelo (--chunks N)
 # ---------------------
 
+def save_rotation_choices(choices):
+    """ Salva le scelte di rotazione (unite a quelle delle sessioni precedenti) """
+    saved = {}
+    if os.path.exists(ROTATION_FILE):
+        with open(ROTATION_FILE, 'r') as f:
+            saved = json.load(f)
+    saved.update(choices)
+    with open(ROTATION_FILE, 'w') as f:
+        json.dump(saved, f, indent=4)
+
+def export_manifest(rotation_map):
+    """ Salva le scelte della sessione come manifest per headless/run_manifest.py """
+    jobs = [{'file': video_file, 'rotate': should_rotate} for video_file, should_rotate in rotation_map.items()]
+    write_manifest(MANIFEST_FILE, 'rotate', jobs, {'RESIZE_FACTOR': RESIZE_FACTOR, 'FRAME_SKIP': FRAME_SKIP})
+
+def jobs_from_manifest(entries):
+    """ Job della fase 2 dalle voci di un manifest (cartelle di INPUT_FOLDER / OUTPUT_FOLDER) """
+    return build_jobs([e['file'] for e in entries], {e['file']: e['rotate'] for e in entries})
+
 def get_user_choices(files):
     """ Fase 1: Check Visivo Rapido """
     choices = {}
@@ -26,14 +62,14 @@ def get_user_choices(files):
     print(" [ESC]   -> Esci")
     print("="*60 + "\n")
     
+    # I video successivi vengono aperti in background mentre si valuta quello corrente
+    prefetch = Prefetcher([os.path.join(INPUT_FOLDER, f) for f in files])
+
     for i, video_file in enumerate(files):
         path_in = os.path.join(INPUT_FOLDER, video_file)
-        cap = cv2.VideoCapture(path_in)
-        if not cap.isOpened(): continue
-        
-        ret, frame = cap.read()
-        cap.release()
-        if not ret: continue
+        preview = prefetch.get(path_in)
+        if preview is None: continue
+        frame = preview['frames'][0]
 
         # Resize per anteprima
         preview_h = 600
@@ -67,84 +103,214 @@ def get_user_choices(files):
                 choices[video_file] = rotate_flag
                 break
             elif key == 27: # Esc
+                prefetch.close()
                 cv2.destroyAllWindows()
                 sys.exit("Uscita forzata.")
     
+    prefetch.close()
     cv2.destroyAllWindows()
     return choices
 
-def main():
-    if not os.path.exists(OUTPUT_FOLDER):
-        os.makedirs(OUTPUT_FOLDER)
-
-    files = [f for f in os.listdir(INPUT_FOLDER) if f.lower().endswith(('.mp4', '.mov', '.avi'))]
-    if not files:
-        print(f"ERRORE: Nessun video trovato in: {INPUT_FOLDER}")
-        return
+def process_range(path_in, path_outs, start, end, desc_text, should_rotate, position=0):
+    """ Fase 2 sui frame [start, end) di un video (end=None: fino alla fine).
+    Ritorna le statistiche del job (mai un'eccezione). """
+    t_start = time.time()
+    stats = {'file': os.path.basename(path_in), 'ok': False, 'frames': 0, 'seconds': 0.0, 'error': None,
+             'start': start, 'written': [0]}
 
-    # --- FASE 1 ---
-    rotation_map = get_user_choices(files)
+    cap = open_at(path_in, start)
+    # Indice globale del frame: con start multiplo di FRAME_SKIP lo skipping dei blocchi
+    # coincide con quello dell'elaborazione sequenziale. I frame scartati vengono solo
+    # "grabbati" (niente retrieve/conversione colore) dal thread del decoder
+    reader = FrameReader(cap, start, end, FRAME_SKIP)
+    out = None
+    timer = metrics.StageTimer()
+    try:
+        if not cap.isOpened():
+            raise IOError(f"Impossibile aprire {path_in}")
 
-    print("\n" + "="*60)
-    print(" FASE 2: ELABORAZIONE BATCH")
-    print(" Siediti e rilassati. Sto lavorando.")
-    print("="*60)
-
-    # --- FASE 2 ---
-    for i, video_file in enumerate(files):
-        if video_file not in rotation_map: continue
-        
-        should_rotate = rotation_map[video_file]
-        path_in = os.path.join(INPUT_FOLDER, video_file)
-        path_out = os.path.join(OUTPUT_FOLDER, f"proc_{video_file}")
-
-        cap = cv2.VideoCapture(path_in)
-        
         # Info video
         w_orig = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         h_orig = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         fps_orig = cap.get(cv2.CAP_PROP_FPS)
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if end is not None: total_frames = min(end, total_frames)
 
         new_w = int(w_orig * RESIZE_FACTOR)
         new_h = int(h_orig * RESIZE_FACTOR)
         new_fps = fps_orig / FRAME_SKIP
 
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(path_out, fourcc, new_fps, (new_w, new_h))
-
-        # Descrizione azione per la barra
-        action_tag = "[ROT]" if should_rotate else "[STD]"
-        desc_text = f"Video {i+1}/{len(files)} {action_tag}"
-
-        count = 0
+        out = open_writer(path_outs[0], new_fps, (new_w, new_h))
         
         # --- QUI C'È LA BARRA DI PROGRESSO ---
         # total=total_frames permette di calcolare la %
         # unit='fr' indica che contiamo frame
-        with tqdm(total=total_frames, desc=desc_text, unit='fr', ncols=100) as pbar:
+        # position = riga fissa del worker quando si lavora in parallelo
+        with tqdm(total=total_frames - start, desc=desc_text, unit='fr', ncols=100,
+                  position=position, leave=(position == 0)) as pbar:
             while True:
-                ret, frame = cap.read()
+                # Attesa del frame decodificato in background (frame skip compreso)
+                ret, frame = reader.read()
+                timer.mark('decode')
+                pbar.update(reader.frames - pbar.n)
                 if not ret: break
-                
-                # Scriviamo solo se il frame è quello giusto (Frame Skipping)
-                if count % FRAME_SKIP == 0:
-                    if should_rotate:
-                        frame = cv2.rotate(frame, cv2.ROTATE_180)
-                    
-                    resized_frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_AREA)
-                    out.write(resized_frame)
-
-                count += 1
-                pbar.update(1) # Aggiorna la barra di 1 frame
+                resized_frame = prepare_frame(frame, should_rotate, (new_w, new_h))
+                timer.mark('transform')
+                out.write(resized_frame)
+                timer.mark('write')
+                stats['written'][0] += 1
+                timer.skip()
+
+        stats['frames'] = reader.frames
+        stats['ok'] = stats['frames'] > 0
+        if not stats['ok']:
+            stats['error'] = "Nessun frame decodificato"
+    except Exception as e:
+        stats['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        reader.release()
+        if out is not None: out.release()
+        timer.mark('flush')
+
+    stats['seconds'] = time.time() - t_start
+    stats['timings'] = timer.as_dict()
+    return stats
+
+def process_video(path_in, path_out, should_rotate, desc_text, position=0):
+    """ Fase 2 per un singolo video intero """
+    return process_range(path_in, [path_out], 0, None, desc_text, should_rotate, position=position)
+
+def offload_video(path_in, path_out, should_rotate, desc_text, position=0):
+    """ Fase 2 per un singolo video eseguita interamente da un filtergraph ffmpeg (--offload) """
+    cap = cv2.VideoCapture(path_in)
+    if not cap.isOpened():
+        return failed_result(path_in, f"Impossibile aprire {path_in}")
+    w_orig = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    h_orig = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps_orig = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    new_size = (int(w_orig * RESIZE_FACTOR), int(h_orig * RESIZE_FACTOR))
+    new_fps = fps_orig / FRAME_SKIP
+    graph = filtergraph.rotate_graph(FRAME_SKIP, new_size, should_rotate, new_fps)
+    stats = filtergraph.run_graph(path_in, graph, [path_out], new_fps, -(-total_frames // FRAME_SKIP),
+                                  desc_text, position=position)
+    if stats['ok']: stats['frames'] = total_frames
+    return stats
+
+def build_jobs(files, rotation_map):
+    """ Job (path_in, path_out, should_rotate, desc_text) dei video con una scelta di rotazione """
+    jobs = []
+    for i, video_file in enumerate(files):
+        if video_file not in rotation_map: continue
         
-        cap.release()
-        out.release()
+        should_rotate = rotation_map[video_file]
+        path_in = os.path.join(INPUT_FOLDER, video_file)
+        path_out = output_name(os.path.join(OUTPUT_FOLDER, f"proc_{video_file}"))
+
+        # Descrizione azione per la barra
+        action_tag = "[ROT]" if should_rotate else "[STD]"
+        desc_text = f"Video {i+1}/{len(files)} {action_tag}"
+        jobs.append((path_in, path_out, should_rotate, desc_text))
+    return jobs
+
+def cache_entry(job):
+    """ (chiave, input, parametri, output) del job per la cache incrementale """
+    path_in, path_out, should_rotate, _ = job
+    params = dict(encoder_settings(), rotate=should_rotate, RESIZE_FACTOR=RESIZE_FACTOR, FRAME_SKIP=FRAME_SKIP)
+    return job_key('rotate', os.path.basename(path_in)), path_in, params, [path_out]
+
+def process_job(job, args):
+    """ Un job della fase 2 nella modalità scelta da args (--chunks / --offload) """
+    path_in, path_out, should_rotate, desc_text = job
+    if args.chunks > 1:
+        return run_chunked(partial(process_range, should_rotate=should_rotate), path_in, [path_out],
+                           desc_text, args.chunks, align=FRAME_SKIP)
+    return (offload_video if args.offload else process_video)(*job)
+
+def run_batch(jobs, args):
+    """ Fase 2: elabora i job non aggiornati nella cache (senza GUI) e ritorna le statistiche per video """
+    cache = BuildCache(OUTPUT_FOLDER)
+    entries = [cache_entry(job) for job in jobs]
+    todo = cache.pending(entries)
+    jobs, entries = [jobs[i] for i in todo], {os.path.basename(entries[i][1]): entries[i] for i in todo}
+
+    def job_done(r):
+        # Record delle metriche appena il video è finito: un batch interrotto conserva i precedenti
+        metrics.record('rotate', r)
+        if r['ok']: cache.record(*entries[r['file']])
+
+    profiler = metrics.start_profiler(args.profile)
+    workers = max(1, min(args.workers, len(jobs)))
+    if workers > 1 and args.chunks <= 1:
+        if SCRATCH_DIR is not None:
+            print("ATTENZIONE: lo staging su SCRATCH_DIR elabora un video alla volta, ignorato con --workers.")
+        results = run_parallel(offload_video if args.offload else process_video, jobs, workers, job_done)
+    else:
+        # Un video alla volta (con --chunks ciascuno su più core), input e output in staging
+        results = run_staged(jobs, lambda job: (job[0], [job[1]]),
+                             lambda job, path_in, path_outs: process_job((path_in, path_outs[0]) + job[2:], args),
+                             lambda job, r: job_done(r))
+    metrics.stop_profiler(profiler, OUTPUT_FOLDER, 'rotate')
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Rotazione, resize e frame skip dei video grezzi")
+    parser.add_argument('--workers', type=int, default=NUM_WORKERS,
+                        help="Numero di video elaborati in parallelo nella fase 2")
+    parser.add_argument('--chunks', type=int, default=NUM_CHUNKS,
+                        help="Divide ogni video in N blocchi temporali elaborati in parallelo (video lunghi)")
+    parser.add_argument('--offload', action='store_true',
+                        help="Fase 2 eseguita da un filtergraph ffmpeg invece che dal loop Python")
+    parser.add_argument('--profile', action='store_true',
+                        help="Profiler a campionamento sulla fase 2 (profilo salvato nella cartella di output)")
+    parser.add_argument('--setup-only', action='store_true',
+                        help=f"Solo fase 1: salva {MANIFEST_FILE} per eseguire la fase 2 altrove")
+    args = parser.parse_args()
+    if args.offload and not filtergraph.available():
+        print("ATTENZIONE: ffmpeg non trovato, --offload ignorato.")
+        args.offload = False
+    if args.offload and args.chunks > 1:
+        print("ATTENZIONE: con --offload ogni video è un unico processo ffmpeg (già multi-thread), --chunks ignorato.")
+        args.chunks = 1
+    if args.profile and (args.workers > 1 or args.chunks > 1):
+        print("ATTENZIONE: il profiler campiona solo questo processo, --workers/--chunks ignorati.")
+        args.workers = args.chunks = 1
+
+    if INPUT_FOLDER is None:
+        print("ERRORE: definisci INPUT_ROTATOR_PATH in config_local.py")
+        return
+    if not os.path.exists(OUTPUT_FOLDER):
+        os.makedirs(OUTPUT_FOLDER)
+
+    files = list_videos(INPUT_FOLDER)
+    if not files:
+        print(f"ERRORE: Nessun video trovato in: {INPUT_FOLDER}")
+        return
+
+    # --- FASE 1 ---
+    rotation_map = get_user_choices(files)
+    save_rotation_choices(rotation_map)
+    export_manifest(rotation_map)
+    if args.setup_only:
+        print(f"Fase 2 rimandata: python headless/run_manifest.py {MANIFEST_FILE} --input ... --output ...")
+        return
 
     print("\n" + "="*60)
-    print(" TUTTO COMPLETATO CON SUCCESSO!")
-    print(" Ora puoi lanciare lo script 01_video_cropper.")
+    print(" FASE 2: ELABORAZIONE BATCH")
+    print(" Siediti e rilassati. Sto lavorando.")
     print("="*60)
 
+    # --- FASE 2 ---
+    results = run_batch(build_jobs(files, rotation_map), args)
+    print_summary(results)
+
+    if all(r['ok'] for r in results):
+        print("\n" + "="*60)
+        print(" TUTTO COMPLETATO CON SUCCESSO!")
+        print(" Ora puoi lanciare lo script 01_video_cropper.")
+        print("="*60)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,26 +2,52 @@ import cv2
 import numpy as np
 import os
 import pandas as pd
-import json
 from string import ascii_uppercase
 import sys
+import time
+import argparse
+from functools import partial
 from tqdm import tqdm 
 
 # Import path dai settings locali
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from config_local import INPUT_CROPPER_PATH, OUTPUT_CROPPER_PATH, EXCEL_META_PATH 
+from common.config import setting, VIDEO_FPS
+from common.video_io import AsyncVideoWriter, release_all, open_writer, output_name, list_videos, encoder_time, \
+    encoder_settings, frame_shape
+from common import metrics
+from common.chunking import open_at, run_chunked
+from common.parallel import failed_result
+from common.reader import FrameReader
+from common.shm_crop import crop_shared
+from common.motion import open_gates, written_counts, motion_settings
+from common.drift import load_or_estimate, frame_shifts, crop_windows, inside_frame, pad_crop
+from common.frame_cache import FrameCache, ScrubView
+from common.prefetch import Prefetcher
+from common.checkpoint import CHECKPOINT_INTERVAL, load_jobs, save_jobs, run_checkpointed
+from common.manifest import write_manifest
+from common.build_cache import BuildCache, CACHE_DIR
+from common.staging import run_staged
+from common.work_queue import job_key
+from common.wells import propose_layout
 
 # --- CONFIGURATION ---
-VIDEO_PATH = INPUT_CROPPER_PATH
-OUTPUT_PATH = OUTPUT_CROPPER_PATH
-EXCEL_PATH = EXCEL_META_PATH
-PROGRESS_FILE = "progress_drift.json"
+VIDEO_PATH = setting('INPUT_CROPPER_PATH', None)
+OUTPUT_PATH = setting('OUTPUT_CROPPER_PATH', None)
+EXCEL_PATH = setting('EXCEL_META_PATH', None)
+JOBS_FILE = "jobs_drift.json"  # Coda dei job configurati, salvata a ogni 's' (ripresa dopo un crash)
+MANIFEST_FILE = "manifest_drift.json"  # Job della fase 2 eseguibili senza GUI (headless/run_manifest.py)
 
-# --- EXPERIMENT SETTINGS ---
+# --- EXPERIMENT SETTINGS --- (VIDEO_FPS in common/config.py, condiviso con fused.py)
 NUM_BOXES = 15           
 COL_PREFIX = "Pos"       
-VIDEO_FPS = 60
 SCALE_FACTOR = 1.5       
+ENCODER_QUEUE = 32       # Frame in coda per ogni encoder (thread dedicato per soggetto); 0 = scrittura sincrona
+NUM_CHUNKS = 1           # >1 = ogni video diviso in blocchi di frame elaborati in parallelo (--chunks N)
+CROP_PROCESSES = 0       # >1 = crop ed encoder divisi su N processi, frame in memoria condivisa (--crop-procs N)
+DRIFT_KEYFRAME_STEP = 60 # Drift automatico: un keyframe registrato ogni N frame
+DRIFT_SCALE = 0.25       # Drift automatico: risoluzione di lavoro della phase correlation
+AUTO_LAYOUT = True       # Propone i box dei pozzetti rilevati sul primo frame (tasto 'g' per accettarli)
+MOTION_GATE = False      # True = per ogni soggetto scarta i frame fermi e scrive <clip>_frames.csv (common/motion.py)
 # ---------------------------
 
 POS_COLUMNS = [f"{COL_PREFIX}{i}" for i in range(1, NUM_BOXES + 1)]
@@ -29,24 +55,22 @@ POS_COLUMNS = [f"{COL_PREFIX}{i}" for i in range(1, NUM_BOXES + 1)]
 np.random.seed(42)
 COLORS = np.random.randint(0, 255, size=(NUM_BOXES, 3), dtype=np.uint8).tolist()
 
-def load_progress():
-    if os.path.exists(PROGRESS_FILE):
-        with open(PROGRESS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_progress(data):
-    with open(PROGRESS_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
-
 def get_video_files(folder):
-    return [f for f in os.listdir(folder) if f.lower().endswith(('.mp4', '.mov', '.avi'))]
+    return list_videos(folder)
+
+def end_frame(total_frames):
+    """ Frame mostrato dal tasto 'e' per il controllo del drift """
+    return total_frames - 100 if total_frames > 100 else 0
 
 def mouse_callback(event, x, y, flags, param):
     state = param['state']
     real_x = int(x / SCALE_FACTOR)
     real_y = int(y / SCALE_FACTOR)
 
+    # Ridisegno solo per gli eventi che cambiano qualcosa a schermo
+    if event == cv2.EVENT_LBUTTONDOWN or (event == cv2.EVENT_MOUSEMOVE and state['drawing']):
+        state['dirty'] = True
+
     if state['mode'] == 'DRAW_BOX':
         if event == cv2.EVENT_LBUTTONDOWN:
             if not state['drawing']:
@@ -85,15 +109,216 @@ def load_csv_smart(path):
     print("ERRORE COLONNA: Non trovo la colonna 'Original_Name' nel CSV.")
     return None
 
+def output_paths(job):
+    """ Percorsi delle clip di output di un job, nell'ordine dei box """
+    clean_name_for_output = os.path.splitext(job['file'])[0]
+    return [output_name(os.path.join(OUTPUT_PATH, f"{sub_name}_{clean_name_for_output}.mp4"))
+            for sub_name in job['subjects']]
+
+def cache_entry(job):
+    """ (chiave, input, parametri, output) del job per la cache incrementale """
+    params = dict(encoder_settings(), job=job, VIDEO_FPS=VIDEO_FPS, motion=motion_settings() if MOTION_GATE else False)
+    if job.get('auto_drift', False):
+        params.update(DRIFT_KEYFRAME_STEP=DRIFT_KEYFRAME_STEP, DRIFT_SCALE=DRIFT_SCALE)
+    return job_key('crop_drift', job['file']), os.path.join(VIDEO_PATH, job['file']), params, output_paths(job)
+
+def drift_cache_dir():
+    """ Traiettorie automatiche in cache nella cartella di output, non accanto ai video di input """
+    return os.path.join(OUTPUT_PATH, CACHE_DIR)
+
+def processed_videos(files):
+    """ Video già ritagliati così come sono ora su disco (saltati nel setup) """
+    cache = BuildCache(OUTPUT_PATH)
+    return {f for f in files if cache.done_input(job_key('crop_drift', f), os.path.join(VIDEO_PATH, f))}
+
+def crop_range(video_path, path_outs, start, end, desc_text, boxes, total_drift, drift_calculated,
+               trajectory=None, position=0, procs=CROP_PROCESSES):
+    """ Scrive i crop (con drift) dei frame [start, end) (end=None: fino alla fine), un file per box.
+    trajectory: traiettoria automatica dell'intero video (al posto del modello lineare), già
+    stimata da process_job """
+    t_start = time.time()
+    timer = metrics.StageTimer()
+    cap = open_at(video_path, start)
+    # Numero di frame dell'INTERO video: l'interpolazione del drift usa l'indice globale
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    last_frame = total_frames if end is None else min(end, total_frames)
+    img_w, img_h = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    # Finestre di crop di tutti i frame del blocco calcolate una volta sola (frame x box x 4):
+    # nel loop restano solo indicizzazione e slicing
+    timer.skip()
+    shifts = frame_shifts(start, max(last_frame, start + 1), total_frames, total_drift, drift_calculated, trajectory)
+    windows = crop_windows(boxes, shifts)
+    inside = inside_frame(windows, img_w, img_h)
+    n_rows = len(windows)
+    timer.mark('transform')
+    reader = FrameReader(cap, start, end)  # decodifica su un thread dedicato
+
+    # Preparazione Writers (con procs > 1 li aprono i processi worker)
+    writers = []
+    gates = open_gates(path_outs, cap.get(cv2.CAP_PROP_FPS), MOTION_GATE and procs <= 1)
+    for box, out_full, gate in zip(boxes, path_outs if procs <= 1 else [], gates):
+        x1, y1, x2, y2 = box
+        w_box, h_box = x2 - x1, y2 - y1
+        writer = open_writer(out_full, VIDEO_FPS, (w_box, h_box))
+        if ENCODER_QUEUE > 0:
+            writer = AsyncVideoWriter(writer, ENCODER_QUEUE)
+        # Buffer per le finestre che escono dal frame (bordo nero invece del resize)
+        writers.append({'writer': writer, 'pad': np.zeros(frame_shape(h_box, w_box), dtype=np.uint8), 'gate': gate})
+
+    # Loop di scrittura: il decoder lavora qui, i 15 encoder sui loro thread
+    count = start
+    written = None
+    timer.skip()
+    try:
+        with tqdm(total=last_frame - start, desc=desc_text, unit='frame', leave=(position == 0),
+                  position=position) as pbar:
+            if procs > 1:
+                frames, written = crop_shared(reader, windows, inside, path_outs, VIDEO_FPS, procs, ENCODER_QUEUE,
+                                              timer, pbar, start=start, motion=MOTION_GATE)
+                count += frames
+            else:
+                while True:
+                    ret, frame = reader.read()
+                    timer.mark('decode')
+                    if not ret: break
+                    # Riga della tabella (oltre il numero di frame dichiarato vale l'ultima)
+                    k = min(count - start, n_rows - 1)
+                    count += 1
+                    row, row_inside = windows[k].tolist(), inside[k].tolist()
+
+                    for item, (x1, y1, x2, y2), ok in zip(writers, row, row_inside):
+                        if ok:
+                            crop = frame[y1:y2, x1:x2]
+                        else:
+                            crop = pad_crop(frame, (x1, y1, x2, y2), item['pad'])
+                        timer.mark('transform')
+                        if item['gate'] is not None and not item['gate'].keep(crop, count - 1):
+                            continue
+
+                        item['writer'].write(crop)
+                        timer.mark('write')
+                    pbar.update(1)
+                    timer.skip()
+    finally:
+        # Flush e chiusura di tutti gli encoder anche in caso di errore
+        reader.release()
+        release_all(writers)
+        for gate in gates:
+            if gate is not None: gate.close()
+        timer.mark('flush')
+        timer.add('encode_threads', encoder_time(writers))
+
+    n = count - start
+    if written is None: written = written_counts(gates, n)
+    return {'file': os.path.basename(video_path), 'ok': n > 0, 'frames': n, 'seconds': time.time() - t_start,
+            'error': None if n > 0 else "Nessun frame decodificato", 'start': start, 'written': written,
+            'timings': timer.as_dict()}
+
+def export_manifest(jobs_queue):
+    """ Salva la coda come manifest per headless/run_manifest.py """
+    settings = {'VIDEO_FPS': VIDEO_FPS, 'DRIFT_KEYFRAME_STEP': DRIFT_KEYFRAME_STEP, 'DRIFT_SCALE': DRIFT_SCALE,
+                'MOTION_GATE': MOTION_GATE}
+    write_manifest(MANIFEST_FILE, 'crop_drift', jobs_queue, settings)
+
+def jobs_from_manifest(entries):
+    """ Job della fase 2 dalle voci di un manifest (stesso formato della coda) """
+    return [dict(e) for e in entries]
+
+def process_job(job, args, video_path=None, path_outs=None):
+    """ Un job della fase 2 nella modalità scelta da args (--chunks / --checkpoint).
+    video_path / path_outs sostituiscono quelli del job (copie locali dello staging) """
+    video_file = job['file']
+    video_path = video_path or os.path.join(VIDEO_PATH, video_file)
+    path_outs = path_outs or output_paths(job)
+    # Traiettoria automatica stimata una volta sola (o dalla cache nella cartella di output),
+    # non da ogni blocco di --chunks in parallelo; letta dalla copia locale se c'è staging
+    t_start = time.time()
+    trajectory = None
+    if job.get('auto_drift', False):
+        try:
+            trajectory = load_or_estimate(video_path, DRIFT_KEYFRAME_STEP, DRIFT_SCALE, drift_cache_dir())
+        except Exception as e:
+            return failed_result(video_path, f"Stima del drift: {type(e).__name__}: {e}")
+    estimate_seconds = time.time() - t_start
+    drift_args = {'boxes': job['boxes'], 'total_drift': job['drift'], 'drift_calculated': job['drift_calculated'],
+                  'trajectory': trajectory}
+    if args.chunks > 1:
+        result = run_chunked(partial(crop_range, **drift_args), video_path, path_outs,
+                             f"Processing {video_file}", args.chunks)
+    else:
+        result = run_checkpointed(partial(crop_range, procs=args.crop_procs, **drift_args), video_path, path_outs,
+                                  f"Processing {video_file}", args.checkpoint, params=job)
+    if trajectory is not None:
+        result['timings'] = dict(result.get('timings') or {}, drift_estimate=round(estimate_seconds, 3))
+    return result
+
+def run_batch(jobs_queue, args, jobs_file=None):
+    """ Fase 2: elabora i job non aggiornati nella cache (senza GUI), registrando quelli completati.
+    jobs_file: coda interattiva da cui togliere i job completati (None per il manifest headless) """
+    cache = BuildCache(OUTPUT_PATH)
+    entries = [cache_entry(job) for job in jobs_queue]
+    todo = cache.pending(entries)
+    jobs_queue, entries = [jobs_queue[i] for i in todo], {jobs_queue[i]['file']: entries[i] for i in todo}
+    processed_files = set()
+
+    def job_done(job, result):
+        # Esito definitivo del job (con lo staging, chiamata dal thread che sposta gli output):
+        # metriche scritte subito, cache e coda aggiornate per i video completati
+        metrics.record('crop_drift', result)
+        if not result['ok']:
+            return
+        video_file = job['file']
+        processed_files.add(video_file)
+        cache.record(*entries[video_file])
+        if jobs_file:
+            save_jobs(jobs_file, [j for j in jobs_queue if j['file'] not in processed_files])
+        print(f"Completato: {video_file}")
+
+    profiler = metrics.start_profiler(args.profile)
+    results = run_staged(jobs_queue, lambda job: (os.path.join(VIDEO_PATH, job['file']), output_paths(job)),
+                         lambda job, path_in, path_outs: process_job(job, args, path_in, path_outs), job_done)
+    metrics.stop_profiler(profiler, OUTPUT_PATH, 'crop_drift')
+    return results
+
 def main():
+    parser = argparse.ArgumentParser(description="Crop dei soggetti con correzione del drift")
+    parser.add_argument('--chunks', type=int, default=NUM_CHUNKS,
+                        help="Divide ogni video in N blocchi temporali elaborati in parallelo (video lunghi)")
+    parser.add_argument('--checkpoint', type=int, default=CHECKPOINT_INTERVAL,
+                        help="Frame per segmento di checkpoint, per riprendere un video interrotto (0 = disattivato)")
+    parser.add_argument('--profile', action='store_true',
+                        help="Profiler a campionamento sulla fase 2 (profilo salvato nella cartella di output)")
+    parser.add_argument('--crop-procs', type=int, default=CROP_PROCESSES,
+                        help="Divide crop ed encoder dei soggetti su N processi (frame in memoria condivisa)")
+    parser.add_argument('--setup-only', action='store_true',
+                        help=f"Solo fase 1: salva {MANIFEST_FILE} per eseguire la fase 2 altrove")
+    args = parser.parse_args()
+    if args.profile and args.chunks > 1:
+        print("ATTENZIONE: il profiler campiona solo questo processo, --chunks ignorato.")
+        args.chunks = 1
+    if MOTION_GATE and (args.chunks > 1 or args.checkpoint > 0):
+        # Ogni blocco / segmento ripartirebbe senza il frame di riferimento: selezione diversa dal video intero
+        print("ATTENZIONE: MOTION_GATE confronta ogni frame con l'ultimo tenuto, --chunks/--checkpoint ignorati.")
+        args.chunks, args.checkpoint = 1, 0
+    if args.crop_procs > 1 and args.chunks > 1:
+        print("ATTENZIONE: --crop-procs non si combina con --chunks, ignorato.")
+        args.crop_procs = 0
+
+    if None in (VIDEO_PATH, OUTPUT_PATH, EXCEL_PATH):
+        print("ERRORE: definisci INPUT_CROPPER_PATH, OUTPUT_CROPPER_PATH e EXCEL_META_PATH in config_local.py")
+        return
     if not os.path.exists(OUTPUT_PATH): os.makedirs(OUTPUT_PATH)
     files = get_video_files(VIDEO_PATH)
-    processed_files = load_progress()
+    processed_files = processed_videos(files)
     df = load_csv_smart(EXCEL_PATH)
     if df is None: return 
 
-    # Coda dei lavori da processare dopo il setup
-    jobs_queue = []
+    # Coda dei lavori da processare dopo il setup (con quelli rimasti da una sessione precedente)
+    jobs_queue = [job for job in load_jobs(JOBS_FILE) if job['file'] not in processed_files]
+    queued = {job['file'] for job in jobs_queue}
+    if jobs_queue:
+        print(f"Ripresi {len(jobs_queue)} job salvati in {JOBS_FILE}")
 
     # --- LEGENDA TASTI SUL TERMINALE ---
     print("\n" + "=" * 60)
@@ -104,10 +329,13 @@ def main():
     print("  [Click] : Draw Box (2 clicks) OR Place Drift Point")
     print("  [ n ]   : Confirm Box")
     print("  [ z ]   : Undo (Last Box or Last Point)")
+    print("  [ g ]   : Accept Auto-detected Grid")
     print("-" * 60)
     print("  [ d ]   : DRIFT TOOL (Click Start -> 'e' -> Click End)")
+    print("  [ a ]   : AUTO DRIFT (Stima automatica on/off)")
     print("  [ e ]   : GO TO END (Check drift)")
     print("  [ r ]   : RESET VIEW (Go to start)")
+    print("  [Frame] : Trackbar to scrub through the video")
     print("-" * 60)
     print("  [ s ]   : SAVE CONFIG & NEXT VIDEO (No processing yet)")
     print("  [ Esc ] : Exit Setup & Start Processing Queued Jobs")
@@ -115,8 +343,12 @@ def main():
     # -----------------------------------
 
     # --- FASE 1: SETUP UTENTE (Tutti i video) ---
+    # Primo frame, frame finale e metadati dei prossimi video preparati in background
+    prefetch = Prefetcher([os.path.join(VIDEO_PATH, f) for f in files if f not in processed_files and f not in queued],
+                          extra_frames=lambda total: [end_frame(total)])
+
     for video_file in files:
-        if video_file in processed_files: continue
+        if video_file in processed_files or video_file in queued: continue
 
         search_name = video_file.replace("proc_", "").replace(".mp4", "").replace(".mov", "")
         search_name = os.path.splitext(search_name)[0]
@@ -128,31 +360,32 @@ def main():
         row = df[df['Original_Name'] == search_name].iloc[0]
         subjects = [str(row[col]) for col in POS_COLUMNS]
 
-        cap = cv2.VideoCapture(os.path.join(VIDEO_PATH, video_file))
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        # Frame letti tramite cache LRU + indice di scrubbing (niente seek/decode a ogni tick)
+        preview = prefetch.get(os.path.join(VIDEO_PATH, video_file))
+        if preview is None: continue
+        cache = FrameCache(os.path.join(VIDEO_PATH, video_file), info=preview)
+        total_frames = cache.total_frames
+        view = ScrubView(cache)
         
         state = {
             'mode': 'DRAW_BOX', 'drawing': False, 'start_point': (0,0), 'current_end': (0,0), 
-            'temp_box': None, 'boxes': [], 'drift_points': [], 'frame_idx': 0
+            'temp_box': None, 'boxes': [], 'drift_points': [],
+            'trajectory': None, 'dirty': True
         }
+        # Griglia dei pozzetti rilevata sul primo frame (None = bassa confidenza, box a mano)
+        state['proposal'] = propose_layout(preview['frames'][0], NUM_BOXES, video_file) if AUTO_LAYOUT else None
         drift_calculated = False
         total_drift = (0, 0)
 
         win_name = f"Setup ({len(jobs_queue)+1}): {video_file}"
         cv2.namedWindow(win_name)
         cv2.setMouseCallback(win_name, mouse_callback, {'state': state})
+        cv2.createTrackbar('Frame', win_name, 0, max(total_frames - 1, 1), view.seek)
         
         setup_completed = False
+        key = 255
 
         while True:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, state['frame_idx'])
-            ret, frame = cap.read()
-            if not ret: break
-
-            h, w = frame.shape[:2]
-            disp_w, disp_h = int(w * SCALE_FACTOR), int(h * SCALE_FACTOR)
-            display_frame = cv2.resize(frame, (disp_w, disp_h))
-
             # --- CALCOLO DRIFT ---
             if len(state['drift_points']) == 2:
                 p1, p2 = state['drift_points']
@@ -162,63 +395,88 @@ def main():
                 drift_calculated = False
                 total_drift = (0, 0)
 
-            # --- CALCOLO SPOSTAMENTO CORRENTE (LIVE PREVIEW) ---
-            current_shift_x, current_shift_y = 0, 0
-            if drift_calculated and total_frames > 0:
-                progress = state['frame_idx'] / total_frames
-                current_shift_x = int(total_drift[0] * progress)
-                current_shift_y = int(total_drift[1] * progress)
-
-            # 1. Disegna i box (DINAMICI)
-            for i, box in enumerate(state['boxes']):
-                bx1, by1, bx2, by2 = box
-                curr_x1 = bx1 + current_shift_x
-                curr_y1 = by1 + current_shift_y
-                curr_x2 = bx2 + current_shift_x
-                curr_y2 = by2 + current_shift_y
-                dx1, dy1, dx2, dy2 = [int(c * SCALE_FACTOR) for c in [curr_x1, curr_y1, curr_x2, curr_y2]]
+            # Si ricompone l'immagine solo quando cambia qualcosa (mouse, tasti, trackbar)
+            view.tick()
+            if state['dirty'] or view.dirty:
+                state['dirty'] = view.dirty = False
+                frame_idx, frame = view.frame()
+                if frame is None: break
+                display_frame = view.base(frame, frame_idx, SCALE_FACTOR)
+
+                # --- CALCOLO SPOSTAMENTO CORRENTE (LIVE PREVIEW) ---
+                current_shift_x, current_shift_y = 0, 0
+                if state['trajectory'] is not None:
+                    dx, dy = state['trajectory'][min(frame_idx, len(state['trajectory']) - 1)]
+                    current_shift_x, current_shift_y = int(round(dx)), int(round(dy))
+                elif drift_calculated and total_frames > 0:
+                    progress = frame_idx / total_frames
+                    current_shift_x = int(total_drift[0] * progress)
+                    current_shift_y = int(total_drift[1] * progress)
+
+                # 1. Disegna i box (DINAMICI)
+                for i, box in enumerate(state['boxes']):
+                    bx1, by1, bx2, by2 = box
+                    curr_x1 = bx1 + current_shift_x
+                    curr_y1 = by1 + current_shift_y
+                    curr_x2 = bx2 + current_shift_x
+                    curr_y2 = by2 + current_shift_y
+                    dx1, dy1, dx2, dy2 = [int(c * SCALE_FACTOR) for c in [curr_x1, curr_y1, curr_x2, curr_y2]]
                 
-                label_text = subjects[i] if i < len(subjects) else f"Box {i}"
-                cv2.rectangle(display_frame, (dx1, dy1), (dx2, dy2), COLORS[i % len(COLORS)], 2)
-                cv2.putText(display_frame, label_text, (dx1, dy1 - 5), 
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, COLORS[i % len(COLORS)], 2)
-
-            # 2. Disegna box in costruzione
-            if state['drawing']:
-                sx, sy = state['start_point']
-                ex, ey = state['current_end']
-                d_sx, d_sy = int(sx * SCALE_FACTOR), int(sy * SCALE_FACTOR)
-                d_ex, d_ey = int(ex * SCALE_FACTOR), int(ey * SCALE_FACTOR)
-                cv2.rectangle(display_frame, (d_sx, d_sy), (d_ex, d_ey), (0, 255, 255), 1)
-
-            # 3. Box temporaneo
-            if state['temp_box']:
-                bx1, by1, bx2, by2 = [int(c * SCALE_FACTOR) for c in state['temp_box']]
-                next_idx = len(state['boxes'])
-                preview_label = subjects[next_idx] if next_idx < len(subjects) else "..."
-                cv2.rectangle(display_frame, (bx1, by1), (bx2, by2), (0, 255, 255), 2)
-                cv2.putText(display_frame, f"Next: {preview_label}", (bx1, by1 - 5), 
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
-
-            # 4. Visualizzazione Drift
-            if len(state['drift_points']) > 0:
-                p1 = state['drift_points'][0]
-                cv2.circle(display_frame, (int(p1[0]*SCALE_FACTOR), int(p1[1]*SCALE_FACTOR)), 5, (0, 0, 255), -1)
-                if len(state['drift_points']) > 1:
-                    p2 = state['drift_points'][1]
-                    cv2.circle(display_frame, (int(p2[0]*SCALE_FACTOR), int(p2[1]*SCALE_FACTOR)), 5, (0, 0, 255), -1)
-                    cv2.line(display_frame, (int(p1[0]*SCALE_FACTOR), int(p1[1]*SCALE_FACTOR)), 
-                                            (int(p2[0]*SCALE_FACTOR), int(p2[1]*SCALE_FACTOR)), (0, 255, 0), 2)
-
-            # Info testo
-            info_txt = f"File: {video_file} | Box: {len(state['boxes'])}/{NUM_BOXES}"
-            if drift_calculated: 
-                info_txt += f" | Drift: OK"
+                    label_text = subjects[i] if i < len(subjects) else f"Box {i}"
+                    cv2.rectangle(display_frame, (dx1, dy1), (dx2, dy2), COLORS[i % len(COLORS)], 2)
+                    cv2.putText(display_frame, label_text, (dx1, dy1 - 5), 
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, COLORS[i % len(COLORS)], 2)
+
+                # Proposta automatica (coordinate del primo frame), finché non ci sono box
+                if state['proposal'] and not state['boxes']:
+                    for i, box in enumerate(state['proposal']):
+                        bx1, by1, bx2, by2 = [int(c * SCALE_FACTOR) for c in box]
+                        cv2.rectangle(display_frame, (bx1, by1), (bx2, by2), (255, 255, 0), 1)
+                        cv2.putText(display_frame, f"{i+1}", (bx1 + 5, by1 + 20),
+                                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 1)
+
+                # 2. Disegna box in costruzione
+                if state['drawing']:
+                    sx, sy = state['start_point']
+                    ex, ey = state['current_end']
+                    d_sx, d_sy = int(sx * SCALE_FACTOR), int(sy * SCALE_FACTOR)
+                    d_ex, d_ey = int(ex * SCALE_FACTOR), int(ey * SCALE_FACTOR)
+                    cv2.rectangle(display_frame, (d_sx, d_sy), (d_ex, d_ey), (0, 255, 255), 1)
+
+                # 3. Box temporaneo
+                if state['temp_box']:
+                    bx1, by1, bx2, by2 = [int(c * SCALE_FACTOR) for c in state['temp_box']]
+                    next_idx = len(state['boxes'])
+                    preview_label = subjects[next_idx] if next_idx < len(subjects) else "..."
+                    cv2.rectangle(display_frame, (bx1, by1), (bx2, by2), (0, 255, 255), 2)
+                    cv2.putText(display_frame, f"Next: {preview_label}", (bx1, by1 - 5), 
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+
+                # 4. Visualizzazione Drift
+                if len(state['drift_points']) > 0:
+                    p1 = state['drift_points'][0]
+                    cv2.circle(display_frame, (int(p1[0]*SCALE_FACTOR), int(p1[1]*SCALE_FACTOR)), 5, (0, 0, 255), -1)
+                    if len(state['drift_points']) > 1:
+                        p2 = state['drift_points'][1]
+                        cv2.circle(display_frame, (int(p2[0]*SCALE_FACTOR), int(p2[1]*SCALE_FACTOR)), 5, (0, 0, 255), -1)
+                        cv2.line(display_frame, (int(p1[0]*SCALE_FACTOR), int(p1[1]*SCALE_FACTOR)), 
+                                                (int(p2[0]*SCALE_FACTOR), int(p2[1]*SCALE_FACTOR)), (0, 255, 0), 2)
+
+                # Info testo
+                info_txt = f"File: {video_file} | Box: {len(state['boxes'])}/{NUM_BOXES}"
+                # '~' = anteprima dall'indice mentre si scorre, il frame esatto arriva appena ci si ferma
+                info_txt += f" | Frame: {'~' if frame_idx != view.target else ''}{frame_idx}"
+                if state['trajectory'] is not None:
+                    info_txt += f" | Drift: AUTO"
+                elif drift_calculated: 
+                    info_txt += f" | Drift: OK"
+                if state['proposal'] and not state['boxes']: info_txt += " | [g] AUTO GRID"
             
-            cv2.putText(display_frame, info_txt, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-            cv2.imshow(win_name, display_frame)
+                cv2.putText(display_frame, info_txt, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+                cv2.imshow(win_name, display_frame)
             
-            key = cv2.waitKey(1) & 0xFF
+            key = cv2.waitKey(15) & 0xFF
+            if key != 255: state['dirty'] = True
 
             if key == ord('n'): 
                 if state['temp_box']:
@@ -229,10 +487,25 @@ def main():
                     state['drift_points'].pop()
                 elif state['boxes']: 
                     state['boxes'].pop()
+            elif key == ord('g'):
+                if state['proposal']:
+                    state['boxes'] = list(state['proposal'])
+                    state['temp_box'] = None
 
-            elif key == ord('e'): state['frame_idx'] = total_frames - 100 if total_frames > 100 else 0
-            elif key == ord('r'): state['frame_idx'] = 0
+            elif key == ord('e'):
+                view.seek(end_frame(total_frames))
+                cv2.setTrackbarPos('Frame', win_name, view.target)
+            elif key == ord('r'):
+                view.seek(0)
+                cv2.setTrackbarPos('Frame', win_name, 0)
             elif key == ord('d'): state['mode'] = 'DRIFT_POINT'
+            elif key == ord('a'):
+                if state['trajectory'] is None:
+                    print(f"Stima automatica del drift per {video_file}...")
+                    state['trajectory'] = load_or_estimate(os.path.join(VIDEO_PATH, video_file),
+                                                           DRIFT_KEYFRAME_STEP, DRIFT_SCALE, drift_cache_dir())
+                else:
+                    state['trajectory'] = None
             elif key == ord('s'): 
                 if len(state['boxes']) == NUM_BOXES:
                     # SALVA IL LAVORO IN CODA
@@ -241,9 +514,11 @@ def main():
                         'boxes': state['boxes'],
                         'drift': total_drift,
                         'subjects': subjects,
-                        'drift_calculated': drift_calculated
+                        'drift_calculated': drift_calculated,
+                        'auto_drift': state['trajectory'] is not None
                     }
                     jobs_queue.append(job_data)
+                    save_jobs(JOBS_FILE, jobs_queue)
                     print(f" -> Configurazione salvata per: {video_file}")
                     setup_completed = True
                     break
@@ -252,82 +527,26 @@ def main():
                 print("Setup interrotto dall'utente. Avvio processamento dei video già configurati...")
                 break
         
-        cap.release()
+        cache.release()
         cv2.destroyWindow(win_name)
         if not setup_completed and key == 27:
             break
+    prefetch.close()
 
     # --- FASE 2: BATCH PROCESSING ---
     if not jobs_queue:
         print("Nessun video configurato. Esco.")
         return
+    export_manifest(jobs_queue)
+    if args.setup_only:
+        print(f"Fase 2 rimandata: python headless/run_manifest.py {MANIFEST_FILE} --input ... --output ...")
+        return
 
     print("\n" + "=" * 60)
     print(f" AVVIO ELABORAZIONE BATCH: {len(jobs_queue)} video in coda")
     print("=" * 60)
 
-    for job in jobs_queue:
-        video_file = job['file']
-        boxes = job['boxes']
-        total_drift = job['drift']
-        subjects = job['subjects']
-        drift_calculated = job['drift_calculated']
-
-        cap = cv2.VideoCapture(os.path.join(VIDEO_PATH, video_file))
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-
-        # Preparazione Writers
-        writers = []
-        clean_name_for_output = os.path.splitext(video_file)[0] 
-        
-        for i, box in enumerate(boxes):
-            x1, y1, x2, y2 = box
-            w_box, h_box = x2 - x1, y2 - y1
-            sub_name = subjects[i]
-            out_name = f"{sub_name}_{clean_name_for_output}.mp4"
-            out_full = os.path.join(OUTPUT_PATH, out_name)
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            writers.append({'writer': cv2.VideoWriter(out_full, fourcc, VIDEO_FPS, (w_box, h_box)), 'base_coords': (x1, y1), 'w': w_box, 'h': h_box})
-
-        # Loop di scrittura
-        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        with tqdm(total=total_frames, desc=f"Processing {video_file}", unit='frame', leave=True) as pbar:
-            while True:
-                ret, frame = cap.read()
-                if not ret: break
-                frame_idx = cap.get(cv2.CAP_PROP_POS_FRAMES)
-                
-                shift_x, shift_y = 0, 0
-                if drift_calculated and total_frames > 0:
-                    progress = frame_idx / total_frames
-                    shift_x = int(total_drift[0] * progress)
-                    shift_y = int(total_drift[1] * progress)
-                
-                img_h, img_w = frame.shape[:2]
-                for item in writers:
-                    base = item['base_coords']
-                    # Calcolo coordinate con drift
-                    curr_x1 = max(0, min(base[0] + shift_x, img_w - 1))
-                    curr_y1 = max(0, min(base[1] + shift_y, img_h - 1))
-                    curr_x2 = max(curr_x1 + 1, min(curr_x1 + item['w'], img_w))
-                    curr_y2 = max(curr_y1 + 1, min(curr_y1 + item['h'], img_h))
-                    
-                    crop = frame[curr_y1:curr_y2, curr_x1:curr_x2]
-                    
-                    # Sicurezza dimensioni
-                    if crop.shape[0] != item['h'] or crop.shape[1] != item['w']:
-                        crop = cv2.resize(crop, (item['w'], item['h']))
-                    
-                    item['writer'].write(crop)
-                pbar.update(1)
-
-        for item in writers: item['writer'].release()
-        cap.release()
-        
-        # Aggiorna file di progresso dopo ogni video completato
-        processed_files[video_file] = True
-        save_progress(processed_files)
-        print(f"Completato: {video_file}")
+    run_batch(jobs_queue, args, JOBS_FILE)
 
     print("\n" + "=" * 60)
     print(" TUTTI I JOB COMPLETATI!")
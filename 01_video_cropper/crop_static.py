@@ -5,23 +5,49 @@ import pandas as pd
 import json
 from string import ascii_uppercase
 import sys
+import time
+import argparse
+from functools import partial
 from tqdm import tqdm 
 
 # Import path locali
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from config_local import INPUT_CROPPER_PATH, OUTPUT_CROPPER_PATH, EXCEL_META_PATH
+from common.config import setting, VIDEO_FPS
+from common.video_io import AsyncVideoWriter, release_all, open_writer, output_name, list_videos, encoder_time, \
+    encoder_settings
+from common import metrics
+from common.chunking import open_at, run_chunked, count_frames
+from common.reader import FrameReader
+from common.shm_crop import crop_shared
+from common.motion import open_gates, written_counts, motion_settings
+from common.drift import inside_frame
+from common.frame_cache import FrameCache, ScrubView
+from common.prefetch import Prefetcher
+from common.checkpoint import CHECKPOINT_INTERVAL, load_jobs, save_jobs, run_checkpointed
+from common.wells import propose_layout
+from common import filtergraph
+from common.manifest import write_manifest
+from common.build_cache import BuildCache
+from common.staging import run_staged
+from common.work_queue import job_key
 
 # --- CONFIGURATION ---
-VIDEO_PATH = INPUT_CROPPER_PATH
-OUTPUT_PATH = OUTPUT_CROPPER_PATH
-EXCEL_PATH = EXCEL_META_PATH
-PROGRESS_FILE = "progress_static.json"
-
-# --- EXPERIMENT SETTINGS ---
+VIDEO_PATH = setting('INPUT_CROPPER_PATH', None)
+OUTPUT_PATH = setting('OUTPUT_CROPPER_PATH', None)
+EXCEL_PATH = setting('EXCEL_META_PATH', None)
+LAYOUT_FILE = "layouts_static.json"  # Box salvati per video (letti anche da 03_fused_pipeline)
+JOBS_FILE = "jobs_static.json"       # Coda dei job configurati, salvata a ogni 's' (ripresa dopo un crash)
+MANIFEST_FILE = "manifest_static.json"  # Job della fase 2 eseguibili senza GUI (headless/run_manifest.py)
+
+# --- EXPERIMENT SETTINGS --- (VIDEO_FPS in common/config.py, condiviso con fused.py)
 NUM_BOXES = 15           
 COL_PREFIX = "Pos"       
-VIDEO_FPS = 60           
 SCALE_FACTOR = 1.5       
+ENCODER_QUEUE = 32       # Frame in coda per ogni encoder (thread dedicato per soggetto); 0 = scrittura sincrona
+NUM_CHUNKS = 1           # >1 = ogni video diviso in blocchi di frame elaborati in parallelo (--chunks N)
+CROP_PROCESSES = 0       # >1 = crop ed encoder divisi su N processi, frame in memoria condivisa (--crop-procs N)
+AUTO_LAYOUT = True       # Propone i box dei pozzetti rilevati sul primo frame (tasto 'g' per accettarli)
+MOTION_GATE = False      # True = per ogni soggetto scarta i frame fermi e scrive <clip>_frames.csv (common/motion.py)
 # ---------------------------
 
 POS_COLUMNS = [f"{COL_PREFIX}{i}" for i in range(1, NUM_BOXES + 1)]
@@ -30,18 +56,18 @@ POS_COLUMNS = [f"{COL_PREFIX}{i}" for i in range(1, NUM_BOXES + 1)]
 np.random.seed(42)
 COLORS = np.random.randint(0, 255, size=(NUM_BOXES, 3), dtype=np.uint8).tolist()
 
-def load_progress():
-    if os.path.exists(PROGRESS_FILE):
-        with open(PROGRESS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_progress(data):
-    with open(PROGRESS_FILE, 'w') as f:
-        json.dump(data, f, indent=4)
+def save_layout(clean_name, boxes, subjects):
+    """ Memorizza su disco il layout dei box confermato per un video """
+    layouts = {}
+    if os.path.exists(LAYOUT_FILE):
+        with open(LAYOUT_FILE, 'r') as f:
+            layouts = json.load(f)
+    layouts[clean_name] = {'boxes': [list(b) for b in boxes], 'subjects': subjects}
+    with open(LAYOUT_FILE, 'w') as f:
+        json.dump(layouts, f, indent=4)
 
 def get_video_files(folder):
-    return [f for f in os.listdir(folder) if f.lower().endswith(('.mp4', '.mov', '.avi'))]
+    return list_videos(folder)
 
 def mouse_callback(event, x, y, flags, param):
     """ MODALITÀ DUE CLICK """
@@ -49,6 +75,10 @@ def mouse_callback(event, x, y, flags, param):
     real_x = int(x / SCALE_FACTOR)
     real_y = int(y / SCALE_FACTOR)
 
+    # Ridisegno solo per gli eventi che cambiano qualcosa a schermo
+    if event == cv2.EVENT_LBUTTONDOWN or (event == cv2.EVENT_MOUSEMOVE and state['drawing']):
+        state['dirty'] = True
+
     if event == cv2.EVENT_LBUTTONDOWN:
         if not state['drawing']:
             state['drawing'] = True
@@ -82,14 +112,194 @@ def load_csv_smart(path):
     print("ERRORE CRITICO: Non trovo la colonna 'Original_Name' nel CSV.")
     return None
 
+def output_paths(job):
+    """ Percorsi delle clip di output di un job, nell'ordine dei box """
+    clean_name = os.path.splitext(job['filename'].replace("proc_", ""))[0]
+    return [output_name(os.path.join(OUTPUT_PATH, f"{subject}_{clean_name}.mp4")) for subject in job['subjects']]
+
+def cache_entry(job):
+    """ (chiave, input, parametri, output) del job per la cache incrementale """
+    params = dict(encoder_settings(), boxes=job['boxes'], subjects=job['subjects'], VIDEO_FPS=VIDEO_FPS,
+                  motion=motion_settings() if MOTION_GATE else False)
+    return job_key('crop_static', job['filename']), job['filepath'], params, output_paths(job)
+
+def processed_videos(files):
+    """ Video già ritagliati così come sono ora su disco (saltati nel setup) """
+    cache = BuildCache(OUTPUT_PATH)
+    return {f for f in files if cache.done_input(job_key('crop_static', f), os.path.join(VIDEO_PATH, f))}
+
+def crop_range(filepath, path_outs, start, end, desc_text, boxes, position=0, procs=CROP_PROCESSES):
+    """ Scrive i crop dei frame [start, end) (end=None: fino alla fine), un file per box """
+    t_start = time.time()
+    cap = open_at(filepath, start)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if end is not None: total_frames = min(end, total_frames)
+    reader = FrameReader(cap, start, end)  # decodifica su un thread dedicato
+    writers = []
+    gates = open_gates(path_outs, cap.get(cv2.CAP_PROP_FPS), MOTION_GATE and procs <= 1)
+    
+    # Setup writers (con procs > 1 li aprono i processi worker)
+    for coords, out_full, gate in zip(boxes, path_outs if procs <= 1 else [], gates):
+        x1, y1, x2, y2 = coords
+        w, h = x2 - x1, y2 - y1
+        writer = open_writer(out_full, VIDEO_FPS, (w, h))
+        if ENCODER_QUEUE > 0:
+            writer = AsyncVideoWriter(writer, ENCODER_QUEUE)
+        writers.append({'writer': writer, 'coords': coords, 'gate': gate})
+
+    # Processing loop: il decoder lavora qui, i 15 encoder sui loro thread
+    count = start
+    written = None
+    timer = metrics.StageTimer()
+    try:
+        with tqdm(total=total_frames - start, desc=desc_text, unit='frame', leave=(position == 0),
+                  position=position) as pbar:
+            if procs > 1:
+                windows = np.asarray(boxes, dtype=np.int32)[None]
+                inside = inside_frame(windows, int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                      int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+                frames, written = crop_shared(reader, windows, inside, path_outs, VIDEO_FPS, procs, ENCODER_QUEUE,
+                                              timer, pbar, start=start, motion=MOTION_GATE)
+                count += frames
+            else:
+                while True:
+                    ret, frame = reader.read()
+                    timer.mark('decode')
+                    if not ret: break
+
+                    # Scrittura dei crop (con encoder asincroni = attesa sulle code piene)
+                    for item in writers:
+                        x1, y1, x2, y2 = item['coords']
+                        crop = frame[y1:y2, x1:x2]
+                        if item['gate'] is not None and not item['gate'].keep(crop, count):
+                            continue
+                        item['writer'].write(crop)
+                    timer.mark('write')
+                    count += 1
+                    pbar.update(1)
+                    timer.skip()
+    finally:
+        # Flush e chiusura di tutti gli encoder anche in caso di errore
+        reader.release()
+        release_all(writers)
+        for gate in gates:
+            if gate is not None: gate.close()
+        timer.mark('flush')
+        timer.add('encode_threads', encoder_time(writers))
+
+    n = count - start
+    if written is None: written = written_counts(gates, n)
+    return {'file': os.path.basename(filepath), 'ok': n > 0, 'frames': n, 'seconds': time.time() - t_start,
+            'error': None if n > 0 else "Nessun frame decodificato", 'start': start, 'written': written,
+            'timings': timer.as_dict()}
+
+def offload_crop(job, path_in, path_outs):
+    """ Fase 2 di un job eseguita da un unico filtergraph ffmpeg (split -> crop x N -> encode) """
+    graph = filtergraph.crop_graph(job['boxes'], VIDEO_FPS)
+    return filtergraph.run_graph(path_in, graph, path_outs, VIDEO_FPS, count_frames(path_in),
+                                 f"Offload {job['filename']}")
+
+def export_manifest(jobs_queue):
+    """ Salva la coda come manifest per headless/run_manifest.py (senza percorsi locali) """
+    jobs = [{'file': job['filename'], 'boxes': job['boxes'], 'subjects': job['subjects']} for job in jobs_queue]
+    write_manifest(MANIFEST_FILE, 'crop_static', jobs, {'VIDEO_FPS': VIDEO_FPS, 'MOTION_GATE': MOTION_GATE})
+
+def jobs_from_manifest(entries):
+    """ Job della fase 2 dalle voci di un manifest, con i video cercati in VIDEO_PATH """
+    return [{'filename': e['file'], 'filepath': os.path.join(VIDEO_PATH, e['file']),
+             'boxes': e['boxes'], 'subjects': e['subjects']} for e in entries]
+
+def process_job(job, args, path_in=None, path_outs=None):
+    """ Un job della fase 2 nella modalità scelta da args (--offload / --chunks / --checkpoint).
+    path_in / path_outs sostituiscono quelli del job (copie locali dello staging) """
+    filename = job['filename']
+    path_in = path_in or job['filepath']
+    path_outs = path_outs or output_paths(job)
+    if args.offload:
+        return offload_crop(job, path_in, path_outs)
+    if args.chunks > 1:
+        return run_chunked(partial(crop_range, boxes=job['boxes']), path_in, path_outs,
+                           f"Writing {filename}", args.chunks)
+    return run_checkpointed(partial(crop_range, boxes=job['boxes'], procs=args.crop_procs), path_in, path_outs,
+                            f"Writing {filename}", args.checkpoint, params=job)
+
+def run_batch(jobs_queue, args, jobs_file=None):
+    """ Fase 2: elabora i job non aggiornati nella cache (senza GUI), registrando quelli completati.
+    jobs_file: coda interattiva da cui togliere i job completati (None per il manifest headless) """
+    cache = BuildCache(OUTPUT_PATH)
+    entries = [cache_entry(job) for job in jobs_queue]
+    todo = cache.pending(entries)
+    jobs_queue, entries = [jobs_queue[i] for i in todo], {jobs_queue[i]['filename']: entries[i] for i in todo}
+    processed_files = set()
+
+    def job_done(job, result):
+        # Esito definitivo del job (con lo staging, chiamata dal thread che sposta gli output):
+        # il record delle metriche è scritto subito, non a fine batch
+        metrics.record('crop_static', result)
+        if not result['ok']:
+            return
+        filename = job['filename']
+        processed_files.add(filename)
+        cache.record(*entries[filename])
+        if jobs_file:
+            save_jobs(jobs_file, [j for j in jobs_queue if j['filename'] not in processed_files])
+        print(f"Completato: {filename}")
+
+    profiler = metrics.start_profiler(args.profile)
+    results = run_staged(jobs_queue, lambda job: (job['filepath'], output_paths(job)),
+                         lambda job, path_in, path_outs: process_job(job, args, path_in, path_outs), job_done)
+    metrics.stop_profiler(profiler, OUTPUT_PATH, 'crop_static')
+    return results
+
 def main():
+    parser = argparse.ArgumentParser(description="Crop statico dei soggetti")
+    parser.add_argument('--chunks', type=int, default=NUM_CHUNKS,
+                        help="Divide ogni video in N blocchi temporali elaborati in parallelo (video lunghi)")
+    parser.add_argument('--checkpoint', type=int, default=CHECKPOINT_INTERVAL,
+                        help="Frame per segmento di checkpoint, per riprendere un video interrotto (0 = disattivato)")
+    parser.add_argument('--offload', action='store_true',
+                        help="Fase 2 eseguita da un filtergraph ffmpeg invece che dal loop Python")
+    parser.add_argument('--profile', action='store_true',
+                        help="Profiler a campionamento sulla fase 2 (profilo salvato nella cartella di output)")
+    parser.add_argument('--crop-procs', type=int, default=CROP_PROCESSES,
+                        help="Divide crop ed encoder dei soggetti su N processi (frame in memoria condivisa)")
+    parser.add_argument('--setup-only', action='store_true',
+                        help=f"Solo fase 1: salva {MANIFEST_FILE} per eseguire la fase 2 altrove")
+    args = parser.parse_args()
+    if args.offload and not filtergraph.available():
+        print("ATTENZIONE: ffmpeg non trovato, --offload ignorato.")
+        args.offload = False
+    if args.offload and MOTION_GATE:
+        print("ATTENZIONE: il filtergraph non scarta i frame fermi (MOTION_GATE), --offload ignorato.")
+        args.offload = False
+    if args.offload and args.chunks > 1:
+        print("ATTENZIONE: con --offload ogni video è un unico processo ffmpeg (già multi-thread), --chunks ignorato.")
+        args.chunks = 1
+    if MOTION_GATE and (args.chunks > 1 or args.checkpoint > 0):
+        # Ogni blocco / segmento ripartirebbe senza il frame di riferimento: selezione diversa dal video intero
+        print("ATTENZIONE: MOTION_GATE confronta ogni frame con l'ultimo tenuto, --chunks/--checkpoint ignorati.")
+        args.chunks, args.checkpoint = 1, 0
+    if args.profile and args.chunks > 1:
+        print("ATTENZIONE: il profiler campiona solo questo processo, --chunks ignorato.")
+        args.chunks = 1
+    if args.crop_procs > 1 and (args.chunks > 1 or args.offload):
+        print("ATTENZIONE: --crop-procs non si combina con --chunks/--offload, ignorato.")
+        args.crop_procs = 0
+
+    if None in (VIDEO_PATH, OUTPUT_PATH, EXCEL_PATH):
+        print("ERRORE: definisci INPUT_CROPPER_PATH, OUTPUT_CROPPER_PATH e EXCEL_META_PATH in config_local.py")
+        return
     if not os.path.exists(OUTPUT_PATH): os.makedirs(OUTPUT_PATH)
     df = load_csv_smart(EXCEL_PATH)
     if df is None: return
     files = get_video_files(VIDEO_PATH)
-    processed_files = load_progress()
+    processed_files = processed_videos(files)
 
-    jobs_queue = []
+    # Job già configurati in una sessione precedente e non ancora completati
+    jobs_queue = [job for job in load_jobs(JOBS_FILE) if job['filename'] not in processed_files]
+    queued = {job['filename'] for job in jobs_queue}
+    if jobs_queue:
+        print(f"Ripresi {len(jobs_queue)} job salvati in {JOBS_FILE}")
     last_cuts_memory = None  # Per la funzione 'c' (copia precedente)
 
     print("\n" + "=" * 60)
@@ -101,14 +311,19 @@ def main():
     print("  [ n ]   : Confirm Box")
     print("  [ z ]   : Undo")
     print("  [ c ]   : Copy Previous Boxes (from previous video)")
+    print("  [ g ]   : Accept Auto-detected Grid")
+    print("  [Frame] : Trackbar to scrub through the video")
     print("-" * 60)
     print("  [ s ]   : SAVE CONFIG & NEXT VIDEO")
     print("  [ Esc ] : Exit Setup & Start Processing")
     print("=" * 60 + "\n")
 
     # --- FASE 1: SETUP UTENTE ---
+    # Primo frame e metadati dei prossimi video preparati in background
+    prefetch = Prefetcher([os.path.join(VIDEO_PATH, f) for f in files if f not in processed_files and f not in queued])
+
     for i, video_file in enumerate(files):
-        if video_file in processed_files:
+        if video_file in processed_files or video_file in queued:
             continue
 
         search_name = video_file.replace("proc_", "").replace(".mp4", "").replace(".mov", "").replace(".avi", "")
@@ -122,57 +337,77 @@ def main():
         row = df[df['Original_Name'] == search_name].iloc[0]
         current_subjects = [str(row[col]) for col in POS_COLUMNS]
 
-        cap = cv2.VideoCapture(os.path.join(VIDEO_PATH, video_file))
-        if not cap.isOpened(): continue
+        # Frame letti tramite cache LRU + indice di scrubbing (niente seek/decode a ogni tick)
+        preview = prefetch.get(os.path.join(VIDEO_PATH, video_file))
+        if preview is None: continue
+        cache = FrameCache(os.path.join(VIDEO_PATH, video_file), info=preview)
+        view = ScrubView(cache)
         
-        ret, frame = cap.read()
-        cap.release() # Chiudiamo subito, riapriremo dopo
-        if not ret: continue
-        
-        state = {'drawing': False, 'start_point': (0,0), 'current_end': (0,0), 'temp_box': None, 'boxes': []}
+        state = {'drawing': False, 'start_point': (0,0), 'current_end': (0,0), 'temp_box': None, 'boxes': [],
+                 'dirty': True}
+        # Griglia dei pozzetti rilevata sul primo frame (None = bassa confidenza, box a mano)
+        state['proposal'] = propose_layout(preview['frames'][0], NUM_BOXES, video_file) if AUTO_LAYOUT else None
         
         win_name = f"Setup ({len(jobs_queue)+1}): {video_file}"
         cv2.namedWindow(win_name)
         cv2.setMouseCallback(win_name, mouse_callback, {'state': state})
+        cv2.createTrackbar('Frame', win_name, 0, max(cache.total_frames - 1, 1), view.seek)
         
         setup_completed = False
+        key = 255
 
         while True:
-            h, w = frame.shape[:2]
-            disp_w, disp_h = int(w * SCALE_FACTOR), int(h * SCALE_FACTOR)
-            display_frame = cv2.resize(frame, (disp_w, disp_h))
-
-            # Disegna i box confermati
-            for idx, box in enumerate(state['boxes']):
-                bx1, by1, bx2, by2 = [int(c * SCALE_FACTOR) for c in box]
-                color = COLORS[idx % len(COLORS)]
-                label_text = current_subjects[idx] if idx < len(current_subjects) else f"Box {idx+1}"
-                cv2.rectangle(display_frame, (bx1, by1), (bx2, by2), color, 2)
-                cv2.putText(display_frame, label_text, (bx1, by1 - 5), 
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-
-            # Box in costruzione
-            if state['drawing']:
-                sx, sy = state['start_point']
-                ex, ey = state['current_end']
-                d_sx, d_sy = int(sx * SCALE_FACTOR), int(sy * SCALE_FACTOR)
-                d_ex, d_ey = int(ex * SCALE_FACTOR), int(ey * SCALE_FACTOR)
-                cv2.rectangle(display_frame, (d_sx, d_sy), (d_ex, d_ey), (0, 255, 255), 1)
-
-            # Box temporaneo
-            if state['temp_box']:
-                bx1, by1, bx2, by2 = [int(c * SCALE_FACTOR) for c in state['temp_box']]
-                next_idx = len(state['boxes'])
-                preview_label = current_subjects[next_idx] if next_idx < len(current_subjects) else "..."
-                cv2.rectangle(display_frame, (bx1, by1), (bx2, by2), (0, 255, 255), 2)
-                cv2.putText(display_frame, f"Next: {preview_label}", (bx1, by1 - 5), 
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
-
-            info_txt = f"File: {video_file} | Box: {len(state['boxes'])}/{NUM_BOXES}"
-            cv2.putText(display_frame, info_txt, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+            # Si ricompone l'immagine solo quando cambia qualcosa (mouse, tasti, trackbar)
+            view.tick()
+            if state['dirty'] or view.dirty:
+                state['dirty'] = view.dirty = False
+                frame_idx, frame = view.frame()
+                if frame is None: break
+                display_frame = view.base(frame, frame_idx, SCALE_FACTOR)
+
+
+                # Disegna i box confermati
+                for idx, box in enumerate(state['boxes']):
+                    bx1, by1, bx2, by2 = [int(c * SCALE_FACTOR) for c in box]
+                    color = COLORS[idx % len(COLORS)]
+                    label_text = current_subjects[idx] if idx < len(current_subjects) else f"Box {idx+1}"
+                    cv2.rectangle(display_frame, (bx1, by1), (bx2, by2), color, 2)
+                    cv2.putText(display_frame, label_text, (bx1, by1 - 5), 
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+
+                # Proposta automatica, visibile finché non si conferma o disegna un box
+                if state['proposal'] and not state['boxes']:
+                    for idx, box in enumerate(state['proposal']):
+                        bx1, by1, bx2, by2 = [int(c * SCALE_FACTOR) for c in box]
+                        cv2.rectangle(display_frame, (bx1, by1), (bx2, by2), (255, 255, 0), 1)
+                        cv2.putText(display_frame, f"{idx+1}", (bx1 + 5, by1 + 20),
+                                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 1)
+
+                # Box in costruzione
+                if state['drawing']:
+                    sx, sy = state['start_point']
+                    ex, ey = state['current_end']
+                    d_sx, d_sy = int(sx * SCALE_FACTOR), int(sy * SCALE_FACTOR)
+                    d_ex, d_ey = int(ex * SCALE_FACTOR), int(ey * SCALE_FACTOR)
+                    cv2.rectangle(display_frame, (d_sx, d_sy), (d_ex, d_ey), (0, 255, 255), 1)
+
+                # Box temporaneo
+                if state['temp_box']:
+                    bx1, by1, bx2, by2 = [int(c * SCALE_FACTOR) for c in state['temp_box']]
+                    next_idx = len(state['boxes'])
+                    preview_label = current_subjects[next_idx] if next_idx < len(current_subjects) else "..."
+                    cv2.rectangle(display_frame, (bx1, by1), (bx2, by2), (0, 255, 255), 2)
+                    cv2.putText(display_frame, f"Next: {preview_label}", (bx1, by1 - 5), 
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+
+                info_txt = f"File: {video_file} | Box: {len(state['boxes'])}/{NUM_BOXES}"
+                info_txt += f" | Frame: {'~' if frame_idx != view.target else ''}{frame_idx}"
+                if state['proposal'] and not state['boxes']: info_txt += " | [g] AUTO GRID"
+                cv2.putText(display_frame, info_txt, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
             
-            cv2.imshow(win_name, display_frame)
-            key = cv2.waitKey(1) & 0xFF
+                cv2.imshow(win_name, display_frame)
+            key = cv2.waitKey(15) & 0xFF
+            if key != 255: state['dirty'] = True
 
             if key == ord('n'): 
                 if state['temp_box']:
@@ -180,6 +415,10 @@ def main():
                     state['temp_box'] = None
             elif key == ord('z'): 
                 if state['boxes']: state['boxes'].pop()
+            elif key == ord('g'):
+                if state['proposal']:
+                    state['boxes'] = list(state['proposal'])
+                    state['temp_box'] = None
             elif key == ord('c'): 
                 if last_cuts_memory: 
                     # Copia profonda per evitare riferimenti incrociati
@@ -196,6 +435,8 @@ def main():
                         'boxes': state['boxes'],
                         'subjects': current_subjects
                     })
+                    save_jobs(JOBS_FILE, jobs_queue)
+                    save_layout(search_name, state['boxes'], current_subjects)
                     last_cuts_memory = state['boxes'] # Memorizza per il prossimo 'c'
                     setup_completed = True
                     break
@@ -206,59 +447,25 @@ def main():
                 break
 
         cv2.destroyWindow(win_name)
+        cache.release()
         if not setup_completed and key == 27:
             break
+    prefetch.close()
 
     # --- FASE 2: BATCH PROCESSING ---
     if not jobs_queue:
         print("Nessun video da processare.")
         return
+    export_manifest(jobs_queue)
+    if args.setup_only:
+        print(f"Fase 2 rimandata: python headless/run_manifest.py {MANIFEST_FILE} --input ... --output ...")
+        return
 
     print("\n" + "=" * 60)
     print(f" AVVIO ELABORAZIONE BATCH: {len(jobs_queue)} video in coda")
     print("=" * 60)
 
-    for job in jobs_queue:
-        filename = job['filename']
-        filepath = job['filepath']
-        boxes = job['boxes']
-        subjects_list = job['subjects']
-
-        cap = cv2.VideoCapture(filepath)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        writers = []
-        clean_name = os.path.splitext(filename.replace("proc_", ""))[0]
-        
-        # Setup writers
-        for i, coords in enumerate(boxes):
-            subject = subjects_list[i]
-            x1, y1, x2, y2 = coords
-            w, h = x2 - x1, y2 - y1
-            out_name = f"{subject}_{clean_name}.mp4"
-            out_full = os.path.join(OUTPUT_PATH, out_name)
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            writers.append({'writer': cv2.VideoWriter(out_full, fourcc, VIDEO_FPS, (w, h)), 'coords': coords})
-
-        # Processing loop
-        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        with tqdm(total=total_frames, desc=f"Writing {filename}", unit='frame', leave=True) as pbar:
-            while True:
-                ret, frame = cap.read()
-                if not ret: break
-                
-                # Scrittura dei crop
-                for item in writers:
-                    x1, y1, x2, y2 = item['coords']
-                    crop = frame[y1:y2, x1:x2]
-                    item['writer'].write(crop)
-                pbar.update(1)
-                
-        for item in writers: item['writer'].release()
-        cap.release()
-        
-        processed_files[filename] = True
-        save_progress(processed_files)
-        print(f"Completato: {filename}")
+    run_batch(jobs_queue, args, JOBS_FILE)
 
     print("\n" + "=" * 60)
     print(" TUTTI I JOB COMPLETATI!")
@@ -1,6 +1,9 @@
 import cv2
 import os
 import sys
+import time
+import argparse
+from functools import partial
 import numpy as np
 from tqdm import tqdm
 
@@ -8,6 +11,15 @@ from tqdm import tqdm
 # Aggiunge la cartella superiore per importare config_local.py
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from config_local import OUTPUT_CROPPER_PATH 
+from common.transforms import apply_clahe as clahe_filter
+from common.lut import build_lut, apply_lut, LUT_SAMPLES, LUT_CURVES
+from common.parallel import run_parallel, print_summary
+from common.chunking import open_at, run_chunked
+from common.reader import FrameReader
+from common.video_io import open_writer, output_name, list_videos, encoder_settings
+from common.work_queue import WorkQueue, job_key, run_queued
+from common.build_cache import BuildCache
+from common import metrics
 
 # --- CONFIGURATION ---
 # ORA L'INPUT È L'OUTPUT DEL CROPPER (i video ritagliati)
@@ -17,21 +29,149 @@ OUTPUT_FOLDER = r"output_enhanced"
 # Settings per il contrasto (CLAHE)
 CLIP_LIMIT = 3.0       # Più alto = più contrasto (prova 2.0 o 3.0)
 GRID_SIZE = (8, 8)     # Griglia di suddivisione
+ENHANCE_MODE = 'clahe' # 'clahe' = CLAHE a ogni frame; 'fit' / 'equalize' = curva fissa per clip, un LUT per frame (common/lut.py)
+NUM_WORKERS = os.cpu_count() or 1  # Clip elaborate in parallelo (sovrascrivibile con --workers N)
+NUM_CHUNKS = 1         # >1 = ogni clip divisa in blocchi di frame elaborati in parallelo (--chunks N)
 # ----------------------
 
 def apply_clahe(image):
     """ Applica il contrasto adattivo (utile per vedere animali scuri su sfondo scuro) """
-    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
-    
-    # Applica CLAHE solo sul canale della luminosità (L)
-    clahe = cv2.createCLAHE(clipLimit=CLIP_LIMIT, tileGridSize=GRID_SIZE)
-    cl = clahe.apply(l)
-    
-    merged = cv2.merge((cl, a, b))
-    return cv2.cvtColor(merged, cv2.COLOR_LAB2BGR)
+    return clahe_filter(image, CLIP_LIMIT, GRID_SIZE)
+
+def clip_lut(path_in):
+    """ Curva fissa della clip per ENHANCE_MODE 'fit' / 'equalize' (None = CLAHE a ogni frame) """
+    if ENHANCE_MODE == 'clahe':
+        return None
+    return build_lut(path_in, ENHANCE_MODE, CLIP_LIMIT, GRID_SIZE)
+
+def process_range(path_in, path_outs, start, end, desc_text, position=0, lut=None):
+    """ Applica CLAHE (o la curva lut della clip) ai frame [start, end) di una clip
+    (end=None: fino alla fine). Ritorna le statistiche del job (mai un'eccezione). """
+    t_start = time.time()
+    stats = {'file': os.path.basename(path_in), 'ok': False, 'frames': 0, 'seconds': 0.0, 'error': None,
+             'start': start, 'written': [0]}
+
+    cap = open_at(path_in, start)
+    reader = FrameReader(cap, start, end)  # decodifica su un thread dedicato
+    out = None
+    timer = metrics.StageTimer()
+    try:
+        if not cap.isOpened():
+            raise IOError(f"Impossibile aprire {path_in}")
+
+        w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if end is not None: total_frames = min(end, total_frames)
+        
+        out = open_writer(path_outs[0], fps, (w, h))
+        
+        count = start
+        with tqdm(total=total_frames - start, desc=desc_text, unit='fr', ncols=100,
+                  position=position, leave=(position == 0)) as pbar:
+            while True:
+                ret, frame = reader.read()
+                timer.mark('decode')
+                if not ret:
+                    break
+                
+                # Applica il filtro di miglioramento
+                enhanced_frame = apply_clahe(frame) if lut is None else apply_lut(frame, lut)
+                timer.mark('transform')
+                
+                out.write(enhanced_frame)
+                timer.mark('write')
+                count += 1
+                pbar.update(1)
+                timer.skip()
+
+        stats['frames'] = stats['written'][0] = count - start
+        stats['ok'] = stats['frames'] > 0
+        if not stats['ok']:
+            stats['error'] = "Nessun frame decodificato"
+    except Exception as e:
+        stats['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        reader.release()
+        if out is not None: out.release()
+        timer.mark('flush')
+
+    stats['seconds'] = time.time() - t_start
+    stats['timings'] = timer.as_dict()
+    return stats
+
+def process_clip(path_in, path_out, desc_text, position=0):
+    """ Applica CLAHE (o la curva fissa di ENHANCE_MODE) a una clip intera """
+    t_start = time.time()
+    lut = clip_lut(path_in)
+    t_lut = time.time() - t_start
+    stats = process_range(path_in, [path_out], 0, None, desc_text, position=position, lut=lut)
+    if lut is not None:
+        stats['timings']['lut'] = t_lut
+        stats['seconds'] += t_lut
+    return stats
+
+def cache_entry(job):
+    """ (chiave, input, parametri, output) della clip per la cache incrementale """
+    path_in, path_out, _ = job
+    params = dict(encoder_settings(), CLIP_LIMIT=CLIP_LIMIT, GRID_SIZE=GRID_SIZE, ENHANCE_MODE=ENHANCE_MODE)
+    if ENHANCE_MODE != 'clahe':
+        params['LUT_SAMPLES'] = LUT_SAMPLES
+    return job_key('enhance', os.path.basename(path_in)), path_in, params, [path_out]
+
+def process_job(job, args):
+    """ Una clip nella modalità scelta da args (--chunks) """
+    path_in, path_out, desc_text = job
+    if args.chunks > 1:
+        # Curva ricavata una volta per tutta la clip: uguale in tutti i blocchi
+        return run_chunked(partial(process_range, lut=clip_lut(path_in)), path_in, [path_out], desc_text, args.chunks)
+    return process_clip(*job)
+
+def run_from_queue(jobs, args, on_result):
+    """ Clip prese una alla volta dalla coda condivisa args.queue (più worker/macchine);
+    on_result(r) appena ogni clip è finita """
+    queue = WorkQueue(args.queue)
+    key = lambda job: job_key('enhance', os.path.basename(job[0]))
+    if args.retry_failed:
+        queue.reset_failed([key(job) for job in jobs])
+
+    def process(job):
+        r = process_job(job, args)
+        on_result(r)
+        return r
+
+    try:
+        results = run_queued(queue, jobs, key, process)
+    finally:
+        queue.close()
+    counts = queue.status([key(job) for job in jobs])
+    print(f"Coda {args.queue}: {counts['done']} completate, {counts['failed']} fallite "
+          f"({len(results)} elaborate da questo worker)")
+    return results
 
 def main():
+    parser = argparse.ArgumentParser(description="Miglioramento contrasto (CLAHE) delle clip ritagliate")
+    parser.add_argument('--workers', type=int, default=NUM_WORKERS,
+                        help="Numero di clip elaborate in parallelo (default: tutti i core)")
+    parser.add_argument('--chunks', type=int, default=NUM_CHUNKS,
+                        help="Divide ogni clip in N blocchi temporali elaborati in parallelo (clip lunghe)")
+    parser.add_argument('--profile', action='store_true',
+                        help="Profiler a campionamento (profilo salvato nella cartella di output)")
+    parser.add_argument('--queue', help="Cartella condivisa della coda di lavoro tra più worker/macchine")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="Con --queue: rimette in coda le clip fallite in esecuzioni precedenti")
+    args = parser.parse_args()
+    if args.queue and args.workers > 1:
+        print("ATTENZIONE: con --queue ogni processo elabora una clip alla volta, avvia più processi per usare più core.")
+        args.workers = 1
+    if args.profile and (args.workers > 1 or args.chunks > 1):
+        print("ATTENZIONE: il profiler campiona solo questo processo, --workers/--chunks ignorati.")
+        args.workers = args.chunks = 1
+    if ENHANCE_MODE != 'clahe' and ENHANCE_MODE not in LUT_CURVES:
+        print(f"ERRORE: ENHANCE_MODE '{ENHANCE_MODE}' non valido (clahe, {', '.join(LUT_CURVES)})")
+        return
+
     if not os.path.exists(OUTPUT_FOLDER):
         os.makedirs(OUTPUT_FOLDER)
 
@@ -41,7 +181,7 @@ def main():
         print("Assicurati di aver eseguito lo step precedente (crop_static.py)!")
         return
 
-    files = [f for f in os.listdir(INPUT_FOLDER) if f.lower().endswith(('.mp4', '.mov', '.avi'))]
+    files = list_videos(INPUT_FOLDER)
 
     if not files:
         print(f"Nessun video trovato in: {INPUT_FOLDER}")
@@ -49,36 +189,37 @@ def main():
 
     print(f"Miglioramento contrasto per {len(files)} video...")
 
+    jobs = []
     for i, video in enumerate(files):
         path_in = os.path.join(INPUT_FOLDER, video)
-        path_out = os.path.join(OUTPUT_FOLDER, f"enh_{video}")
-        
-        cap = cv2.VideoCapture(path_in)
-        
-        w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(path_out, fourcc, fps, (w, h))
-        
-        desc_text = f"Enhance {i+1}/{len(files)}"
-        
-        with tqdm(total=total_frames, desc=desc_text, unit='fr', ncols=100) as pbar:
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                
-                # Applica il filtro di miglioramento
-                enhanced_frame = apply_clahe(frame)
-                
-                out.write(enhanced_frame)
-                pbar.update(1)
-        
-        cap.release()
-        out.release()
+        path_out = output_name(os.path.join(OUTPUT_FOLDER, f"enh_{video}"))
+        jobs.append((path_in, path_out, f"Enhance {i+1}/{len(files)}"))
+
+    # Solo le clip nuove, riesportate dal cropper o con CLIP_LIMIT / GRID_SIZE cambiati
+    cache = BuildCache(OUTPUT_FOLDER)
+    entries = [cache_entry(job) for job in jobs]
+    todo = cache.pending(entries)
+    jobs, entries = [jobs[i] for i in todo], {os.path.basename(entries[i][1]): entries[i] for i in todo}
+
+    def clip_done(r):
+        # Metriche e cache aggiornate a ogni clip finita: un batch interrotto conserva le precedenti
+        metrics.record('enhance', r)
+        if r['ok']: cache.record(*entries[r['file']])
+
+    profiler = metrics.start_profiler(args.profile)
+    if args.queue:
+        results = run_from_queue(jobs, args, clip_done)
+    elif args.chunks > 1:
+        # Una clip alla volta, ma ciascuna su più core
+        results = []
+        for job in jobs:
+            results.append(process_job(job, args))
+            clip_done(results[-1])
+    else:
+        workers = max(1, min(args.workers, len(jobs)))
+        results = run_parallel(process_clip, jobs, workers, clip_done)
+    metrics.stop_profiler(profiler, OUTPUT_FOLDER, 'enhance')
+    print_summary(results)
 
     print("\n" + "="*60)
     print(" PROCESSO COMPLETATO: Video migliorati in 'output_enhanced'")
@@ -0,0 +1,167 @@
+import cv2
+import os
+import json
+import sys
+import time
+import argparse
+from tqdm import tqdm
+
+# Import config locale
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.config import setting, RESIZE_FACTOR, FRAME_SKIP, VIDEO_FPS
+from common.transforms import prepare_frame, apply_clahe
+from common.video_io import AsyncVideoWriter, release_all, open_writer, output_name, list_videos, encoder_time, \
+    encoder_settings
+from common.reader import FrameReader
+from common.build_cache import BuildCache
+from common.work_queue import job_key
+from common import metrics
+
+# --- CONFIGURATION ---
+# Legge i video GREZZI e scrive direttamente le clip finali per soggetto:
+# rotate -> crop -> enhance con una sola decodifica e una sola codifica.
+INPUT_FOLDER = setting('INPUT_ROTATOR_PATH', None)
+OUTPUT_FOLDER = r"output_fused"
+ROTATION_FILE = "rotation_choices.json"  # Salvato da 00_video_rotator/rotate.py (fase 1)
+LAYOUT_FILE = "layouts_static.json"      # Salvato da 01_video_cropper/crop_static.py (tasto 's')
+
+# RESIZE_FACTOR, FRAME_SKIP e VIDEO_FPS vengono da common/config.py, come per rotate.py e
+# crop_static.py: le clip hanno le stesse dimensioni, gli stessi frame e lo stesso frame rate
+
+# SETTINGS CROP / ENHANCE
+NUM_BOXES = 15
+APPLY_CLAHE = True     # False = clip solo ritagliate (come l'output di crop_static.py)
+CLIP_LIMIT = 3.0
+GRID_SIZE = (8, 8)
+ENCODER_QUEUE = 32     # Frame in coda per ogni encoder (thread dedicato per soggetto); 0 = scrittura sincrona
+# ---------------------
+
+def load_json(path):
+    if not os.path.exists(path):
+        print(f"ERRORE: File non trovato: {path}")
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def output_paths(subjects, clean_name):
+    """ Clip finali di un video, nell'ordine dei box """
+    prefix = "enh_" if APPLY_CLAHE else ""
+    return [output_name(os.path.join(OUTPUT_FOLDER, f"{prefix}{subject}_{clean_name}.mp4")) for subject in subjects]
+
+def process_fused(path_in, should_rotate, boxes, subjects, clean_name):
+    """ Una sola passata sul video grezzo: skip -> rotazione/resize -> crop -> CLAHE -> scrittura """
+    t_start = time.time()
+    cap = cv2.VideoCapture(path_in)
+    if not cap.isOpened():
+        print(f"ERRORE: Impossibile aprire {path_in}")
+        return False
+
+    w_orig = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    h_orig = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    new_size = (int(w_orig * RESIZE_FACTOR), int(h_orig * RESIZE_FACTOR))
+
+    # I box sono definiti sul frame già ruotato e ridimensionato (come in crop_static.py)
+    writers = []
+    for coords, out_full in zip(boxes, output_paths(subjects, clean_name)):
+        x1, y1, x2, y2 = coords
+        writer = open_writer(out_full, VIDEO_FPS, (x2 - x1, y2 - y1))  # come crop_static.py
+        if ENCODER_QUEUE > 0:
+            writer = AsyncVideoWriter(writer, ENCODER_QUEUE)
+        writers.append({'writer': writer, 'coords': coords})
+
+    action_tag = "[ROT]" if should_rotate else "[STD]"
+    # Decodifica su un thread dedicato; i frame scartati dal frame skip vengono solo "grabbati"
+    reader = FrameReader(cap, step=FRAME_SKIP)
+    timer = metrics.StageTimer()
+    try:
+        with tqdm(total=total_frames, desc=f"Fused {clean_name} {action_tag}", unit='fr', ncols=100) as pbar:
+            while True:
+                ret, frame = reader.read()
+                timer.mark('decode')
+                pbar.update(reader.frames - pbar.n)
+                if not ret: break
+                frame = prepare_frame(frame, should_rotate, new_size)
+                timer.mark('transform')
+                for item in writers:
+                    x1, y1, x2, y2 = item['coords']
+                    crop = frame[y1:y2, x1:x2]
+                    if APPLY_CLAHE:
+                        crop = apply_clahe(crop, CLIP_LIMIT, GRID_SIZE)
+                        timer.mark('enhance')
+                    item['writer'].write(crop)
+                    timer.mark('write')
+                timer.skip()
+    finally:
+        reader.release()
+        release_all(writers)
+        timer.mark('flush')
+        timer.add('encode_threads', encoder_time(writers))
+        count = reader.frames
+        metrics.record('fused', {'file': os.path.basename(path_in), 'ok': count > 0, 'frames': count,
+                                 'seconds': time.time() - t_start, 'timings': timer.as_dict()})
+    return count > 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Rotazione, crop e CLAHE in una sola passata")
+    parser.add_argument('--profile', action='store_true',
+                        help="Profiler a campionamento (profilo salvato nella cartella di output)")
+    args = parser.parse_args()
+
+    if INPUT_FOLDER is None:
+        print("ERRORE: definisci INPUT_ROTATOR_PATH in config_local.py")
+        return
+    if not os.path.exists(OUTPUT_FOLDER):
+        os.makedirs(OUTPUT_FOLDER)
+
+    rotation_map = load_json(ROTATION_FILE)
+    layouts = load_json(LAYOUT_FILE)
+    if rotation_map is None or layouts is None:
+        print("Esegui prima la fase di setup di rotate.py e crop_static.py.")
+        return
+
+    files = list_videos(INPUT_FOLDER)
+    if not files:
+        print(f"ERRORE: Nessun video trovato in: {INPUT_FOLDER}")
+        return
+
+    print("\n" + "=" * 60)
+    print(f" FUSED PIPELINE: rotate -> crop -> {'enhance' if APPLY_CLAHE else 'no enhance'}")
+    print("=" * 60)
+
+    cache = BuildCache(OUTPUT_FOLDER)
+    profiler = metrics.start_profiler(args.profile)
+    for video_file in files:
+        clean_name = os.path.splitext(video_file)[0]
+        if video_file not in rotation_map:
+            print(f"SKIP: {video_file} (nessuna scelta di rotazione salvata)")
+            continue
+        if clean_name not in layouts:
+            print(f"SKIP: {video_file} (nessun layout box salvato)")
+            continue
+
+        layout = layouts[clean_name]
+        if len(layout['boxes']) != NUM_BOXES:
+            print(f"SKIP: {video_file} (il layout ha {len(layout['boxes'])} box, attesi {NUM_BOXES})")
+            continue
+
+        path_in = os.path.join(INPUT_FOLDER, video_file)
+        params = dict(encoder_settings(), rotate=rotation_map[video_file], layout=layout, RESIZE_FACTOR=RESIZE_FACTOR,
+                      FRAME_SKIP=FRAME_SKIP, VIDEO_FPS=VIDEO_FPS, APPLY_CLAHE=APPLY_CLAHE, CLIP_LIMIT=CLIP_LIMIT,
+                      GRID_SIZE=GRID_SIZE)
+        entry = (job_key('fused', video_file), path_in, params, output_paths(layout['subjects'], clean_name))
+        if cache.fresh(*entry):
+            print(f"SKIP: {video_file} (già aggiornato)")
+            continue
+        if process_fused(path_in, rotation_map[video_file], layout['boxes'], layout['subjects'], clean_name):
+            cache.record(*entry)
+            print(f"Completato: {video_file}")
+    metrics.stop_profiler(profiler, OUTPUT_FOLDER, 'fused')
+
+    print("\n" + "=" * 60)
+    print(" TUTTO COMPLETATO CON SUCCESSO!")
+    print("=" * 60)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import cv2
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.transforms import apply_clahe
+from common.lut import build_lut, apply_lut, LUT_SAMPLES, LUT_CURVES
+from common.video_io import list_videos
+
+# Confronto tra il CLAHE a ogni frame e le curve fisse per clip di common/lut.py
+# (ENHANCE_MODE di enhance.py): per ogni clip tempo per ricavare la curva, frame/s
+# dell'applicazione e differenza pixel per pixel rispetto all'output del CLAHE.
+
+CLIP_LIMIT = 3.0
+GRID_SIZE = (8, 8)
+
+
+def synthetic_clip(folder, seconds=20):
+    """ Clip di un pozzetto ritagliata dal video sintetico di bench_pipeline.py """
+    from bench_pipeline import make_video, well_boxes
+    raw = os.path.join(folder, 'raw.mp4')
+    make_video(raw, 960, 540, 30, seconds, (0, 0))
+    x1, y1, x2, y2 = well_boxes(960, 540)[0]
+    path = os.path.join(folder, 'well.mp4')
+    cap = cv2.VideoCapture(raw)
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 30, (x2 - x1, y2 - y1))
+    while True:
+        ret, frame = cap.read()
+        if not ret: break
+        out.write(frame[y1:y2, x1:x2])
+    cap.release()
+    out.release()
+    return path
+
+
+def read_frames(path, n):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < n:
+        ret, frame = cap.read()
+        if not ret: break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def measure(fn, frames):
+    """ (frame/s, output) di fn su tutti i frame """
+    fn(frames[0])  # warm-up
+    t0 = time.perf_counter()
+    out = [fn(f) for f in frames]
+    return len(frames) / (time.perf_counter() - t0), out
+
+
+def difference(outputs, reference):
+    """ Media e 99° percentile della differenza assoluta, PSNR rispetto al riferimento """
+    diff = np.concatenate([cv2.absdiff(o, r).ravel() for o, r in zip(outputs, reference)])
+    mse = np.mean(diff.astype(np.float64) ** 2)
+    psnr = float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+    return diff.mean(), np.percentile(diff, 99), psnr
+
+
+def compare(path, n_frames, samples):
+    frames = read_frames(path, n_frames)
+    if not frames:
+        print(f"{os.path.basename(path)}: nessun frame, saltata")
+        return
+    h, w = frames[0].shape[:2]
+    clahe_fps, reference = measure(lambda f: apply_clahe(f, CLIP_LIMIT, GRID_SIZE), frames)
+    print(f"\n{os.path.basename(path)} ({w}x{h}, {len(frames)} frame, 1 thread)")
+    print(f"  {'modalità':<10} {'curva s':>8} {'fr/s':>9} {'x CLAHE':>8} {'diff media':>11} {'diff p99':>9} {'PSNR dB':>8}")
+    print(f"  {'clahe':<10} {'-':>8} {clahe_fps:9.1f} {1.0:8.2f} {'-':>11} {'-':>9} {'-':>8}")
+    for curve in LUT_CURVES:
+        t0 = time.perf_counter()
+        lut = build_lut(path, curve, CLIP_LIMIT, GRID_SIZE, samples)
+        t_lut = time.perf_counter() - t0
+        fps, outputs = measure(lambda f: apply_lut(f, lut), frames)
+        mean, p99, psnr = difference(outputs, reference)
+        print(f"  {curve:<10} {t_lut:8.2f} {fps:9.1f} {fps / clahe_fps:8.2f} {mean:11.2f} {p99:9.0f} {psnr:8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CLAHE per frame contro curva fissa per clip (LUT)")
+    parser.add_argument('clips', nargs='*',
+                        help="Clip o cartelle di clip ritagliate (default: un pozzetto sintetico)")
+    parser.add_argument('--frames', type=int, default=300, help="Frame per clip usati per velocità e differenza")
+    parser.add_argument('--samples', type=int, default=LUT_SAMPLES, help="Frame campionati per ricavare la curva")
+    args = parser.parse_args()
+
+    cv2.setNumThreads(1)
+    paths = []
+    for p in args.clips:
+        paths += [os.path.join(p, f) for f in sorted(list_videos(p))] if os.path.isdir(p) else [p]
+    with tempfile.TemporaryDirectory() as tmp:
+        if not paths:
+            paths = [synthetic_clip(tmp)]
+        for path in paths:
+            compare(path, args.frames, args.samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+import cv2
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+# Benchmark end-to-end della pipeline su video sintetici (griglia 3x5 di pozzetti con
+# un soggetto in movimento ciascuno, drift della camera opzionale). Ogni fase gira in
+# un sottoprocesso separato, così il picco di memoria (RSS) è quello della sola fase;
+# i risultati (frame/s, RSS, byte scritti) finiscono in un JSON confrontabile tra commit.
+# Con --smoke tutte le fasi girano su un video minuscolo e l'uscita è 1 se una fallisce:
+# un controllo veloce (CI) che le chiamate del benchmark seguano le firme degli script.
+
+ROWS, COLS = 3, 5
+STAGES = ['decode', 'rotate', 'crop_static', 'crop_drift', 'crop_drift_auto', 'enhance']
+
+
+def well_boxes(width, height, margin=0.08):
+    """ Box (x1, y1, x2, y2) dei pozzetti sul primo frame, in ordine riga per riga """
+    cw, ch = width / COLS, height / ROWS
+    mx, my = int(cw * margin), int(ch * margin)
+    return [(int(c * cw) + mx, int(r * ch) + my, int((c + 1) * cw) - mx, int((r + 1) * ch) - my)
+            for r in range(ROWS) for c in range(COLS)]
+
+
+def make_video(path, width, height, fps, seconds, drift):
+    """ Video sintetico: pozzetti chiari su fondo rumoroso, un blob scuro che si muove in
+    ognuno e tutta la scena traslata linearmente di drift=(dx, dy) pixel fino all'ultimo frame """
+    n_frames = int(fps * seconds)
+    rng = np.random.default_rng(0)
+    pad = int(max(abs(drift[0]), abs(drift[1]))) + 1
+    scene = rng.integers(20, 60, (height + 2 * pad, width + 2 * pad, 3), dtype=np.uint8)
+    radius = int(min(width / COLS, height / ROWS) * 0.42)
+    centers = [((x1 + x2) // 2 + pad, (y1 + y2) // 2 + pad) for x1, y1, x2, y2 in well_boxes(width, height)]
+    for c in centers:
+        cv2.circle(scene, c, radius, (180, 180, 170), -1)
+
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    for k in range(n_frames):
+        frame = scene.copy()
+        for j, (cx, cy) in enumerate(centers):
+            bx = int(cx + radius * 0.6 * np.cos(k / (9 + j) + j))
+            by = int(cy + radius * 0.6 * np.sin(k / (13 + j) + 2 * j))
+            cv2.ellipse(frame, (bx, by), (max(2, radius // 5), max(1, radius // 9)), k + 20 * j, 0, 360, (30, 25, 20), -1)
+        t = k / max(1, n_frames - 1)
+        ox, oy = pad - int(round(drift[0] * t)), pad - int(round(drift[1] * t))
+        out.write(frame[oy:oy + height, ox:ox + width])
+    out.release()
+    return n_frames
+
+
+def load_script(rel_path, workdir):
+    """ Importa uno script della pipeline con un config_local che punta alla cartella di lavoro """
+    config = types.ModuleType('config_local')
+    config.INPUT_ROTATOR_PATH = workdir
+    config.INPUT_CROPPER_PATH = workdir
+    config.OUTPUT_CROPPER_PATH = os.path.join(workdir, 'cropped')
+    config.EXCEL_META_PATH = os.path.join(workdir, 'meta.csv')
+    sys.modules['config_local'] = config
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(rel_path))[0],
+                                                  os.path.join(ROOT, rel_path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def folder_bytes(folder):
+    return sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder)) if os.path.isdir(folder) else 0
+
+
+def run_stage(stage, video, workdir, meta):
+    """ Esegue una fase nel processo corrente; ritorna (frame elaborati, cartella di output) """
+    boxes = [tuple(b) for b in meta['boxes']]
+    out_dir = os.path.join(workdir, stage)
+    os.makedirs(out_dir, exist_ok=True)
+
+    if stage == 'decode':
+        cap, n = cv2.VideoCapture(video), 0
+        while cap.read()[0]: n += 1
+        cap.release()
+        return n, out_dir
+    if stage == 'rotate':
+        m = load_script('00_video_rotator/rotate.py', workdir)
+        r = m.process_video(video, os.path.join(out_dir, 'proc_bench.mp4'), True, stage)
+    elif stage == 'crop_static':
+        m = load_script('01_video_cropper/crop_static.py', workdir)
+        outs = [os.path.join(out_dir, f"S{j + 1}_bench.mp4") for j in range(len(boxes))]
+        r = m.crop_range(video, outs, 0, None, stage, boxes)
+    elif stage in ('crop_drift', 'crop_drift_auto'):
+        m = load_script('01_video_cropper/crop_drift.py', workdir)
+        outs = [os.path.join(out_dir, f"S{j + 1}_bench.mp4") for j in range(len(boxes))]
+        auto = stage == 'crop_drift_auto'
+        # Stima della traiettoria compresa nel tempo della fase, come in process_job
+        trajectory = m.load_or_estimate(video, m.DRIFT_KEYFRAME_STEP, m.DRIFT_SCALE) if auto else None
+        r = m.crop_range(video, outs, 0, None, stage, boxes, tuple(meta['drift']), not auto, trajectory)
+    elif stage == 'enhance':
+        m = load_script('02_video_enhancer/enhance.py', workdir)
+        clips_dir = os.path.join(workdir, 'crop_static')
+        if not os.path.isdir(clips_dir):
+            raise RuntimeError("enhance richiede l'output della fase crop_static")
+        results = [m.process_clip(os.path.join(clips_dir, f), os.path.join(out_dir, f"enh_{f}"), stage)
+                   for f in sorted(os.listdir(clips_dir))]
+        r = {'ok': all(x['ok'] for x in results), 'frames': sum(x['frames'] for x in results),
+             'error': next((x['error'] for x in results if not x['ok']), None)}
+    else:
+        raise ValueError(f"Fase sconosciuta: {stage}")
+    if not r['ok']:
+        raise RuntimeError(r['error'])
+    return r['frames'], out_dir
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+
+def child_main(args):
+    """ Modalità sottoprocesso: una sola fase, risultato JSON su stdout """
+    with open(os.path.join(args.workdir, 'meta.json')) as f:
+        meta = json.load(f)
+    t0 = time.perf_counter()
+    frames, out_dir = run_stage(args.stage, meta['video'], args.workdir, meta)
+    seconds = time.perf_counter() - t0
+    print(json.dumps({'stage': args.stage, 'frames': frames, 'seconds': round(seconds, 3),
+                      'fps': round(frames / seconds, 1) if seconds > 0 else None,
+                      'peak_rss_mb': peak_rss_mb(), 'output_bytes': folder_bytes(out_dir)}))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end della pipeline su video sintetici")
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--fps', type=float, default=60)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--drift', type=float, nargs=2, default=(24, -12), metavar=('DX', 'DY'),
+                        help="Spostamento della scena all'ultimo frame (pixel)")
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--out', default="bench_results.json", help="File JSON dei risultati")
+    parser.add_argument('--keep', action='store_true', help="Non cancella la cartella di lavoro")
+    parser.add_argument('--compare', help="JSON di un'esecuzione precedente: stampa la variazione di fr/s")
+    parser.add_argument('--smoke', action='store_true',
+                        help="Tutte le fasi su un video minuscolo, uscita 1 se una fallisce (nessun JSON)")
+    parser.add_argument('--stage', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        return child_main(args)
+    if args.smoke:
+        args.width, args.height, args.fps, args.seconds, args.stages = 320, 192, 30, 2, STAGES
+
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    try:
+        video = os.path.join(workdir, 'bench.mp4')
+        print(f"Generazione video {args.width}x{args.height} @ {args.fps:g} fps, {args.seconds:g} s...")
+        n_frames = make_video(video, args.width, args.height, args.fps, args.seconds, args.drift)
+        meta = {'video': video, 'frames': n_frames, 'boxes': well_boxes(args.width, args.height),
+                'drift': list(args.drift)}
+        with open(os.path.join(workdir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        results = []
+        for stage in args.stages:
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--stage', stage, '--workdir', workdir],
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            if proc.returncode != 0:
+                error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "errore"
+                results.append({'stage': stage, 'error': error})
+                print(f"  {stage:<16} ERRORE: {error}")
+                continue
+            r = json.loads(proc.stdout.strip().splitlines()[-1])
+            results.append(r)
+            rss = f"{r['peak_rss_mb']:8.1f} MB" if r['peak_rss_mb'] is not None else "       - MB"
+            print(f"  {stage:<16} {r['frames']:>7} fr  {r['seconds']:>8.2f} s  {r['fps']:>8.1f} fr/s  "
+                  f"{rss}  {r['output_bytes'] / 1024 ** 2:8.1f} MiB")
+    finally:
+        if args.keep: print(f"Cartella di lavoro: {workdir}")
+        else: shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.smoke:
+        failed = [r['stage'] for r in results if 'error' in r]
+        print(f"Smoke test: {len(results) - len(failed)}/{len(results)} fasi ok" +
+              (f", fallite: {', '.join(failed)}" if failed else ""))
+        sys.exit(1 if failed else 0)
+    report = {'commit': git_commit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'platform': platform.platform(), 'python': platform.python_version(), 'opencv': cv2.__version__,
+              'cpus': os.cpu_count(),
+              'video': {'width': args.width, 'height': args.height, 'fps': args.fps, 'seconds': args.seconds,
+                        'drift': list(args.drift), 'wells': ROWS * COLS},
+              'results': results}
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Risultati salvati in {args.out}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+def compare(report, old_path):
+    """ Variazione di frame/s rispetto a un report precedente, fase per fase """
+    with open(old_path) as f:
+        old = json.load(f)
+    old_fps = {r['stage']: r.get('fps') for r in old['results']}
+    print(f"Confronto con {old_path} (commit {old.get('commit')}):")
+    for r in report['results']:
+        before = old_fps.get(r['stage'])
+        if r.get('fps') and before:
+            print(f"  {r['stage']:<16} {before:>8.1f} -> {r['fps']:>8.1f} fr/s  ({(r['fps'] / before - 1) * 100:+.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
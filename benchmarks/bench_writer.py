@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import cv2
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from common.video_io import FfmpegWriter, VIDEO_PRESET, VIDEO_CRF
+
+# Benchmark dei backend di scrittura: fps di codifica e dimensione del file prodotto
+# per mp4v (cv2.VideoWriter) e per i codec ffmpeg in pipe, sugli stessi frame.
+
+CODECS = ['mp4v', 'libx264', 'libx265', 'ffv1']
+
+
+def synthetic_frames(width, height, n):
+    """ Sfondo fisso con rumore leggero e un soggetto scuro che si muove (simile a una clip ritagliata) """
+    rng = np.random.default_rng(0)
+    background = np.full((height, width, 3), 170, np.uint8)
+    cv2.circle(background, (width // 2, height // 2), min(width, height) // 2 - 2, (200, 200, 200), -1)
+    frames = []
+    for k in range(n):
+        frame = background.copy()
+        cx = int(width / 2 + width / 4 * np.cos(k / 15))
+        cy = int(height / 2 + height / 4 * np.sin(k / 11))
+        cv2.ellipse(frame, (cx, cy), (width // 12, height // 20), k * 3, 0, 360, (40, 40, 40), -1)
+        noise = rng.integers(-4, 5, frame.shape, dtype=np.int16)
+        frames.append(np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8))
+    return frames
+
+
+def encode(codec, frames, path, fps):
+    h, w = frames[0].shape[:2]
+    if codec == 'mp4v':
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
+    else:
+        writer = FfmpegWriter(path, fps, (w, h), codec=codec)
+    t0 = time.perf_counter()
+    for f in frames:
+        writer.write(f)
+    writer.release()
+    return len(frames) / (time.perf_counter() - t0), os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encode fps e dimensione output: mp4v vs ffmpeg")
+    parser.add_argument('--width', type=int, default=192)
+    parser.add_argument('--height', type=int, default=180)
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--fps', type=float, default=60)
+    parser.add_argument('--codecs', nargs='+', default=CODECS)
+    args = parser.parse_args()
+
+    frames = synthetic_frames(args.width, args.height, args.frames)
+    has_ffmpeg = shutil.which('ffmpeg') is not None
+    print(f"Frame {args.width}x{args.height} x {args.frames} (preset {VIDEO_PRESET}, CRF {VIDEO_CRF})")
+
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for codec in args.codecs:
+            if codec != 'mp4v' and not has_ffmpeg:
+                print(f"  {codec:<8}: ffmpeg non disponibile")
+                continue
+            path = os.path.join(tmp, "out" + (".mkv" if codec == 'ffv1' else ".mp4"))
+            fps, size = encode(codec, frames, path, args.fps)
+            if codec == 'mp4v': baseline = size
+            ratio = f"  ({size / baseline:.2f}x mp4v)" if baseline else ""
+            print(f"  {codec:<8}: {fps:8.1f} fr/s  {size / 1024:9.1f} KiB{ratio}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+# Moduli condivisi dagli script della pipeline (rotate, crop, enhance).
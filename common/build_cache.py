@@ -0,0 +1,104 @@
+import os
+import json
+import hashlib
+
+from common.checkpoint import write_json_atomic
+from common.work_queue import job_key
+
+# Cache incrementale condivisa da tutte le fasi, al posto dei file di progresso per nome.
+# Ogni job è registrato nella cartella di output (.build_cache/<chiave>.json) con
+# l'impronta del suo video di input (dimensione + blake2b di SAMPLE_BLOCKS blocchi sparsi
+# nel file, senza leggerlo tutto), l'hash dei parametri della fase e le dimensioni degli
+# output scritti. Un job viene saltato solo se impronta, parametri e output su disco
+# coincidono con l'ultima esecuzione riuscita: un video riesportato con lo stesso nome o
+# un RESIZE_FACTOR / CLIP_LIMIT / layout diverso lo rimettono in lavorazione. Quando una
+# fase rigenera un output cambia l'impronta dell'input della fase successiva, che quindi
+# rielabora solo i video toccati.
+
+CACHE_DIR = ".build_cache"
+SAMPLE_BLOCKS = 16       # Blocchi letti per impronta (primo e ultimo compresi)
+BLOCK_SIZE = 64 * 1024   # Byte per blocco: ~1 MB letto per video, qualunque sia la durata
+
+
+def fingerprint(path, blocks=SAMPLE_BLOCKS, block_size=BLOCK_SIZE):
+    """ Impronta veloce del contenuto di un file: 'dimensione-hash dei blocchi campionati' """
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        if size <= blocks * block_size:
+            h.update(f.read())
+        else:
+            for k in range(blocks):
+                f.seek((size - block_size) * k // (blocks - 1))
+                h.update(f.read(block_size))
+    return f"{size}-{h.hexdigest()}"
+
+
+def params_hash(params):
+    """ Hash dei parametri di un job (JSON-serializzabili, tuple = liste) """
+    text = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class BuildCache:
+    """ Registro dei job completati di una fase nella sua cartella di output.
+
+    Un job è descritto da (chiave, video di input, parametri, output): la chiave lo
+    identifica tra un'esecuzione e l'altra (es. job_key('rotate', nome del file)).
+    """
+
+    def __init__(self, output_folder):
+        self.folder = os.path.join(output_folder, CACHE_DIR)
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{job_key(key)}.json")
+
+    def _load(self, key):
+        try:
+            with open(self._path(key), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def fresh(self, key, path_in, params, path_outs):
+        """ True se l'ultima esecuzione riuscita ha stesso input, stessi parametri e output intatti """
+        record = self._load(key)
+        if record is None or record['params'] != params_hash(params):
+            return False
+        if sorted(record['outputs']) != sorted(os.path.basename(p) for p in path_outs):
+            return False
+        for path_out in path_outs:
+            if not os.path.exists(path_out) or os.path.getsize(path_out) != record['outputs'][os.path.basename(path_out)]:
+                return False
+        try:
+            return record['input'] == fingerprint(path_in)
+        except OSError:
+            return False
+
+    def done_input(self, key, path_in):
+        """ True se l'input è già stato elaborato così com'è (parametri del job non ancora noti,
+        es. prima del setup dei box) e gli output registrati esistono ancora """
+        record = self._load(key)
+        if record is None:
+            return False
+        folder = os.path.dirname(self.folder)
+        if not all(os.path.exists(os.path.join(folder, name)) for name in record['outputs']):
+            return False
+        try:
+            return record['input'] == fingerprint(path_in)
+        except OSError:
+            return False
+
+    def record(self, key, path_in, params, path_outs):
+        """ Registra un job appena completato con successo """
+        os.makedirs(self.folder, exist_ok=True)
+        write_json_atomic(self._path(key), {
+            'input': fingerprint(path_in), 'params': params_hash(params),
+            'outputs': {os.path.basename(p): os.path.getsize(p) for p in path_outs}})
+
+    def pending(self, entries):
+        """ Indici delle voci (chiave, input, parametri, output) da rielaborare; stampa quante sono in cache """
+        todo = [i for i, entry in enumerate(entries) if not self.fresh(*entry)]
+        if len(todo) < len(entries):
+            print(f"Cache: {len(entries) - len(todo)} job già aggiornati saltati, {len(todo)} da elaborare.")
+        return todo
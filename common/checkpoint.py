@@ -0,0 +1,149 @@
+import os
+import json
+import time
+
+from common.chunking import segment_path, temp_path, concat_segments, count_frames, publish, remove_output
+from common.parallel import failed_result
+from common.metrics import merge_timings
+
+# Elaborazione resistente ai crash: la coda dei job viene salvata su disco appena
+# configurata, gli output vengono scritti con nomi temporanei e rinominati solo a
+# lavoro finito, e i video lunghi sono elaborati a segmenti di CHECKPOINT_INTERVAL
+# frame registrati in un file di checkpoint, così una ripresa riparte dall'ultimo
+# segmento completato invece che da zero.
+
+# Disattivato di default: senza ffmpeg l'unione dei segmenti ricodifica tutto in mp4v
+# (una seconda codifica con perdita e circa il doppio del tempo della fase 2)
+CHECKPOINT_INTERVAL = 0  # Frame per segmento (es. 18000 = 5 min a 60 fps); 0 = nessun checkpoint
+
+
+def write_json_atomic(path, data):
+    """ Scrive un JSON senza mai lasciare un file troncato (tmp + fsync + rename) """
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_jobs(path):
+    """ Coda dei job salvata da una sessione precedente ([] se assente o illeggibile) """
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f"ATTENZIONE: {path} illeggibile, coda salvata ignorata.")
+        return []
+
+
+def save_jobs(path, jobs):
+    write_json_atomic(path, jobs)
+
+
+def checkpoint_path(path_outs):
+    """ File di checkpoint di un job, accanto al suo primo output """
+    folder, name = os.path.split(path_outs[0])
+    return os.path.join(folder, f".ckpt_{name}.json")
+
+
+def _load_checkpoint(path, params, path_outs):
+    """ Stato salvato se appartiene allo stesso job e i suoi segmenti sono ancora su disco """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('params') != params:
+        return None
+    for path_out in path_outs:
+        segments = [segment_path(path_out, k) for k in range(len(state['segments']))]
+        # Un output può mancare dei segmenti solo se è già stato unito e rinominato
+        if not all(os.path.exists(s) for s in segments) and not (state['done'] and os.path.exists(path_out)):
+            return None
+    return state
+
+
+def _run_direct(range_fn, path_in, path_outs, desc_text):
+    tmp_outs = [temp_path(p) for p in path_outs]
+    try:
+        stats = range_fn(path_in, tmp_outs, 0, None, desc_text)
+        if stats['ok']:
+            for tmp, path_out in zip(tmp_outs, path_outs):
+                publish(tmp, path_out)
+        return stats
+    finally:
+        for tmp in tmp_outs:
+            remove_output(tmp)
+
+
+def _run_segments(range_fn, path_in, path_outs, desc_text, interval, params):
+    ckpt_file = checkpoint_path(path_outs)
+    state = _load_checkpoint(ckpt_file, params, path_outs)
+    if state is None:
+        state = {'params': params, 'segments': [], 'done': False}
+    elif state['segments']:
+        print(f"Ripresa di {os.path.basename(path_in)} dal frame {state['segments'][-1]['end']}")
+
+    while not state['done']:
+        k = len(state['segments'])
+        start = state['segments'][-1]['end'] if k else 0
+        seg_outs = [segment_path(p, k) for p in path_outs]
+        r = range_fn(path_in, seg_outs, start, start + interval, f"{desc_text} @{start}")
+        if r['frames'] == 0 and k > 0:
+            # Il video finiva esattamente sul bordo del segmento precedente
+            for seg in seg_outs:
+                remove_output(seg)
+            state['done'] = True
+        elif not r['ok']:
+            raise RuntimeError(r['error'])
+        else:
+            state['segments'].append({'start': start, 'end': start + r['frames'], 'written': r['written'],
+                                      'timings': r.get('timings', {})})
+            state['done'] = r['frames'] < interval
+        write_json_atomic(ckpt_file, state)
+
+    n_segments = len(state['segments'])
+    for j, path_out in enumerate(path_outs):
+        segments = [segment_path(path_out, k) for k in range(n_segments)]
+        if not all(os.path.exists(s) for s in segments):
+            continue  # già unito prima di un'interruzione
+        if n_segments == 1:
+            publish(segments[0], temp_path(path_out))
+        else:
+            expected = sum(seg['written'][j] for seg in state['segments'])
+            concat_segments(segments, temp_path(path_out))
+            written = count_frames(temp_path(path_out))
+            if written != expected:
+                raise RuntimeError(f"{os.path.basename(path_out)}: {written} frame dopo l'unione, attesi {expected}")
+        publish(temp_path(path_out), path_out)
+    os.remove(ckpt_file)
+    return state
+
+
+def run_checkpointed(range_fn, path_in, path_outs, desc_text, interval=CHECKPOINT_INTERVAL, params=None):
+    """ Elabora un video a segmenti consecutivi di interval frame, riprendendo da un
+    eventuale checkpoint, e pubblica gli output con un rename atomico.
+
+    range_fn ha la stessa firma usata da run_chunked; params (JSON-serializzabile)
+    identifica il job: un checkpoint con parametri diversi viene scartato.
+    """
+    t_start = time.time()
+    params = json.loads(json.dumps(params))
+
+    try:
+        if interval <= 0:
+            # Nessun checkpoint: solo scrittura su nomi temporanei + rename
+            return _run_direct(range_fn, path_in, path_outs, desc_text)
+        state = _run_segments(range_fn, path_in, path_outs, desc_text, interval, params)
+    except Exception as e:
+        # Il checkpoint resta su disco: la prossima esecuzione riparte da qui
+        return failed_result(path_in, f"{type(e).__name__}: {e}")
+
+    frames = state['segments'][-1]['end'] if state['segments'] else 0
+    return {'file': os.path.basename(path_in), 'ok': True, 'frames': frames, 'seconds': time.time() - t_start,
+            'error': None, 'timings': merge_timings(state['segments'])}
@@ -0,0 +1,198 @@
+import os
+import csv
+import time
+import shutil
+import subprocess
+import cv2
+
+from common.parallel import run_parallel, failed_result
+from common.metrics import merge_timings
+
+# Modalità a blocchi temporali: un singolo video lungo viene diviso in intervalli
+# di frame contigui, elaborati da processi diversi e poi riuniti in un unico file.
+# L'unione è una copia dello stream con ffmpeg: senza ffmpeg ogni video viene elaborato
+# in un solo blocco, perché unire i blocchi con OpenCV vorrebbe dire ricodificarli
+# (una seconda codifica con perdita, output diverso da quello sequenziale).
+
+_warned_no_ffmpeg = False
+
+
+def split_ranges(total_frames, n_chunks, align=1):
+    """ Divide [0, total_frames) in intervalli contigui (start, end).
+
+    Gli inizi sono multipli di align (es. FRAME_SKIP, così il frame skipping resta
+    identico a quello sequenziale). L'ultimo intervallo ha end=None e legge fino
+    alla fine del file: CAP_PROP_FRAME_COUNT è solo una stima per alcuni container.
+    """
+    if total_frames <= 0 or n_chunks <= 1:
+        return [(0, None)]
+    size = -(-total_frames // n_chunks)          # ceil
+    size = -(-size // align) * align             # arrotondato a multiplo di align
+    starts = list(range(0, total_frames, size))
+    return [(s, starts[k + 1] if k + 1 < len(starts) else None) for k, s in enumerate(starts)]
+
+
+def open_at(path_in, start):
+    """ VideoCapture posizionato esattamente sul frame start """
+    cap = cv2.VideoCapture(path_in)
+    if start > 0 and cap.isOpened():
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != start:
+            # Seek non affidabile per questo file: riapriamo e avanziamo a grab()
+            cap.release()
+            cap = cv2.VideoCapture(path_in)
+            for _ in range(start):
+                if not cap.grab(): break
+    return cap
+
+
+def segment_path(path_out, k):
+    """ Nome del segmento k di un output (file nascosto nella stessa cartella) """
+    folder, name = os.path.split(path_out)
+    return os.path.join(folder, f".seg{k:03d}_{name}")
+
+
+def temp_path(path_out):
+    """ Nome temporaneo di un output, rinominato atomicamente a lavoro finito """
+    folder, name = os.path.split(path_out)
+    return os.path.join(folder, f".tmp_{name}")
+
+
+def index_path(path_out):
+    """ Indice dei frame di una clip (<clip>_frames.csv, scritto dai crop con MOTION_GATE) """
+    return os.path.splitext(path_out)[0] + "_frames.csv"
+
+
+def publish(path_tmp, path_out):
+    """ Rinomina un output finito (con il suo indice dei frame, se c'è) sul nome finale """
+    if os.path.exists(index_path(path_tmp)):
+        os.replace(index_path(path_tmp), index_path(path_out))
+    os.replace(path_tmp, path_out)
+
+
+def remove_output(path):
+    """ Cancella un output temporaneo o un segmento e il suo indice dei frame """
+    for p in (path, index_path(path)):
+        if os.path.exists(p): os.remove(p)
+
+
+def concat_index(segments, path_out):
+    """ Unisce gli indici dei frame dei segmenti rinumerando i frame di output """
+    if not all(os.path.exists(index_path(seg)) for seg in segments):
+        return
+    with open(index_path(path_out), 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['frame', 'source_frame', 'time_s'])
+        n = 0
+        for seg in segments:
+            with open(index_path(seg), 'r', newline='') as g:
+                for row in list(csv.reader(g))[1:]:
+                    w.writerow([n] + row[1:])
+                    n += 1
+
+
+def count_frames(path):
+    cap = cv2.VideoCapture(path)
+    n = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return n
+
+
+def concat_segments(segments, path_out):
+    """ Concatena i segmenti in ordine in path_out (con i loro indici dei frame) e li cancella.
+
+    Con ffmpeg disponibile è una copia dello stream (nessuna ricodifica); altrimenti
+    i segmenti vengono decodificati e ricodificati in mp4v con OpenCV: una seconda
+    codifica con perdita, i pixel non sono più quelli dell'elaborazione in un passaggio.
+    """
+    concat_index(segments, path_out)
+    if shutil.which('ffmpeg'):
+        list_path = path_out + ".segments.txt"
+        with open(list_path, 'w') as f:
+            for seg in segments:
+                f.write("file '{}'\n".format(os.path.abspath(seg).replace("'", "'\\''")))
+        try:
+            subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                            '-i', list_path, '-c', 'copy', path_out], check=True)
+        finally:
+            os.remove(list_path)
+    else:
+        out = None
+        try:
+            for seg in segments:
+                cap = cv2.VideoCapture(seg)
+                if out is None:
+                    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+                    out = cv2.VideoWriter(path_out, cv2.VideoWriter_fourcc(*'mp4v'), cap.get(cv2.CAP_PROP_FPS), size)
+                while True:
+                    ret, frame = cap.read()
+                    if not ret: break
+                    out.write(frame)
+                cap.release()
+        finally:
+            if out is not None: out.release()
+
+    for seg in segments:
+        remove_output(seg)
+
+
+def run_chunked(range_fn, path_in, path_outs, desc_text, n_chunks, align=1):
+    """ Elabora un video a blocchi su n_chunks processi e riunisce gli output.
+
+    range_fn(path_in, seg_outs, start, end, desc, position=p) elabora i frame
+    [start, end) scrivendo un segmento per ogni output e ritorna le statistiche
+    del job con 'written' = frame scritti per ciascun output. Senza ffmpeg il video
+    è elaborato in un solo blocco (avviso alla prima chiamata).
+    """
+    global _warned_no_ffmpeg
+    if n_chunks > 1 and not shutil.which('ffmpeg'):
+        if not _warned_no_ffmpeg:
+            print("ATTENZIONE: ffmpeg non trovato, i blocchi andrebbero ricodificati per unirli: --chunks ignorato.")
+            _warned_no_ffmpeg = True
+        n_chunks = 1
+    t_start = time.time()
+    cap = cv2.VideoCapture(path_in)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    ranges = split_ranges(total_frames, n_chunks, align)
+    segments = [[segment_path(p, k) for k in range(len(ranges))] for p in path_outs]
+    jobs = [(path_in, [segs[k] for segs in segments], start, end, f"{desc_text} [{k+1}/{len(ranges)}]")
+            for k, (start, end) in enumerate(ranges)]
+
+    results = run_parallel(range_fn, jobs, len(jobs))
+    stats = {'file': os.path.basename(path_in), 'ok': False, 'frames': sum(r['frames'] for r in results),
+             'seconds': 0.0, 'error': None, 'timings': merge_timings(results)}
+
+    errors = [r['error'] for r in results if not r['ok']]
+    try:
+        if errors:
+            raise RuntimeError(errors[0])
+
+        # Controllo giunzioni: ogni blocco deve aver letto esattamente il suo intervallo
+        results.sort(key=lambda r: r['start'])
+        for (start, end), r in zip(ranges, results):
+            if end is not None and r['frames'] != end - start:
+                raise RuntimeError(f"Blocco {start}-{end}: letti {r['frames']} frame invece di {end - start}")
+
+        for j, path_out in enumerate(path_outs):
+            expected = sum(r['written'][j] for r in results)
+            if len(ranges) == 1:
+                publish(segments[j][0], temp_path(path_out))
+            else:
+                concat_segments(segments[j], temp_path(path_out))
+            written = count_frames(temp_path(path_out))
+            if written != expected:
+                remove_output(temp_path(path_out))
+                raise RuntimeError(f"{os.path.basename(path_out)}: {written} frame dopo l'unione, attesi {expected}")
+            publish(temp_path(path_out), path_out)
+        stats['ok'] = True
+    except Exception as e:
+        stats = failed_result(path_in, f"{type(e).__name__}: {e}")
+    finally:
+        for segs in segments:
+            for seg in segs:
+                remove_output(seg)
+
+    stats['seconds'] = time.time() - t_start
+    return stats
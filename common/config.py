@@ -0,0 +1,18 @@
+# Impostazioni opzionali lette da config_local.py: ogni modulo chiede il valore
+# con un default, così un config_local che non le definisce continua a funzionare.
+try:
+    import config_local
+except ImportError:
+    config_local = None
+
+
+def setting(name, default):
+    """ Valore di name in config_local.py, default se assente """
+    return getattr(config_local, name, default)
+
+
+# Parametri condivisi tra le fasi separate e 03_fused_pipeline, definiti una volta sola
+# perché le clip di fused.py coincidano con quelle di rotate -> crop -> enhance
+RESIZE_FACTOR = setting('RESIZE_FACTOR', 0.5)  # 0.5 = Dimezza risoluzione (1080p -> 540p)
+FRAME_SKIP = setting('FRAME_SKIP', 2)          # 2 = 30fps (da 60fps originali)
+VIDEO_FPS = setting('VIDEO_FPS', 60)           # Frame rate scritto nelle clip dei soggetti
@@ -0,0 +1,167 @@
+import os
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from common.transforms import resize_frame
+
+# Stima automatica del drift della camera: i keyframe (uno ogni `step` frame) vengono
+# registrati contro il primo frame con la phase correlation a risoluzione ridotta e
+# la traiettoria (dx, dy) per frame è l'interpolazione lineare tra i keyframe.
+
+CACHE_SUFFIX = ".drift.npz"
+SEEK_MIN_STEP = 30     # Sotto questo passo conviene grab() sequenziale invece del seek
+MIN_RESPONSE = 0.05    # Picco minimo della phase correlation per fidarsi di un keyframe
+JUMP_PX = 3.0          # Differenza tra keyframe oltre la quale si cerca un salto della camera
+
+
+def cache_path(video_path, cache_dir):
+    """ File della traiettoria di un video in cache_dir (non accanto al video: la cartella
+    di input può essere in sola lettura, es. share di rete o SD card) """
+    return os.path.join(cache_dir, os.path.splitext(os.path.basename(video_path))[0] + CACHE_SUFFIX)
+
+
+def _prepare(frame, scale):
+    h, w = frame.shape[:2]
+    small = resize_frame(frame, (max(1, int(w * scale)), max(1, int(h * scale))))
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+
+def estimate_trajectory(video_path, step=60, scale=0.25, desc=None):
+    """ Ritorna un array (total_frames, 2) float32 con lo spostamento (dx, dy) in pixel
+    del contenuto di ogni frame rispetto al primo (stesso verso del drift manuale).
+
+    Dove due keyframe vicini differiscono più di JUMP_PX e il punto medio non è sulla
+    retta tra i due (salto della camera), l'intervallo viene bisecato fino al frame.
+    """
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    ret, frame = cap.read()
+    if not ret or total_frames <= 0:
+        cap.release()
+        raise IOError(f"Impossibile leggere {video_path}")
+
+    reference = _prepare(frame, scale)
+    window = cv2.createHanningWindow(reference.shape[::-1], cv2.CV_32F)
+    pos = 1  # prossimo frame che la read() restituirebbe
+
+    def register(idx):
+        nonlocal pos
+        if idx < pos or idx - pos >= SEEK_MIN_STEP:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+        else:
+            while pos < idx and cap.grab(): pos += 1
+        ret, frame = cap.read()
+        pos = idx + 1
+        if not ret:
+            return None
+        (dx, dy), response = cv2.phaseCorrelate(reference, _prepare(frame, scale), window)
+        if response < MIN_RESPONSE:
+            return None  # keyframe poco affidabile (blur, luce): lo si interpola dai vicini
+        return np.array([dx / scale, dy / scale])
+
+    keyframes = list(range(step, total_frames, step))
+    if total_frames > 1 and total_frames - 1 not in keyframes:
+        keyframes.append(total_frames - 1)
+
+    samples = {0: np.zeros(2)}
+    for idx in tqdm(keyframes, desc=desc or f"Drift {os.path.basename(video_path)}", unit='kf', leave=False):
+        shift = register(idx)
+        if shift is not None:
+            samples[idx] = shift
+
+    # Raffinamento dei salti
+    known = sorted(samples)
+    pending = list(zip(known[:-1], known[1:]))
+    while pending:
+        a, b = pending.pop()
+        if b - a <= 1 or np.abs(samples[b] - samples[a]).max() <= JUMP_PX:
+            continue
+        m = (a + b) // 2
+        shift = register(m)
+        if shift is None:
+            continue
+        samples[m] = shift
+        linear = samples[a] + (samples[b] - samples[a]) * (m - a) / (b - a)
+        if np.abs(shift - linear).max() > 1.0:
+            pending += [(a, m), (m, b)]
+    cap.release()
+
+    kf_idx = sorted(samples)
+    kf_shift = np.array([samples[k] for k in kf_idx])
+    frames = np.arange(total_frames)
+    trajectory = np.stack([np.interp(frames, kf_idx, kf_shift[:, 0]),
+                           np.interp(frames, kf_idx, kf_shift[:, 1])], axis=1)
+    return trajectory.astype(np.float32)
+
+
+def load_or_estimate(video_path, step=60, scale=0.25, cache_dir=None):
+    """ Traiettoria dalla cache in cache_dir (None = nessuna cache), ricalcolata se il video o
+    i parametri sono cambiati. La cache viene scritta su un nome temporaneo e rinominata: un
+    lettore non vede mai un file a metà. Una scrittura fallita non ferma il job. """
+    if cache_dir is None:
+        return estimate_trajectory(video_path, step, scale)
+    path = cache_path(video_path, cache_dir)
+    stat = os.stat(video_path)
+    signature = np.array([stat.st_size, int(stat.st_mtime), step, int(scale * 1000)], dtype=np.int64)
+
+    if os.path.exists(path):
+        try:
+            with np.load(path) as data:
+                if np.array_equal(data['signature'], signature):
+                    return data['trajectory']
+        except Exception:
+            pass  # cache illeggibile (anche zip troncato): si ricalcola
+
+    trajectory = estimate_trajectory(video_path, step, scale)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(tmp, 'wb') as f:
+            np.savez(f, trajectory=trajectory, signature=signature)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"ATTENZIONE: cache del drift non salvata ({e}), verrà ricalcolata.")
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+    return trajectory
+
+
+def frame_shifts(start, stop, total_frames, total_drift=(0, 0), drift_calculated=False, trajectory=None):
+    """ Spostamento intero (dx, dy) dei frame [start, stop): array (stop - start, 2) int32.
+
+    Traiettoria automatica arrotondata (oltre la fine vale l'ultimo valore), altrimenti
+    drift lineare totale * (indice + 1) / total_frames troncato verso zero, altrimenti 0.
+    """
+    idx = np.arange(start, stop)
+    if trajectory is not None:
+        return np.rint(trajectory[np.minimum(idx, len(trajectory) - 1)]).astype(np.int32)
+    if drift_calculated and total_frames > 0:
+        progress = (idx + 1) / total_frames
+        return np.stack([np.trunc(total_drift[0] * progress), np.trunc(total_drift[1] * progress)],
+                        axis=1).astype(np.int32)
+    return np.zeros((len(idx), 2), dtype=np.int32)
+
+
+def crop_windows(boxes, shifts):
+    """ Finestre (x1, y1, x2, y2) di ogni box su ogni frame: array (frame, box, 4) int32 """
+    boxes = np.asarray(boxes, dtype=np.int32)
+    return boxes[None, :, :] + np.tile(shifts, (1, 2))[:, None, :]
+
+
+def inside_frame(windows, width, height):
+    """ Maschera (frame, box): True se la finestra è tutta dentro il frame """
+    return ((windows[..., 0] >= 0) & (windows[..., 1] >= 0) &
+            (windows[..., 2] <= width) & (windows[..., 3] <= height))
+
+
+def pad_crop(frame, window, out):
+    """ Copia in out (buffer preallocato della dimensione del box) la parte di window
+    dentro il frame; il resto resta nero, così il soggetto non viene deformato """
+    x1, y1, x2, y2 = window
+    h, w = frame.shape[:2]
+    sx1, sy1, sx2, sy2 = max(x1, 0), max(y1, 0), min(x2, w), min(y2, h)
+    out[:] = 0
+    if sx2 > sx1 and sy2 > sy1:
+        out[sy1 - y1:sy2 - y1, sx1 - x1:sx2 - x1] = frame[sy1:sy2, sx1:sx2]
+    return out
@@ -0,0 +1,86 @@
+import os
+import time
+import shutil
+import tempfile
+import subprocess
+from tqdm import tqdm
+
+from common.video_io import encoder_args, GRAYSCALE
+from common.chunking import temp_path, count_frames
+from common.parallel import failed_result
+
+# Modalità offload: i job che non richiedono Python su ogni pixel (crop statico,
+# rotazione/resize/frame skip) vengono tradotti in un unico filtergraph ffmpeg ed
+# eseguiti nativamente, una decodifica e N codifiche nello stesso processo.
+# In modalità GRAYSCALE il grafo converte in grigio come primo filtro (come FrameReader).
+
+
+def _source(gray):
+    """ Ingresso del grafo: il video decodificato, in grigio con gray=True """
+    return "[0:v]format=gray," if gray else "[0:v]"
+
+
+def available():
+    return shutil.which('ffmpeg') is not None
+
+
+def crop_graph(boxes, fps, gray=GRAYSCALE):
+    """ split -> crop per box -> timestamp a fps fissi (come cv2.VideoWriter a VIDEO_FPS) """
+    final_filter, _ = encoder_args(gray=gray)
+    chains = [_source(gray) + "split={}{}".format(len(boxes), ''.join(f"[s{j}]" for j in range(len(boxes))))]
+    for j, (x1, y1, x2, y2) in enumerate(boxes):
+        chain = f"[s{j}]crop={x2 - x1}:{y2 - y1}:{x1}:{y1},setpts=N/({fps}*TB)"
+        if final_filter: chain += "," + final_filter
+        chains.append(chain + f"[o{j}]")
+    return ';'.join(chains)
+
+
+def rotate_graph(frame_skip, new_size, should_rotate, fps, gray=GRAYSCALE):
+    """ Frame skip -> resize (area) -> rotazione 180° (stesso ordine di prepare_frame) """
+    final_filter, _ = encoder_args(gray=gray)
+    chain = _source(gray) + f"select=not(mod(n\\,{frame_skip})),scale={new_size[0]}:{new_size[1]}:flags=area"
+    if should_rotate: chain += ",hflip,vflip"
+    chain += f",setpts=N/({fps}*TB)"
+    if final_filter: chain += "," + final_filter
+    return chain + "[o0]"
+
+
+def run_graph(path_in, graph, path_outs, fps, total_frames, desc_text, position=0):
+    """ Esegue il filtergraph (uscite [o0], [o1], ... nell'ordine di path_outs) scrivendo
+    su nomi temporanei poi rinominati. Ritorna le statistiche del job (mai un'eccezione). """
+    t_start = time.time()
+    _, args = encoder_args()
+    tmp_outs = [temp_path(p) for p in path_outs]
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-nostats', '-progress', 'pipe:1',
+           '-i', path_in, '-filter_complex', graph]
+    for j, tmp in enumerate(tmp_outs):
+        cmd += ['-map', f"[o{j}]", '-an', '-r', str(fps)] + args + [tmp]
+
+    try:
+        # stderr su file e non in pipe: letto solo a fine lettura di stdout, una pipe piena
+        # bloccherebbe ffmpeg (come in FfmpegWriter)
+        with tempfile.TemporaryFile() as stderr:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True)
+            with tqdm(total=total_frames, desc=desc_text, unit='fr', ncols=100,
+                      position=position, leave=(position == 0)) as pbar:
+                # -progress scrive blocchi chiave=valore; 'frame' conta i frame della prima uscita
+                for line in proc.stdout:
+                    if line.startswith('frame='):
+                        pbar.n = min(int(line.split('=')[1]), total_frames)
+                        pbar.refresh()
+            code = proc.wait()
+            stderr.seek(0)
+            err = stderr.read().decode(errors='replace').strip()
+        if code != 0:
+            raise IOError(f"ffmpeg: {err[-2000:]}")
+        written = [count_frames(tmp) for tmp in tmp_outs]
+        for tmp, path_out in zip(tmp_outs, path_outs):
+            os.replace(tmp, path_out)
+    except Exception as e:
+        return failed_result(path_in, f"{type(e).__name__}: {e}")
+    finally:
+        for tmp in tmp_outs:
+            if os.path.exists(tmp): os.remove(tmp)
+
+    return {'file': os.path.basename(path_in), 'ok': True, 'frames': total_frames,
+            'seconds': time.time() - t_start, 'error': None, 'start': 0, 'written': written}
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# Accesso casuale veloce ai frame per le finestre di setup dei cropper:
+# - cache LRU dei frame già decodificati (tornare su un frame visto è istantaneo)
+# - indice di frame campionati uniformemente, costruito in background, che dà
+#   un'anteprima immediata durante lo scrubbing mentre il frame esatto arriva dopo
+
+FRAME_CACHE_SIZE = 32   # Frame decodificati tenuti in memoria
+INDEX_POINTS = 48       # Punti dell'indice di scrubbing (0 = nessun indice)
+SCRUB_SETTLE = 0.15     # Secondi di trackbar ferma prima di decodificare il frame esatto
+
+
+class FrameCache:
+    """ Frame di un video per indice, con cache LRU e indice di scrubbing in background """
+
+    def __init__(self, video_path, capacity=FRAME_CACHE_SIZE, index_points=INDEX_POINTS, info=None):
+        """ info: anteprima già pronta (common.prefetch.load_preview); in quel caso il
+        video viene aperto solo alla prima richiesta di un frame non ancora in memoria """
+        self.path = video_path
+        self._cap = None
+        self._next = 0  # frame che la prossima read() restituirebbe (niente seek se sequenziale)
+        self._capacity = capacity
+        self._lru = OrderedDict()
+        if info is None:
+            self._open()
+            self.total_frames = int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        else:
+            self.total_frames = info['total_frames']
+            for idx, frame in info['frames'].items():
+                self.put(idx, frame)
+        self._index = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if index_points > 0 and self.total_frames > 1:
+            positions = np.unique(np.linspace(0, self.total_frames - 1, index_points).astype(int))
+            self._thread = threading.Thread(target=self._build_index, args=(positions,), daemon=True)
+            self._thread.start()
+
+    def _open(self):
+        self._cap = cv2.VideoCapture(self.path)
+        self._next = 0
+
+    def isOpened(self):
+        return self._cap.isOpened() if self._cap is not None else bool(self._lru)
+
+    def _build_index(self, positions):
+        # VideoCapture separato: quello principale non è thread-safe
+        cap = cv2.VideoCapture(self.path)
+        for idx in positions:
+            if self._stop.is_set(): break
+            cap.set(cv2.CAP_PROP_POS_FRAMES, int(idx))
+            ret, frame = cap.read()
+            if ret:
+                with self._lock:
+                    self._index[int(idx)] = frame
+        cap.release()
+
+    def put(self, idx, frame):
+        """ Inserisce un frame già decodificato altrove (es. dal prefetch) """
+        self._lru[idx] = frame
+        self._lru.move_to_end(idx)
+        while len(self._lru) > self._capacity:
+            self._lru.popitem(last=False)
+
+    def get(self, idx):
+        """ Frame esatto idx (None se non leggibile) """
+        if self.total_frames > 0:
+            idx = max(0, min(idx, self.total_frames - 1))
+        if idx in self._lru:
+            self._lru.move_to_end(idx)
+            return self._lru[idx]
+        with self._lock:
+            frame = self._index.get(idx)
+        if frame is None:
+            if self._cap is None:
+                self._open()
+            if idx != self._next:
+                self._cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+            ret, frame = self._cap.read()
+            if not ret:
+                return None
+            self._next = idx + 1
+        self.put(idx, frame)
+        return frame
+
+    def peek(self, idx):
+        """ (indice, frame) senza decodificare: il frame esatto se in memoria,
+        altrimenti il punto dell'indice più vicino; (None, None) se non c'è niente """
+        if idx in self._lru:
+            return idx, self._lru[idx]
+        with self._lock:
+            if not self._index:
+                return None, None
+            nearest = min(self._index, key=lambda k: abs(k - idx))
+            return nearest, self._index[nearest]
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._cap is not None:
+            self._cap.release()
+
+
+class ScrubView:
+    """ Stato di visualizzazione di una finestra di setup: frame richiesto, frame mostrato
+    e flag 'dirty' che indica quando ricomporre l'immagine (niente ridisegni a vuoto). """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.target = 0           # frame richiesto (trackbar / tasti)
+        self.shown = None         # frame effettivamente a schermo
+        self.dirty = True
+        self._changed_at = 0.0
+        self._base = None         # frame mostrato già ridimensionato per il display
+        self._base_key = None
+
+    def seek(self, idx):
+        self.target = idx
+        self._changed_at = time.time()
+        self.dirty = True
+
+    def tick(self):
+        """ Da chiamare a ogni giro del loop: se lo scrubbing si è fermato su un frame
+        approssimato, segna il ridisegno con il frame esatto """
+        if self.shown != self.target and time.time() - self._changed_at >= SCRUB_SETTLE:
+            self.dirty = True
+
+    def frame(self):
+        """ (indice, frame) da mostrare: esatto se lo scrubbing è fermo, altrimenti il più vicino disponibile """
+        settled = time.time() - self._changed_at >= SCRUB_SETTLE
+        idx, frame = self.cache.peek(self.target)
+        if frame is None or (idx != self.target and settled):
+            idx, frame = self.target, self.cache.get(self.target)
+        self.shown = idx
+        return idx, frame
+
+    def base(self, frame, idx, scale):
+        """ Frame ridimensionato per il display, ricalcolato solo quando cambia il frame """
+        if self._base_key != (idx, scale):
+            h, w = frame.shape[:2]
+            self._base = cv2.resize(frame, (int(w * scale), int(h * scale)))
+            self._base_key = (idx, scale)
+        return self._base.copy()
@@ -0,0 +1,38 @@
+import json
+import time
+
+from common.checkpoint import write_json_atomic
+
+# Manifest del setup: le decisioni prese nella fase 1 interattiva (finestre OpenCV sul
+# desktop dell'operatore) salvate in un JSON autosufficiente, che la fase 2 può eseguire
+# altrove con headless/run_manifest.py (server senza display né config_local.py).
+# I video sono indicati solo per nome: le cartelle di input e output si scelgono al
+# momento dell'esecuzione, così lo stesso manifest vale su macchine diverse.
+
+MANIFEST_VERSION = 1
+STAGES = ('rotate', 'crop_static', 'crop_drift')
+
+
+def write_manifest(path, stage, jobs, settings):
+    """ Salva i job di una fase con le impostazioni dello script che li ha configurati.
+
+    jobs: lista di dict JSON-serializzabili con almeno 'file' (nome del video);
+    settings: costanti dello script da riapplicare in esecuzione (es. FRAME_SKIP).
+    """
+    write_json_atomic(path, {'version': MANIFEST_VERSION, 'stage': stage,
+                             'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                             'settings': settings, 'jobs': jobs})
+    print(f"Manifest ({len(jobs)} job) salvato in {path}")
+
+
+def read_manifest(path):
+    """ Manifest letto e validato; ValueError se non è utilizzabile """
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(f"{path}: versione {manifest.get('version')} non supportata (attesa {MANIFEST_VERSION})")
+    if manifest.get('stage') not in STAGES:
+        raise ValueError(f"{path}: fase sconosciuta {manifest.get('stage')!r}")
+    if not all('file' in job for job in manifest.get('jobs', [])):
+        raise ValueError(f"{path}: job senza campo 'file'")
+    return manifest
@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter
+
+from common.config import setting
+
+# Strumentazione dei loop sui frame: tempi cumulativi per fase (decodifica,
+# trasformazioni, scrittura/attesa dell'encoder), un record JSON per video in
+# METRICS_FILE e un profiler a campionamento opzionale (--profile).
+
+METRICS_FILE = setting('METRICS_FILE', "metrics.jsonl")  # None = nessun record
+PROFILE_INTERVAL = 0.005                                 # Secondi tra due campioni del profiler
+
+
+class StageTimer:
+    """ Tempi cumulativi per fase: mark(nome) attribuisce a nome il tempo trascorso
+    dall'ultimo mark, così ogni fase del loop costa una sola chiamata a perf_counter """
+
+    def __init__(self):
+        self.totals = Counter()
+        self._last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.totals[stage] += now - self._last
+        self._last = now
+
+    def skip(self):
+        """ Riparte da adesso senza attribuire il tempo trascorso (es. aggiornamento tqdm) """
+        self._last = time.perf_counter()
+
+    def add(self, stage, seconds):
+        self.totals[stage] += seconds
+
+    def as_dict(self):
+        return {k: round(v, 3) for k, v in sorted(self.totals.items())}
+
+
+def merge_timings(results):
+    """ Somma i tempi per fase di più risultati (blocchi o segmenti dello stesso video) """
+    total = Counter()
+    for r in results:
+        total.update(r.get('timings') or {})
+    return {k: round(v, 3) for k, v in sorted(total.items())}
+
+
+def record(script, stats):
+    """ Aggiunge a METRICS_FILE una riga JSON con le statistiche di un video """
+    if not METRICS_FILE:
+        return
+    fps = stats['frames'] / stats['seconds'] if stats.get('seconds') else 0.0
+    entry = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'script': script, 'file': stats['file'],
+             'ok': stats['ok'], 'frames': stats['frames'], 'seconds': round(stats.get('seconds', 0.0), 3),
+             'fps': round(fps, 1), 'timings': stats.get('timings', {}), 'error': stats.get('error')}
+    # Una write() per riga in append: righe intere anche con più processi
+    with open(METRICS_FILE, 'a') as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+class SamplingProfiler:
+    """ Profiler statistico: un thread campiona lo stack di tutti gli altri thread
+    ogni PROFILE_INTERVAL secondi (sys._current_frames), senza rallentare il codice
+    misurato come farebbe cProfile. Il report è nel formato "stack compresso"
+    (una riga 'f1;f2;f3 N' per stack), leggibile da flamegraph.pl / speedscope. """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            names.update({t.ident: t.name for t in threading.enumerate()})
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, path):
+        """ Scrive gli stack compressi in path e stampa le funzioni con più campioni propri """
+        with open(path, 'w') as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+        # Riepilogo sul solo thread principale: gli encoder in attesa sulla coda
+        # riempirebbero la classifica di campioni "idle"
+        own = Counter()
+        for stack, n in self.stacks.items():
+            if stack.startswith('MainThread;'):
+                own[stack.rsplit(';', 1)[-1]] += n
+        total = sum(own.values()) or 1
+        print(f"\nProfilo ({self.samples} campioni) salvato in {path}")
+        for func, n in own.most_common(10):
+            print(f"  {100 * n / total:5.1f}%  {func}")
+
+
+def start_profiler(enabled):
+    """ Profiler avviato solo se richiesto (--profile), altrimenti None """
+    return SamplingProfiler().start() if enabled else None
+
+
+def stop_profiler(profiler, folder, script):
+    if profiler is None:
+        return
+    profiler.stop()
+    profiler.dump(os.path.join(folder, f"profile_{script}_{time.strftime('%Y%m%d_%H%M%S')}.txt"))
@@ -0,0 +1,84 @@
+import csv
+import cv2
+
+from common.chunking import index_path
+
+# Riduzione dei frame statici nelle clip dei soggetti (es. insetti immobili in chill coma):
+# per ogni soggetto il crop viene ridotto di MOTION_SCALE, convertito in grigio e confrontato
+# con l'ultimo frame tenuto. C'è movimento se più di MOTION_FRACTION dei pixel cambia di
+# oltre PIXEL_DELTA livelli; si tengono i frame con movimento, i MOTION_HOLD successivi e,
+# nei tratti fermi, un frame ogni STATIC_KEEP_EVERY. Accanto a ogni clip viene scritto
+# <clip>_frames.csv (frame di output -> frame e tempo del video di input) per riallineare
+# i risultati del tracking. source_frame conta i frame del video dato al cropper (il proc_
+# già decimato da FRAME_SKIP, non la registrazione grezza) e time_s usa il suo frame rate.
+
+MOTION_SCALE = 0.5        # Riduzione del crop prima del confronto
+PIXEL_DELTA = 20          # Differenza di grigio (0-255) oltre la quale un pixel è "cambiato"
+MOTION_FRACTION = 0.002   # Frazione minima di pixel cambiati per considerare il soggetto in movimento
+MOTION_HOLD = 30          # Frame tenuti dopo l'ultimo movimento (la coda di ogni movimento resta intera)
+STATIC_KEEP_EVERY = 60    # Nei tratti fermi un frame ogni N (0 = nessuno)
+
+
+class MotionGate:
+    """ Decide frame per frame se tenere il crop di un soggetto e registra l'indice della clip """
+
+    def __init__(self, path_out, source_fps):
+        self.path_out = path_out
+        self.source_fps = source_fps  # Frame rate del video di input (0 = sconosciuto: time_s vuoto)
+        self.kept = 0
+        self._rows = []
+        self._ref = None
+        self._hold = 0
+        self._since = 0
+
+    def _small(self, crop):
+        small = cv2.resize(crop, None, fx=MOTION_SCALE, fy=MOTION_SCALE, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def keep(self, crop, source_frame):
+        """ True se il crop (frame source_frame del video di input) va scritto nella clip """
+        small = self._small(crop)
+        if self._ref is not None:
+            changed = cv2.threshold(cv2.absdiff(small, self._ref), PIXEL_DELTA, 255, cv2.THRESH_BINARY)[1]
+            moving = cv2.countNonZero(changed) > MOTION_FRACTION * changed.size
+            if moving:
+                self._hold = MOTION_HOLD
+            elif self._hold > 0:
+                self._hold -= 1
+            self._since += 1
+            if not (moving or self._hold > 0 or (STATIC_KEEP_EVERY > 0 and self._since >= STATIC_KEEP_EVERY)):
+                return False
+        # Il primo frame è sempre tenuto (per questo il gate lavora solo sul video intero,
+        # senza --chunks / --checkpoint)
+        # Il confronto successivo è con l'ultimo frame tenuto: anche un movimento lentissimo
+        # si accumula fino a superare la soglia
+        self._ref = small
+        self._since = 0
+        time_s = round(source_frame / self.source_fps, 4) if self.source_fps > 0 else ''
+        self._rows.append((self.kept, source_frame, time_s))
+        self.kept += 1
+        return True
+
+    def close(self):
+        """ Scrive <clip>_frames.csv """
+        with open(index_path(self.path_out), 'w', newline='') as f:
+            w = csv.writer(f)
+            w.writerow(['frame', 'source_frame', 'time_s'])
+            w.writerows(self._rows)
+
+
+def motion_settings():
+    """ Soglie correnti (per i parametri della cache incrementale) """
+    return {'scale': MOTION_SCALE, 'pixel_delta': PIXEL_DELTA, 'fraction': MOTION_FRACTION,
+            'hold': MOTION_HOLD, 'static_keep_every': STATIC_KEEP_EVERY}
+
+
+def open_gates(path_outs, source_fps, enabled):
+    """ Un MotionGate per output (None per ognuno se la modalità è disattivata); source_fps è
+    il frame rate del video di input (cap.get(cv2.CAP_PROP_FPS)), non quello delle clip """
+    return [MotionGate(p, source_fps) if enabled else None for p in path_outs]
+
+
+def written_counts(gates, frames):
+    """ Frame scritti per ciascun output: tutti senza gate, quelli tenuti con il gate """
+    return [frames if gate is None else gate.kept for gate in gates]
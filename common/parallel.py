@@ -0,0 +1,108 @@
+import os
+import cv2
+from multiprocessing import RLock, Manager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from tqdm import tqdm
+
+# Riga tqdm assegnata al processo worker corrente (0 = processo principale)
+_worker_position = 0
+
+
+def failed_result(path_in, error):
+    """ Record di statistiche per un job fallito """
+    return {'file': os.path.basename(path_in), 'ok': False, 'frames': 0, 'seconds': 0.0, 'error': error}
+
+
+def _init_worker(lock, positions):
+    """ Ogni processo del pool prende una riga fissa per la sua barra tqdm """
+    global _worker_position
+    tqdm.set_lock(lock)
+    # Il parallelismo è già tra processi: evitiamo che OpenCV apra altri thread per ognuno
+    cv2.setNumThreads(1)
+    _worker_position = positions.get()
+
+
+def _call_isolated(fn, job):
+    """ Esecuzione nel processo corrente con la stessa gestione errori del pool """
+    try:
+        return fn(*job)
+    except Exception as e:
+        return failed_result(job[0], f"{type(e).__name__}: {e}")
+
+
+def _pool_job(fn, job):
+    return fn(*job, position=_worker_position)
+
+
+def _run_pool(fn, jobs, workers, lock, on_result):
+    """ Esegue i job su un pool nuovo. Ritorna (risultati, job persi per crash di un worker). """
+    results, crashed = [], []
+    with Manager() as manager:
+        positions = manager.Queue()
+        for p in range(1, workers + 1): positions.put(p)
+
+        with tqdm(total=len(jobs), desc="Batch", unit='video', ncols=100, position=0) as batch_bar, \
+             ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(lock, positions)) as pool:
+            futures = {pool.submit(_pool_job, fn, job): job for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    r = future.result()
+                except BrokenProcessPool:
+                    # Un worker è morto (es. segfault del decoder): il pool non è più utilizzabile
+                    crashed.append(futures[future])
+                    r = None
+                except Exception as e:
+                    r = failed_result(futures[future][0], f"{type(e).__name__}: {e}")
+                if r is not None:
+                    results.append(r)
+                    if on_result is not None: on_result(r)
+                batch_bar.update(1)
+    return results, crashed
+
+
+def run_parallel(fn, jobs, workers, on_result=None):
+    """ Esegue fn(*job, position=riga_tqdm) per ogni job su un pool di processi.
+
+    fn deve essere una funzione di modulo (o un functools.partial) che ritorna un dict
+    di statistiche ('file', 'ok', 'frames', 'seconds', 'error'); il primo elemento di
+    ogni job è il percorso del video. Un'eccezione o un crash del decoder su un file
+    diventa un risultato fallito e non ferma il batch. on_result(r) viene chiamata nel
+    processo principale appena ogni risultato è definitivo (es. metriche per video).
+    """
+    if workers <= 1:
+        results = []
+        for job in jobs:
+            results.append(_call_isolated(fn, job))
+            if on_result is not None: on_result(results[-1])
+        return results
+
+    lock = RLock()
+    tqdm.set_lock(lock)
+    results, crashed = _run_pool(fn, jobs, workers, lock, on_result)
+
+    # Ritento isolato: ogni job interrotto gira da solo, così fallisce solo il file colpevole
+    for job in crashed:
+        retry_results, still_crashed = _run_pool(fn, [job], 1, lock, on_result)
+        results.extend(retry_results)
+        if still_crashed:
+            results.append(failed_result(job[0], "Processo worker terminato in modo anomalo"))
+            if on_result is not None: on_result(results[-1])
+    return results
+
+
+def print_summary(results):
+    """ Tabella finale: frame, tempo e throughput per file """
+    print("\n" + "="*60)
+    print(" RIEPILOGO ELABORAZIONE")
+    print("="*60)
+    for r in sorted(results, key=lambda r: r['file']):
+        if r['ok']:
+            fps = r['frames'] / r['seconds'] if r['seconds'] > 0 else 0.0
+            print(f" OK   {r['file']:<40} {r['frames']:>8} fr  {r['seconds']:>8.1f} s  {fps:>7.1f} fr/s")
+        else:
+            print(f" ERR  {r['file']:<40} {r['error']}")
+    n_ok = sum(1 for r in results if r['ok'])
+    print("-"*60)
+    print(f" {n_ok}/{len(results)} video completati")
@@ -0,0 +1,74 @@
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+
+# Prefetch delle anteprime per le fasi di setup interattive: appena è nota la lista
+# dei file, i video successivi a quello mostrato vengono aperti in thread separati
+# (primo frame, eventuali frame extra e metadati), così su SD card o share di rete
+# il prossimo video compare subito dopo SPAZIO / 's'.
+
+PREFETCH_AHEAD = 3     # Video preparati in anticipo rispetto a quello corrente
+PREFETCH_WORKERS = 2   # Thread di apertura/decodifica
+
+
+def load_preview(video_path, extra_frames=None):
+    """ Metadati e frame di anteprima di un video, None se non è leggibile.
+
+    Ritorna {'fps', 'total_frames', 'size': (w, h), 'frames': {indice: frame}} con
+    il frame 0 e quelli indicati da extra_frames(total_frames).
+    """
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            return None
+        ret, frame = cap.read()
+        if not ret:
+            return None
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        info = {'fps': cap.get(cv2.CAP_PROP_FPS), 'total_frames': total_frames,
+                'size': (frame.shape[1], frame.shape[0]), 'frames': {0: frame}}
+        for idx in (extra_frames(total_frames) if extra_frames else []):
+            if idx in info['frames']: continue
+            cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+            ret, frame = cap.read()
+            if ret: info['frames'][idx] = frame
+        return info
+    finally:
+        cap.release()
+
+
+class Prefetcher:
+    """ Anteprime dei video di una lista, preparate in background PREFETCH_AHEAD file
+    avanti rispetto all'ultimo richiesto con get() """
+
+    def __init__(self, paths, extra_frames=None, ahead=PREFETCH_AHEAD, workers=PREFETCH_WORKERS):
+        self._paths = list(paths)
+        self._pos = {p: i for i, p in enumerate(self._paths)}
+        self._extra_frames = extra_frames
+        self._ahead = ahead
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self._futures = {}  # path -> Future (None = già consegnato)
+        self._schedule(0)
+
+    def _schedule(self, cursor):
+        for path in self._paths[cursor:cursor + self._ahead + 1]:
+            if path not in self._futures:
+                self._futures[path] = self._pool.submit(load_preview, path, self._extra_frames)
+
+    def get(self, path):
+        """ Anteprima di path (vedi load_preview); attende solo se non è ancora pronta """
+        i = self._pos.get(path)
+        if i is None:
+            return load_preview(path, self._extra_frames)
+        self._schedule(i)
+        future = self._futures[path]
+        self._futures[path] = None  # la memoria dei frame passa al chiamante
+        if future is None:
+            return load_preview(path, self._extra_frames)
+        try:
+            return future.result()
+        except Exception:
+            return None
+
+    def close(self):
+        """ Annulla i prefetch non ancora partiti """
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,93 @@
+import queue
+import threading
+import cv2
+
+from common.video_io import GRAYSCALE
+
+# Decodifica in background per i loop sui frame: un thread legge dal VideoCapture in
+# un pool fisso di READER_POOL buffer riutilizzati (niente allocazione di un frame
+# nuovo a ogni read) mentre il thread principale elabora e scrive il frame precedente.
+# Quando il pool è esaurito il decoder si ferma finché il consumatore non restituisce
+# un buffer, così la memoria resta limitata anche su registrazioni 4K lunghe.
+# In modalità GRAYSCALE la conversione in grigio avviene sullo stesso thread, subito dopo
+# la decodifica: il pool contiene frame a un canale e il frame BGR usa un solo buffer.
+
+READER_POOL = 4  # Buffer di frame in circolo (decodificati in anticipo + quello in uso)
+
+_STOP = object()
+
+
+class FrameReader:
+    """ Sostituto di cap.read() con decodifica su un thread dedicato.
+
+    Restituisce i frame con indice globale in [start, end) (end=None: fino alla fine);
+    con step > 1 solo quelli multipli di step, gli altri vengono solo "grabbati".
+    Il frame ritornato da read() resta valido fino alla read() successiva: chi lo
+    conserva più a lungo (es. AsyncVideoWriter) deve copiarlo.
+    Il thread parte alla prima read(), quindi prima si può usare liberamente cap.get().
+    Con gray=True (default: GRAYSCALE) i frame ritornati sono a un canale.
+    """
+
+    def __init__(self, cap, start=0, end=None, step=1, pool_size=READER_POOL, gray=GRAYSCALE):
+        self.cap = cap
+        self.gray = gray
+        self.frames = 0  # Frame sorgente consumati (letti o saltati) fino all'ultimo ritornato
+        self._start, self._end, self._step = start, end, step
+        self._free = queue.Queue()
+        for _ in range(pool_size):
+            self._free.put(None)  # buffer allocato dal decoder al primo giro
+        self._ready = queue.Queue()
+        self._current = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        idx = self._start
+        bgr = None  # buffer della decodifica prima della conversione in grigio
+        try:
+            while (self._end is None or idx < self._end) and not self._stop.is_set():
+                if idx % self._step == 0:
+                    buf = self._free.get()
+                    if buf is _STOP:
+                        return
+                    if self.gray:
+                        ret, bgr = self.cap.read(bgr) if bgr is not None else self.cap.read()
+                        if not ret: break
+                        frame = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY, dst=buf)
+                    else:
+                        ret, frame = self.cap.read(buf) if buf is not None else self.cap.read()
+                        if not ret: break
+                    idx += 1
+                    self._ready.put((frame, idx - self._start))
+                else:
+                    if not self.cap.grab(): break
+                    idx += 1
+            self._ready.put((None, idx - self._start))
+        except Exception as e:
+            self._ready.put(e)  # rilanciata nel thread che chiama read()
+
+    def read(self):
+        """ (True, frame) oppure (False, None) a fine video / fine intervallo """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name='reader')
+            self._thread.start()
+        if self._current is not None:
+            self._free.put(self._current)
+            self._current = None
+        item = self._ready.get()
+        if isinstance(item, Exception):
+            raise item
+        frame, self.frames = item
+        if frame is None:
+            self._ready.put(item)  # le read() successive ritornano ancora False
+            return False, None
+        self._current = frame
+        return True, frame
+
+    def release(self):
+        """ Ferma il decoder e chiude il VideoCapture """
+        if self._thread is not None:
+            self._stop.set()
+            self._free.put(_STOP)
+            self._thread.join()
+        self.cap.release()
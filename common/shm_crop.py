@@ -0,0 +1,184 @@
+import queue
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+
+from common.video_io import AsyncVideoWriter, release_all, open_writer, encoder_time, frame_shape
+from common.drift import pad_crop
+from common.motion import open_gates
+from common.metrics import StageTimer
+
+# Crop su più processi senza copiare i frame: il processo principale decodifica e
+# pubblica ogni frame una sola volta in un anello di SHM_SLOTS slot in memoria condivisa,
+# ogni worker possiede un sottoinsieme degli encoder dei soggetti e legge le sue finestre
+# direttamente dallo slot (viste numpy, zero-copy). Ai worker arriva solo l'indice del
+# frame; ognuno ha un semaforo di "crediti" (uno per slot) che impedisce al processo
+# principale di sovrascrivere uno slot prima che tutti abbiano finito di leggerlo.
+
+SHM_SLOTS = 8         # Frame in volo nell'anello condiviso
+WORKER_TIMEOUT = 1.0  # Secondi tra due controlli di vitalità durante le attese
+
+
+def _crop_worker(shm, shape, n_slots, windows, inside, path_outs, fps, encoder_queue, start, motion,
+                 source_fps, jobs, credits, results):
+    """ Processo worker: crop delle sue finestre da ogni frame pubblicato e scrittura """
+    cv2.setNumThreads(1)
+    slots = np.ndarray((n_slots,) + shape, dtype=np.uint8, buffer=shm.buf)
+    parent = mp.parent_process()
+    timer = StageTimer()
+    writers, count = [], 0
+    gray = len(shape) == 2
+    frame = crop = None
+    try:
+        for (x1, y1, x2, y2), path_out, gate in zip(windows[0].tolist(), path_outs, open_gates(path_outs, source_fps, motion)):
+            writer = open_writer(path_out, fps, (x2 - x1, y2 - y1), gray=gray)
+            if encoder_queue > 0:
+                writer = AsyncVideoWriter(writer, encoder_queue)
+            writers.append({'writer': writer, 'pad': np.zeros(frame_shape(y2 - y1, x2 - x1, gray), dtype=np.uint8), 'gate': gate})
+
+        while True:
+            try:
+                k = jobs.get(timeout=WORKER_TIMEOUT)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():
+                    return  # processo principale terminato: niente da finire
+                continue
+            if k is None:
+                break
+            timer.skip()
+            frame = slots[k % n_slots]
+            row = min(k, len(windows) - 1)
+            for item, (x1, y1, x2, y2), ok in zip(writers, windows[row].tolist(), inside[row].tolist()):
+                crop = frame[y1:y2, x1:x2] if ok else pad_crop(frame, (x1, y1, x2, y2), item['pad'])
+                if item['gate'] is None or item['gate'].keep(crop, start + k):
+                    item['writer'].write(crop)
+            timer.mark('crop_workers')
+            credits.release()
+            count += 1
+
+        release_all(writers)
+        written = {}
+        for path_out, item in zip(path_outs, writers):
+            written[path_out] = count if item['gate'] is None else item['gate'].kept
+            if item['gate'] is not None: item['gate'].close()
+        results.put({'ok': True, 'frames': count, 'written': written,
+                     'timings': dict(timer.as_dict(), encode_threads=encoder_time(writers))})
+    except Exception as e:
+        try:
+            release_all(writers)
+        except Exception:
+            pass
+        results.put({'ok': False, 'error': f"{type(e).__name__}: {e}"})
+    finally:
+        # Nessuna vista deve restare sul segmento prima di chiuderlo
+        slots = frame = crop = None
+        shm.close()
+
+
+def _worker_failure(results, dead):
+    """ Errore da rilanciare per un worker terminato: quello riportato in results da un
+    worker fallito, altrimenti l'exit code (worker ucciso o crash senza messaggio) """
+    while True:
+        try:
+            r = results.get(timeout=0.1)
+        except queue.Empty:
+            break
+        if not r['ok']:
+            return RuntimeError(r['error'])
+    return RuntimeError(f"Worker di crop terminato (exit code {dead.exitcode})")
+
+
+def _wait(acquire, procs, results):
+    """ Attende un semaforo controllando che i worker siano ancora vivi """
+    while not acquire(timeout=WORKER_TIMEOUT):
+        dead = [p for p in procs if not p.is_alive()]
+        if dead:
+            raise _worker_failure(results, dead[0])
+
+
+def crop_shared(reader, windows, inside, path_outs, fps, procs, encoder_queue, timer, pbar,
+                start=0, motion=False, n_slots=SHM_SLOTS):
+    """ Esegue il loop di crop con procs processi worker; ritorna (frame elaborati, frame
+    scritti per ciascun output).
+
+    windows/inside: tabella (frame, box, 4) delle finestre e maschera "dentro il frame"
+    (con una sola riga = finestre fisse); path_outs nell'ordine dei box; start = indice del
+    primo frame nel video (per l'indice di MOTION_GATE). I tempi finiscono in timer
+    ('decode', 'write' = attesa dei worker, 'publish', più quelli dei worker).
+    """
+    w, h = int(reader.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(reader.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    source_fps = reader.cap.get(cv2.CAP_PROP_FPS)  # tempi dell'indice di MOTION_GATE (fps = quello delle clip)
+    shape = frame_shape(h, w, reader.gray)
+    procs = max(1, min(procs, windows.shape[1]))
+    groups = [list(range(j, windows.shape[1], procs)) for j in range(procs)]
+
+    shm = shared_memory.SharedMemory(create=True, size=n_slots * int(np.prod(shape)))
+    slots = np.ndarray((n_slots,) + shape, dtype=np.uint8, buffer=shm.buf)
+    results = mp.Queue()
+    workers = []
+    try:
+        for group in groups:
+            jobs, credits = mp.Queue(), mp.Semaphore(n_slots)
+            p = mp.Process(target=_crop_worker, daemon=True,
+                           args=(shm, shape, n_slots, windows[:, group], inside[:, group],
+                                 [path_outs[j] for j in group], fps, encoder_queue, start, motion,
+                                 source_fps, jobs, credits, results))
+            p.start()
+            workers.append((p, jobs, credits))
+        alive = [p for p, _, _ in workers]
+
+        k = 0
+        frame = None
+        timer.skip()
+        while True:
+            ret, frame = reader.read()
+            timer.mark('decode')
+            if not ret: break
+            if frame.shape != shape:
+                raise ValueError(f"Frame {frame.shape[1]}x{frame.shape[0]} diverso da {w}x{h}")
+            # Lo slot k % n_slots è libero quando tutti i worker hanno finito il frame k - n_slots
+            for _, _, credits in workers:
+                _wait(credits.acquire, alive, results)
+            timer.mark('write')
+            np.copyto(slots[k % n_slots], frame)
+            for _, jobs, _ in workers:
+                jobs.put(k)
+            timer.mark('publish')
+            k += 1
+            pbar.update(1)
+            timer.skip()
+
+        for _, jobs, _ in workers:
+            jobs.put(None)
+        done = []
+        for _ in workers:
+            while True:
+                try:
+                    done.append(results.get(timeout=WORKER_TIMEOUT))
+                    break
+                except queue.Empty:
+                    if not any(p.is_alive() for p in alive):
+                        raise _worker_failure(results, alive[0])
+        timer.mark('flush')
+        errors = [r['error'] for r in done if not r['ok']]
+        if errors:
+            raise RuntimeError(errors[0])
+        written = {}
+        for r in done:
+            written.update(r['written'])
+            for stage, seconds in r['timings'].items():
+                timer.add(stage, seconds)
+        return k, [written[p] for p in path_outs]
+    finally:
+        # Anche dopo un errore: worker fermati e segmento condiviso rimosso
+        for _, jobs, _ in workers:
+            jobs.put(None)  # dopo la fine normale è un doppione innocuo
+        for p, _, _ in workers:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+                p.join()
+        slots = frame = None
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,271 @@
+import os
+import queue
+import shutil
+import hashlib
+import threading
+import time
+
+from common.config import setting
+from common.chunking import temp_path, index_path, publish, remove_output
+from common.parallel import failed_result
+
+# Staging su disco locale per input e output su supporti lenti (SD card, share di rete).
+# Con SCRATCH_DIR configurato un thread copia in anticipo i prossimi STAGE_AHEAD video di
+# input nella cartella locale mentre si elabora quello corrente, che viene letto dalla
+# copia; gli output vengono scritti in SCRATCH_DIR e spostati nella cartella finale da un
+# secondo thread mentre parte il video successivo. Le copie occupano al massimo
+# SCRATCH_BUDGET_GB (input copiati + output da spostare): la copia successiva aspetta che
+# si liberi spazio e l'input di un video finito viene eliminato subito. Un video più grande
+# del budget (o una copia fallita) viene letto direttamente dall'origine.
+
+SCRATCH_DIR = setting('SCRATCH_DIR', None)              # Cartella locale veloce (None = staging disattivato)
+STAGE_AHEAD = setting('STAGE_AHEAD', 2)                  # Video di input copiati in anticipo oltre quello corrente
+SCRATCH_BUDGET_GB = setting('SCRATCH_BUDGET_GB', 50)     # Spazio massimo occupato dalle copie in SCRATCH_DIR
+SCRATCH_RESERVE_GB = 2     # Spazio libero lasciato sul disco locale (output in scrittura, altro)
+COPY_BLOCK = 16 * 1024 * 1024
+
+_GB = 1024 ** 3
+
+
+def _copy(src, dst, stop):
+    """ Copia a blocchi (interrompibile da stop) su un nome .part poi rinominato """
+    part = dst + '.part'
+    try:
+        with open(src, 'rb') as f, open(part, 'wb') as g:
+            while not stop():
+                block = f.read(COPY_BLOCK)
+                if not block:
+                    break
+                g.write(block)
+            else:
+                raise InterruptedError("staging interrotto")
+        shutil.copystat(src, part)  # mtime conservato: la cache del drift (dimensione + mtime) resta valida
+        os.replace(part, dst)
+    finally:
+        if os.path.exists(part): os.remove(part)
+
+
+class Stager:
+    """ Copie locali degli input (nell'ordine di elaborazione) e spostamento in background degli output.
+
+    Uso per ogni job, nello stesso ordine di paths_in: input() e outputs() danno i percorsi
+    su cui lavorare, finish() libera l'input e accoda lo spostamento degli output; close()
+    attende gli spostamenti e ritorna gli errori per nome dell'input. Senza scratch ogni
+    metodo lascia i percorsi invariati.
+    """
+
+    def __init__(self, paths_in, scratch=SCRATCH_DIR, ahead=STAGE_AHEAD, budget_gb=SCRATCH_BUDGET_GB):
+        self.enabled = scratch is not None
+        self.scratch = scratch
+        self._order = list(paths_in)
+        self._state = {}   # input -> 'copying' | 'ready' | 'direct' | 'done'
+        self._local = {}   # input -> copia locale
+        self._sizes = {}   # file locale -> byte contati nel budget
+        self._errors = {}
+        self._stop = False
+        self._cond = threading.Condition()
+        if not self.enabled:
+            return
+        self._ahead = ahead
+        self._budget = budget_gb * _GB
+        self._in_dir = os.path.join(scratch, 'in')
+        self._out_dir = os.path.join(scratch, 'out')
+        os.makedirs(self._in_dir, exist_ok=True)
+        os.makedirs(self._out_dir, exist_ok=True)
+        self._moves = queue.Queue()
+        self._copier = threading.Thread(target=self._copy_all, daemon=True, name='stage-in')
+        self._mover = threading.Thread(target=self._move_all, daemon=True, name='stage-out')
+        self._copier.start()
+        self._mover.start()
+
+    def _staged(self):
+        return sum(1 for s in self._state.values() if s in ('copying', 'ready'))
+
+    def _fits(self, size):
+        return (self._staged() <= self._ahead and sum(self._sizes.values()) + size <= self._budget)
+
+    def _copy_all(self):
+        for path_in in self._order:
+            name = os.path.basename(path_in)
+            local = os.path.join(self._in_dir, name)
+            try:
+                size = os.path.getsize(path_in)
+            except OSError:
+                size = None
+            with self._cond:
+                if size is None or size > self._budget:
+                    if size is not None:
+                        print(f"ATTENZIONE: {name} supera SCRATCH_BUDGET_GB, letto dall'origine.")
+                    self._state[path_in] = 'direct'
+                    self._cond.notify_all()
+                    continue
+                # Al massimo il video corrente + ahead copie, entro il budget
+                self._cond.wait_for(lambda: self._stop or self._fits(size))
+                if self._stop:
+                    return
+                self._state[path_in] = 'copying'
+                self._sizes[local] = size
+            try:
+                if shutil.disk_usage(self._in_dir).free < size + SCRATCH_RESERVE_GB * _GB:
+                    raise OSError("spazio insufficiente su disco")
+                _copy(path_in, local, lambda: self._stop)
+                state = 'ready'
+            except Exception as e:
+                if not self._stop:
+                    print(f"ATTENZIONE: copia locale di {name} fallita ({e}), letto dall'origine.")
+                state = 'direct'
+            with self._cond:
+                if state == 'ready':
+                    self._local[path_in] = local
+                else:
+                    self._sizes.pop(local, None)
+                self._state[path_in] = state
+                self._cond.notify_all()
+
+    def _move(self, local, path_out):
+        """ Copia nella cartella finale su un nome temporaneo, rename atomico, poi cancella la copia locale """
+        tmp = temp_path(path_out)
+        try:
+            shutil.copyfile(local, tmp)
+            if os.path.exists(index_path(local)):
+                shutil.copyfile(index_path(local), index_path(tmp))
+            publish(tmp, path_out)
+        finally:
+            remove_output(tmp)
+        remove_output(local)
+
+    def _move_all(self):
+        while True:
+            item = self._moves.get()
+            if item is None:
+                break
+            path_in, local_outs, path_outs, on_done = item
+            error = None
+            try:
+                for local, path_out in zip(local_outs, path_outs):
+                    self._move(local, path_out)
+            except Exception as e:
+                # La copia locale resta in SCRATCH_DIR (fuori dal budget) per recuperarla a mano
+                error = f"Spostamento output fallito: {type(e).__name__}: {e} (copia in {self._out_dir})"
+            finally:
+                with self._cond:
+                    for local in local_outs:
+                        self._sizes.pop(local, None)
+                    self._cond.notify_all()
+            try:
+                if on_done is not None:
+                    on_done(error)
+            except Exception as e:
+                error = error or f"{type(e).__name__}: {e}"
+            if error is not None:
+                self._errors[os.path.basename(path_in)] = error
+
+    def input(self, path_in):
+        """ Percorso da cui leggere path_in: la copia locale appena pronta, altrimenti l'originale """
+        if not self.enabled or path_in not in self._order:
+            return path_in
+        with self._cond:
+            self._cond.wait_for(lambda: self._state.get(path_in) in ('ready', 'direct'))
+            return self._local.get(path_in, path_in)
+
+    def outputs(self, path_outs):
+        """ Percorsi locali su cui scrivere gli output (una sottocartella per cartella di destinazione) """
+        if not self.enabled:
+            return list(path_outs)
+        local_outs = []
+        for path_out in path_outs:
+            folder, name = os.path.split(os.path.abspath(path_out))
+            local_dir = os.path.join(self._out_dir, hashlib.blake2b(folder.encode('utf-8'), digest_size=6).hexdigest())
+            os.makedirs(local_dir, exist_ok=True)
+            local_outs.append(os.path.join(local_dir, name))
+        return local_outs
+
+    def finish(self, path_in, local_outs, path_outs, ok, on_done=None):
+        """ Fine del job: elimina la copia dell'input e, se ok, accoda lo spostamento degli
+        output; on_done(errore) viene chiamata (sul thread di spostamento) a output arrivati
+        con None, o con il messaggio se lo spostamento è fallito """
+        if not self.enabled:
+            if ok and on_done is not None:
+                on_done(None)
+            return
+        with self._cond:
+            local = self._local.pop(path_in, None)
+            self._state[path_in] = 'done'
+            if local is not None:
+                self._sizes.pop(local, None)
+                if os.path.exists(local): os.remove(local)
+            if ok:
+                for p in local_outs:
+                    self._sizes[p] = sum(os.path.getsize(f) for f in (p, index_path(p)) if os.path.exists(f))
+            self._cond.notify_all()
+        if ok:
+            self._moves.put((path_in, list(local_outs), list(path_outs), on_done))
+        else:
+            for p in local_outs:
+                remove_output(p)
+
+    def close(self):
+        """ Ferma le copie in anticipo, attende gli spostamenti; ritorna {nome input: errore} """
+        if not self.enabled:
+            return {}
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        self._copier.join()
+        self._moves.put(None)
+        self._mover.join()
+        for local in self._local.values():
+            if os.path.exists(local): os.remove(local)
+        self._local.clear()
+        return dict(self._errors)
+
+
+def run_staged(jobs, paths, run_job, on_done):
+    """ Esegue run_job(job, path_in, path_outs) per ogni job, in ordine, con input e output in
+    SCRATCH_DIR se configurato.
+
+    paths(job) -> (input, lista degli output finali); on_done(job, result) una volta per job,
+    a esito definitivo: quando gli output sono nella cartella finale (subito senza staging,
+    altrimenti dal thread di spostamento), subito per un job fallito. Un'eccezione o uno
+    spostamento fallito rendono fallito il risultato (errore stampato subito), prima di
+    on_done. I secondi di attesa della copia locale finiscono in timings['stage_wait'].
+    """
+    stager = Stager([paths(job)[0] for job in jobs])
+    results = []
+
+    def moved(job, result, error):
+        if error is not None:
+            result['ok'] = False
+            result['error'] = error
+            print(f"ERRORE: {result['file']}: {result['error']}")
+        on_done(job, result)
+
+    try:
+        for job in jobs:
+            path_in, path_outs = paths(job)
+            t0 = time.perf_counter()
+            local_in = stager.input(path_in)
+            wait = time.perf_counter() - t0
+            local_outs = stager.outputs(path_outs)
+            try:
+                result = run_job(job, local_in, local_outs)
+            except Exception as e:
+                result = failed_result(path_in, f"{type(e).__name__}: {e}")
+            if not result['ok']:
+                print(f"ERRORE: {result['file']}: {result['error']}")
+            if stager.enabled:
+                result['timings'] = dict(result.get('timings') or {}, stage_wait=round(wait, 3))
+            results.append(result)
+            stager.finish(path_in, local_outs, path_outs, result['ok'],
+                          lambda error, job=job, result=result: moved(job, result, error))
+            if not result['ok']:
+                on_done(job, result)
+    finally:
+        errors = stager.close()
+    for result in results:
+        # Errori di on_done dopo uno spostamento riuscito (quelli di spostamento sono già nel risultato)
+        if result['ok'] and result['file'] in errors:
+            result['ok'] = False
+            result['error'] = errors[result['file']]
+            print(f"ERRORE: {result['file']}: {result['error']}")
+    return results
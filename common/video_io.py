@@ -0,0 +1,214 @@
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import cv2
+import numpy as np
+
+from common.config import setting
+
+# Backend di scrittura dei video, configurabile in config_local.py:
+# - VIDEO_CODEC = 'mp4v' (default): cv2.VideoWriter come in origine
+# - 'libx264' / 'libx265': frame grezzi in pipe a un processo ffmpeg (preset/CRF sotto)
+# - 'ffv1': lossless, in contenitore .mkv
+# Senza ffmpeg nel PATH si ripiega su cv2.VideoWriter mp4v.
+VIDEO_CODEC = setting('VIDEO_CODEC', 'mp4v')
+VIDEO_PRESET = setting('VIDEO_PRESET', 'veryfast')
+VIDEO_CRF = setting('VIDEO_CRF', 18)
+
+# Modalità in scala di grigi per tutta la pipeline (arene in IR / luce bianca, il colore non
+# porta informazione): FrameReader converte ogni frame in grigio subito dopo la decodifica e
+# da lì resize, crop, CLAHE e codifica lavorano su un solo canale (~1/3 dei byte per frame).
+# GRAY_OUTPUT decide il formato dei video scritti:
+# - 'gray': sola luma (pix_fmt gray con libx264/libx265/ffv1; mp4v non lo supporta e scrive yuv420p)
+# - 'bgr': formato a tre canali standard (yuv420p, ffv1 bgr0) con R = G = B, per i tool che lo richiedono
+# OpenCV (quindi anche DeepLabCut) rilegge comunque entrambi come frame BGR.
+GRAYSCALE = setting('GRAYSCALE', False)
+GRAY_OUTPUT = setting('GRAY_OUTPUT', 'gray')
+GRAY_OUTPUTS = ('gray', 'bgr')
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv')
+
+_warned_fallback = False
+
+
+def list_videos(folder):
+    """ Video di una cartella (esclusi i file nascosti: temporanei e segmenti) """
+    return [f for f in os.listdir(folder) if f.lower().endswith(VIDEO_EXTENSIONS) and not f.startswith('.')]
+
+
+def _use_ffmpeg():
+    global _warned_fallback
+    if VIDEO_CODEC == 'mp4v':
+        return False
+    if shutil.which('ffmpeg'):
+        return True
+    if not _warned_fallback:
+        _warned_fallback = True
+        print(f"ATTENZIONE: ffmpeg non trovato, VIDEO_CODEC='{VIDEO_CODEC}' ignorato (uso mp4v).")
+    return False
+
+
+def output_name(path_out):
+    """ Percorso di output con l'estensione adatta al codec (FFV1 solo in .mkv) """
+    if VIDEO_CODEC == 'ffv1' and _use_ffmpeg():
+        return os.path.splitext(path_out)[0] + '.mkv'
+    return path_out
+
+
+def output_pix_fmt(codec=VIDEO_CODEC, gray=GRAYSCALE):
+    """ pix_fmt di uscita di ffmpeg (None = quello scelto dall'encoder) """
+    if not gray:
+        return None if codec == 'ffv1' else 'yuv420p'
+    if GRAY_OUTPUT not in GRAY_OUTPUTS:
+        raise ValueError(f"GRAY_OUTPUT '{GRAY_OUTPUT}' non valido (attesi {', '.join(GRAY_OUTPUTS)})")
+    if GRAY_OUTPUT == 'gray' and codec != 'mp4v':
+        return 'gray'
+    return 'bgr0' if codec == 'ffv1' else 'yuv420p'
+
+
+def encoder_args(codec=VIDEO_CODEC, preset=VIDEO_PRESET, crf=VIDEO_CRF, gray=GRAYSCALE):
+    """ (filtro finale, opzioni di codifica) di ffmpeg per codec.
+
+    yuv420p vuole lati pari: i box dispari ricevono un bordo nero di 1 px. 'mp4v'
+    corrisponde all'encoder mpeg4 di ffmpeg (stesso formato di cv2.VideoWriter).
+    """
+    pix_fmt = output_pix_fmt(codec, gray)
+    fmt = ['-pix_fmt', pix_fmt] if pix_fmt else []
+    pad = 'pad=ceil(iw/2)*2:ceil(ih/2)*2' if pix_fmt == 'yuv420p' else None
+    if codec == 'ffv1':
+        return None, ['-c:v', 'ffv1', '-level', '3'] + fmt
+    if codec == 'mp4v':
+        return pad, ['-c:v', 'mpeg4', '-q:v', '3'] + fmt
+    return pad, ['-c:v', codec, '-preset', preset, '-crf', str(crf)] + fmt
+
+
+def encoder_settings():
+    """ Impostazioni di codifica effettive (per i parametri della cache incrementale) """
+    if not _use_ffmpeg():
+        return {'codec': 'mp4v', 'gray': GRAYSCALE}
+    return {'codec': VIDEO_CODEC, 'preset': VIDEO_PRESET, 'crf': VIDEO_CRF,
+            'gray': GRAY_OUTPUT if GRAYSCALE else False}
+
+
+def frame_shape(h, w, gray=GRAYSCALE):
+    """ Forma di un frame h x w in memoria (un solo canale in modalità GRAYSCALE) """
+    return (h, w) if gray else (h, w, 3)
+
+
+class FfmpegWriter:
+    """ Stessa interfaccia di cv2.VideoWriter, ma i frame BGR (o grigi con gray=True) vengono
+    passati in pipe a un processo ffmpeg che codifica con i suoi thread """
+
+    def __init__(self, path_out, fps, size, codec=VIDEO_CODEC, preset=VIDEO_PRESET, crf=VIDEO_CRF,
+                 gray=GRAYSCALE):
+        w, h = size
+        cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'gray' if gray else 'bgr24',
+               '-s', f'{w}x{h}', '-r', str(fps), '-i', '-']
+        final_filter, args = encoder_args(codec, preset, crf, gray)
+        if final_filter:
+            cmd += ['-vf', final_filter]
+        self._path = path_out
+        # stderr su file e non in pipe: una pipe piena bloccherebbe ffmpeg mentre write() aspetta su stdin
+        self._stderr = tempfile.TemporaryFile()
+        self._proc = subprocess.Popen(cmd + args + [path_out], stdin=subprocess.PIPE, stderr=self._stderr)
+
+    def isOpened(self):
+        return self._proc.poll() is None
+
+    def write(self, frame):
+        try:
+            self._proc.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            self.release()  # rilancia il messaggio di errore di ffmpeg
+            raise IOError(f"ffmpeg terminato durante la scrittura di {self._path}")
+
+    def release(self):
+        if self._proc.stdin.closed:
+            return
+        self._proc.stdin.close()
+        code = self._proc.wait()
+        self._stderr.seek(0)
+        err = self._stderr.read().decode(errors='replace').strip()
+        self._stderr.close()
+        if code != 0:
+            raise IOError(f"ffmpeg ({self._path}): {err[-2000:]}")  # solo la coda: gli errori ripetuti sono tutti uguali
+
+
+def open_writer(path_out, fps, size, gray=GRAYSCALE):
+    """ Writer per path_out secondo VIDEO_CODEC (vedi sopra); con gray=True accetta frame a un canale """
+    if _use_ffmpeg():
+        return FfmpegWriter(path_out, fps, size, gray=gray)
+    return cv2.VideoWriter(path_out, cv2.VideoWriter_fourcc(*'mp4v'), fps, size, isColor=not gray)
+
+
+class AsyncVideoWriter:
+    """ Incapsula un cv2.VideoWriter e ne esegue la codifica su un thread dedicato.
+
+    I frame passano da una coda limitata (backpressure sul decoder se l'encoder
+    è più lento) e vengono scritti nello stesso ordine di write(). write() ne
+    accoda una copia: i frame di FrameReader e i buffer di padding vengono
+    riutilizzati subito dopo.
+    """
+
+    def __init__(self, writer, queue_size=32):
+        self._writer = writer
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._closed = False
+        self.encode_seconds = 0.0  # Tempo cumulativo di codifica sul thread dell'encoder
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+            if self._error is None:
+                try:
+                    t0 = time.perf_counter()
+                    self._writer.write(frame)
+                    self.encode_seconds += time.perf_counter() - t0
+                except Exception as e:
+                    # Continuiamo a svuotare la coda per non bloccare il produttore
+                    self._error = e
+
+    def isOpened(self):
+        return self._writer.isOpened()
+
+    def write(self, frame):
+        if self._error is not None:
+            raise RuntimeError(f"Errore nell'encoder: {self._error}") from self._error
+        # Copia sempre (anche se già contigua): np.ascontiguousarray non copierebbe un frame intero
+        self._queue.put(np.array(frame, order='C'))
+
+    def release(self):
+        """ Svuota la coda, chiude il file e rilancia un eventuale errore dell'encoder """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+            self._writer.release()
+        if self._error is not None:
+            raise RuntimeError(f"Errore nell'encoder: {self._error}") from self._error
+
+
+def release_all(writers):
+    """ Chiude tutti i writer anche se qualcuno fallisce; rilancia il primo errore """
+    first_error = None
+    for item in writers:
+        try:
+            item['writer'].release()
+        except Exception as e:
+            if first_error is None:
+                first_error = e
+    if first_error is not None:
+        raise first_error
+
+
+def encoder_time(writers):
+    """ Secondi di codifica spesi sui thread degli encoder asincroni (somma) """
+    return sum(getattr(item['writer'], 'encode_seconds', 0.0) for item in writers)
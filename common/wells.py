@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+
+# Rilevamento automatico della griglia di pozzetti / piastre Petri sul primo frame, per
+# proporre nel setup dei crop tutti i box in una volta invece di 2 click per soggetto.
+# I cerchi vengono cercati (HoughCircles) su una copia ridotta del frame e ordinati
+# riga per riga, da sinistra a destra, come le colonne Pos1..PosN del CSV.
+
+WORK_WIDTH = 640       # Larghezza del frame ridotto su cui si cercano i cerchi
+MIN_CONFIDENCE = 0.6   # Sotto questa soglia nessuna proposta: box disegnati a mano
+BOX_MARGIN = 1.05      # Lato del box = diametro del pozzetto * BOX_MARGIN
+
+
+def _rows(circles, tolerance):
+    """ Raggruppa i cerchi (x, y, r) in righe per y, ciascuna ordinata per x """
+    rows = []
+    for c in sorted(circles, key=lambda c: c[1]):
+        if rows and c[1] - rows[-1][0][1] <= tolerance:
+            rows[-1].append(c)
+        else:
+            rows.append([c])
+    return [sorted(row, key=lambda c: c[0]) for row in rows]
+
+
+def detect_wells(frame, n_wells, work_width=WORK_WIDTH):
+    """ Box (x1, y1, x2, y2) di n_wells pozzetti in ordine riga per riga e confidenza in [0, 1].
+
+    La confidenza scende con la variabilità dei raggi e con righe di lunghezza diversa;
+    se si trovano meno di n_wells cerchi o la confidenza è sotto MIN_CONFIDENCE i box
+    sono None.
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    scale = min(1.0, work_width / gray.shape[1])
+    small = cv2.medianBlur(cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), 5)
+
+    # Lato medio della cella di un pozzetto se la griglia riempie l'inquadratura
+    cell = np.sqrt(small.shape[0] * small.shape[1] / n_wells)
+    circles = cv2.HoughCircles(small, cv2.HOUGH_GRADIENT, dp=1.5, minDist=cell * 0.6, param1=100, param2=30,
+                               minRadius=int(cell * 0.2), maxRadius=int(cell * 0.65))
+    if circles is None or len(circles[0]) < n_wells:
+        return None, 0.0
+
+    # HoughCircles ordina per numero di voti: si tengono gli n_wells cerchi più marcati
+    found = circles[0][:n_wells]
+    radii = found[:, 2]
+    rows = _rows(found.tolist(), np.median(radii))
+    confidence = max(0.0, 1.0 - 3.0 * float(np.std(radii) / np.mean(radii)))
+    if len({len(row) for row in rows}) > 1:
+        confidence *= 0.5
+    if confidence < MIN_CONFIDENCE:
+        return None, confidence
+
+    h, w = gray.shape
+    boxes = []
+    for x, y, r in (c for row in rows for c in row):
+        half = r * BOX_MARGIN / scale
+        cx, cy = x / scale, y / scale
+        boxes.append((max(0, int(cx - half)), max(0, int(cy - half)), min(w, int(cx + half)), min(h, int(cy + half))))
+    return boxes, confidence
+
+
+def propose_layout(frame, n_wells, label):
+    """ Box proposti per il setup (None = da disegnare a mano), con un messaggio per l'operatore """
+    boxes, confidence = detect_wells(frame, n_wells)
+    if boxes is None:
+        print(f"{label}: griglia non rilevata (confidenza {confidence:.2f}), disegna i box a mano.")
+    else:
+        print(f"{label}: {n_wells} pozzetti rilevati (confidenza {confidence:.2f}), [g] per accettarli.")
+    return boxes
@@ -0,0 +1,194 @@
+import os
+import re
+import json
+import time
+import socket
+import threading
+
+from common.checkpoint import write_json_atomic
+from common.parallel import failed_result
+
+# Coda di lavoro su una cartella condivisa (NFS/SMB) per distribuire un batch su più
+# processi o macchine. Ogni job ha una chiave; chi lo prende crea <chiave>.lease in
+# modo esclusivo (O_EXCL) e ne aggiorna la data di modifica ogni HEARTBEAT_INTERVAL
+# secondi. Un lease non aggiornato da LEASE_SECONDS appartiene a un worker morto e
+# viene ripreso da un altro; a fine job restano <chiave>.done o <chiave>.failed.
+# Le età dei lease sono misurate con l'orologio del file server (mtime di un file
+# sonda), così macchine con orologi sfasati non si rubano i job a vicenda.
+# Garanzia "almeno una volta": nel caso raro di un lease ripreso mentre il vecchio
+# worker è ancora vivo lo stesso job gira due volte, ma gli output sono pubblicati
+# con un rename atomico e il risultato non cambia.
+
+LEASE_SECONDS = 120      # Lease senza heartbeat da più di così = worker morto
+HEARTBEAT_INTERVAL = 20  # Secondi tra due rinnovi dei lease posseduti
+POLL_INTERVAL = 10       # Attesa prima di ricontrollare i job tenuti da altri worker
+
+
+def job_key(*parts):
+    """ Chiave di un job usabile come nome di file (es. job_key('crop_static', 'VID01.mp4')) """
+    return re.sub(r'[^\w.-]', '_', '_'.join(str(p) for p in parts))
+
+
+class WorkQueue:
+    """ Lease, heartbeat e marcatori di completamento in folder (vedi sopra) """
+
+    def __init__(self, folder, lease_seconds=LEASE_SECONDS, heartbeat=HEARTBEAT_INTERVAL):
+        self.folder = folder
+        self.lease_seconds = lease_seconds
+        self.worker = f"{socket.gethostname()}-{os.getpid()}"
+        os.makedirs(folder, exist_ok=True)
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, args=(heartbeat,), daemon=True)
+        self._thread.start()
+
+    def _path(self, key, kind):
+        return os.path.join(self.folder, f"{key}.{kind}")
+
+    @staticmethod
+    def _read_owner(path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f).get('worker')
+        except (OSError, ValueError):
+            return None
+
+    def _owner(self, key):
+        return self._read_owner(self._path(key, 'lease'))
+
+    def _server_now(self):
+        """ Ora corrente secondo il file server: mtime di un file sonda appena toccato """
+        probe = os.path.join(self.folder, f".clock_{self.worker}")
+        with open(probe, 'a'):
+            os.utime(probe, None)
+        return os.stat(probe).st_mtime
+
+    def _create_lease(self, key):
+        try:
+            fd = os.open(self._path(key, 'lease'), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'worker': self.worker, 'claimed': time.strftime('%Y-%m-%d %H:%M:%S')}, f)
+        return True
+
+    def _reclaim(self, key):
+        """ Toglie di mezzo un lease scaduto; False se nel frattempo è tornato vivo """
+        lease = self._path(key, 'lease')
+        try:
+            if self._server_now() - os.stat(lease).st_mtime <= self.lease_seconds:
+                return False
+            owner = self._owner(key)
+            stale = f"{lease}.stale_{self.worker}"
+            os.rename(lease, stale)  # atomico: uno solo dei worker concorrenti ci riesce
+        except FileNotFoundError:
+            return True  # rilasciato o già ripreso da un altro
+        # Il lease spostato deve essere quello scaduto, non uno appena ricreato da un altro
+        # worker che l'aveva ripreso prima di noi: in quel caso lo rimettiamo al suo posto
+        if owner is not None and self._read_owner(stale) != owner:
+            try:
+                os.link(stale, lease)
+            except OSError:
+                pass
+            os.remove(stale)
+            return False
+        os.remove(stale)
+        print(f"Lease di {owner} su {key} scaduto: job ripreso.")
+        return True
+
+    def claim(self, key):
+        """ Prova a prendere un job: 'claimed', 'held' (da un altro worker vivo), 'done' o 'failed' """
+        for kind in ('done', 'failed'):
+            if os.path.exists(self._path(key, kind)):
+                return kind
+        if not self._create_lease(key):
+            if not self._reclaim(key) or not self._create_lease(key):
+                return 'held'
+        # Un altro worker può aver completato il job tra il controllo e la creazione del lease
+        for kind in ('done', 'failed'):
+            if os.path.exists(self._path(key, kind)):
+                os.remove(self._path(key, 'lease'))
+                return kind
+        with self._lock:
+            self._held.add(key)
+        return 'claimed'
+
+    def _finish(self, key, kind, stats):
+        write_json_atomic(self._path(key, kind), dict(stats, worker=self.worker))
+        with self._lock:
+            self._held.discard(key)
+        if self._owner(key) == self.worker:
+            os.remove(self._path(key, 'lease'))
+        else:
+            print(f"ATTENZIONE: il lease di {key} era stato ripreso da un altro worker.")
+
+    def complete(self, key, stats):
+        self._finish(key, 'done', stats)
+
+    def fail(self, key, stats):
+        self._finish(key, 'failed', stats)
+
+    def reset_failed(self, keys):
+        """ Rimette in coda i job falliti in un'esecuzione precedente """
+        for key in keys:
+            if os.path.exists(self._path(key, 'failed')):
+                os.remove(self._path(key, 'failed'))
+
+    def _heartbeat(self, interval):
+        while not self._stop.wait(interval):
+            with self._lock:
+                held = list(self._held)
+            for key in held:
+                if self._owner(key) != self.worker:
+                    continue  # ripreso da un altro worker: _finish lo segnalerà
+                try:
+                    os.utime(self._path(key, 'lease'), None)
+                except OSError:
+                    pass
+
+    def status(self, keys):
+        """ Conteggio dei job per stato: done, failed, held, pending """
+        counts = {'done': 0, 'failed': 0, 'held': 0, 'pending': 0}
+        for key in keys:
+            kind = next((k for k in ('done', 'failed', 'lease') if os.path.exists(self._path(key, k))), None)
+            counts['held' if kind == 'lease' else kind or 'pending'] += 1
+        return counts
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        probe = os.path.join(self.folder, f".clock_{self.worker}")
+        if os.path.exists(probe): os.remove(probe)
+
+
+def run_queued(queue, jobs, key, fn, poll=POLL_INTERVAL):
+    """ Elabora con fn(job) -> statistiche i job non ancora presi da altri worker.
+
+    key(job) dà la chiave del job nella coda. I job tenuti da altri worker vengono
+    ricontrollati ogni poll secondi finché non risultano completati o falliti,
+    così quelli di un worker morto vengono ripresi alla scadenza del suo lease.
+    Ritorna le statistiche dei soli job elaborati da questo worker.
+    """
+    results = []
+    pending = list(jobs)
+    while pending:
+        waiting = []
+        for job in pending:
+            k = key(job)
+            state = queue.claim(k)
+            if state == 'held':
+                waiting.append(job)
+            if state != 'claimed':
+                continue
+            try:
+                r = fn(job)
+            except Exception as e:
+                r = failed_result(k, f"{type(e).__name__}: {e}")
+            (queue.complete if r['ok'] else queue.fail)(k, r)
+            results.append(r)
+        pending = waiting
+        if pending:
+            print(f"{len(pending)} job in corso su altri worker, nuovo controllo tra {poll} s...")
+            time.sleep(poll)
+    return results
@@ -0,0 +1,154 @@
+import os
+import sys
+import argparse
+import importlib.util
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+from common.manifest import read_manifest
+from common.checkpoint import CHECKPOINT_INTERVAL
+from common.parallel import print_summary
+from common.work_queue import WorkQueue, job_key, run_queued
+from common.build_cache import BuildCache
+from common import filtergraph, metrics
+
+# Fase 2 senza GUI: esegue i job di un manifest salvato dalla fase 1 (--setup-only o
+# fine setup di rotate.py / crop_static.py / crop_drift.py) su una macchina senza
+# display. Cartelle e opzioni arrivano da riga di comando, config_local.py non serve.
+#
+#   python headless/run_manifest.py manifest_static.json --input /data/proc --output /data/crops
+#
+# Con --queue DIR (cartella condivisa) più processi o macchine lanciati sullo stesso
+# manifest si dividono i job: ognuno prende quelli liberi, salta quelli tenuti da altri
+# worker e riprende quelli dei worker morti (vedi common/work_queue.py).
+
+# Script di ogni fase e nomi delle sue cartelle di input / output
+STAGES = {
+    'rotate': ('00_video_rotator/rotate.py', 'INPUT_FOLDER', 'OUTPUT_FOLDER'),
+    'crop_static': ('01_video_cropper/crop_static.py', 'VIDEO_PATH', 'OUTPUT_PATH'),
+    'crop_drift': ('01_video_cropper/crop_drift.py', 'VIDEO_PATH', 'OUTPUT_PATH'),
+}
+
+
+def load_stage(rel_path):
+    """ Importa lo script di una fase; registrato in sys.modules perché i worker
+    di run_parallel (fork) ritrovino le sue funzioni """
+    name = os.path.splitext(os.path.basename(rel_path))[0]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, rel_path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_from_queue(stage, stage_name, entries, args):
+    """ Job del manifest presi uno alla volta dalla coda condivisa args.queue """
+    # Job già aggiornati nella cache della cartella di output: nemmeno messi in coda
+    cache = BuildCache(args.output)
+    jobs = stage.jobs_from_manifest(entries)
+    cache_entries = [stage.cache_entry(job) for job in jobs]
+    todo = cache.pending(cache_entries)
+    entries, jobs, cache_entries = ([items[i] for i in todo] for items in (entries, jobs, cache_entries))
+
+    queue = WorkQueue(args.queue)
+    keys = [job_key(stage_name, e['file']) for e in entries]
+    if args.retry_failed:
+        queue.reset_failed(keys)
+
+    def process(item):
+        key, job, entry = item
+        r = stage.process_job(job, args)
+        metrics.record(stage_name, r)
+        if r['ok']: cache.record(*entry)
+        return r
+
+    profiler = metrics.start_profiler(args.profile)
+    try:
+        results = run_queued(queue, zip(keys, jobs, cache_entries), lambda item: item[0], process)
+    finally:
+        metrics.stop_profiler(profiler, args.output, stage_name)
+        queue.close()
+    counts = queue.status(keys)
+    print(f"Coda {args.queue}: {counts['done']} completati, {counts['failed']} falliti "
+          f"({len(results)} elaborati da questo worker)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fase 2 della pipeline da un manifest, senza GUI")
+    parser.add_argument('manifest', help="JSON salvato dalla fase 1 (manifest_*.json)")
+    parser.add_argument('--input', required=True, help="Cartella dei video di input su questa macchina")
+    parser.add_argument('--output', required=True, help="Cartella di output su questa macchina")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Video elaborati in parallelo (solo rotate)")
+    parser.add_argument('--chunks', type=int, default=1,
+                        help="Divide ogni video in N blocchi temporali elaborati in parallelo")
+    parser.add_argument('--checkpoint', type=int, default=CHECKPOINT_INTERVAL,
+                        help="Frame per segmento di checkpoint (crop, 0 = disattivato)")
+    parser.add_argument('--offload', action='store_true',
+                        help="Filtergraph ffmpeg invece del loop Python (rotate, crop_static)")
+    parser.add_argument('--profile', action='store_true',
+                        help="Profiler a campionamento (profilo salvato nella cartella di output)")
+    parser.add_argument('--crop-procs', type=int, default=0,
+                        help="Crop: divide crop ed encoder dei soggetti su N processi (memoria condivisa)")
+    parser.add_argument('--queue', help="Cartella condivisa della coda di lavoro tra più worker/macchine")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="Con --queue: rimette in coda i job falliti in esecuzioni precedenti")
+    args = parser.parse_args()
+
+    try:
+        manifest = read_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        sys.exit(f"ERRORE: manifest non valido: {e}")
+    if not os.path.isdir(args.input):
+        sys.exit(f"ERRORE: cartella di input inesistente: {args.input}")
+    if args.offload and not filtergraph.available():
+        print("ATTENZIONE: ffmpeg non trovato, --offload ignorato.")
+        args.offload = False
+    if args.queue and args.workers > 1:
+        print("ATTENZIONE: con --queue ogni processo elabora un job alla volta, avvia più processi per usare più core.")
+        args.workers = 1
+    if args.profile and (args.workers > 1 or args.chunks > 1):
+        print("ATTENZIONE: il profiler campiona solo questo processo, --workers/--chunks ignorati.")
+        args.workers = args.chunks = 1
+    script, input_attr, output_attr = STAGES[manifest['stage']]
+    stage = load_stage(script)
+    # Stesse impostazioni della sessione di setup, indipendentemente dai default locali
+    for name, value in manifest['settings'].items():
+        if not hasattr(stage, name):
+            print(f"ATTENZIONE: impostazione sconosciuta nel manifest ignorata: {name}")
+            continue
+        setattr(stage, name, value)
+    if args.offload and getattr(stage, 'MOTION_GATE', False):
+        print("ATTENZIONE: il filtergraph non scarta i frame fermi (MOTION_GATE), --offload ignorato.")
+        args.offload = False
+    if args.offload and args.chunks > 1:
+        print("ATTENZIONE: con --offload ogni video è un unico processo ffmpeg (già multi-thread), --chunks ignorato.")
+        args.chunks = 1
+    if getattr(stage, 'MOTION_GATE', False) and (args.chunks > 1 or args.checkpoint > 0):
+        # Ogni blocco / segmento ripartirebbe senza il frame di riferimento: selezione diversa dal video intero
+        print("ATTENZIONE: MOTION_GATE confronta ogni frame con l'ultimo tenuto, --chunks/--checkpoint ignorati.")
+        args.chunks, args.checkpoint = 1, 0
+    if args.crop_procs > 1 and (args.chunks > 1 or args.offload):
+        print("ATTENZIONE: --crop-procs non si combina con --chunks/--offload, ignorato.")
+        args.crop_procs = 0
+    setattr(stage, input_attr, args.input)
+    setattr(stage, output_attr, args.output)
+    os.makedirs(args.output, exist_ok=True)
+
+    missing = [e['file'] for e in manifest['jobs'] if not os.path.exists(os.path.join(args.input, e['file']))]
+    for f in missing:
+        print(f"ATTENZIONE: {f} non trovato in {args.input}, job saltato.")
+    entries = [e for e in manifest['jobs'] if e['file'] not in missing]
+
+    print(f"{manifest['stage']}: {len(entries)} job da {args.manifest} (creato {manifest.get('created')})")
+    if args.queue:
+        results = run_from_queue(stage, manifest['stage'], entries, args)
+    else:
+        results = stage.run_batch(stage.jobs_from_manifest(entries), args)
+    print_summary(results)
+    sys.exit(0 if not missing and all(r['ok'] for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()